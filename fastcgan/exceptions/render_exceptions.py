@@ -0,0 +1,5 @@
+class RenderQueueFullError(Exception):
+    def __init__(self, message: str = "Map rendering queue is full. Please try again later.", retry_after: int = 30) -> None:
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
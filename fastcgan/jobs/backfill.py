@@ -0,0 +1,334 @@
+import concurrent
+import json
+from argparse import ArgumentParser
+from collections.abc import Callable
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from os import getenv, getpid
+from pathlib import Path
+from time import monotonic, sleep, time
+
+from loguru import logger
+from show_forecasts.constants import COUNTRY_NAMES
+
+from fastcgan.jobs.cgan_ifs import get_cgan_ifs_source, get_cgan_inference_requests, migrate_cgan_ifs_file
+from fastcgan.jobs.counts import make_cgan_forecast_counts
+from fastcgan.jobs.data_sync import run_ecmwf_ifs_sync
+from fastcgan.jobs.icpac_ftp import sync_icpac_ifs_data
+from fastcgan.jobs.inference import get_inference_workers, run_cgan_inference
+from fastcgan.jobs.open_ifs import get_grib2_steps_cost, run_grib2_step_tasks
+from fastcgan.jobs.prerender import prerender_forecast_maps
+from fastcgan.jobs.sftp import sync_sftp_data_files
+from fastcgan.jobs.status import acquire_task_lease, get_job_cost, release_task_lease
+from fastcgan.jobs.utils import (
+    get_data_store_path,
+    get_gan_forecast_dates,
+    get_relevant_forecast_steps,
+    save_to_new_filesystem_structure,
+)
+
+BACKFILL_MODELS = ["open-ifs", "jurre-brishti-ens", "jurre-brishti-count", "mvua-kubwa-ens", "mvua-kubwa-count"]
+# stages of a forecast in execution order. ens forecasts are sliced and count forecasts are counted
+BACKFILL_STAGES = ["download", "convert", "generate", "slice", "counts", "prerender"]
+# (cpus, memory in GB) reserved by the stages that do not run a source's own processing
+BACKFILL_STAGE_COSTS = {"slice": (4, 8), "counts": (4, 8), "prerender": (2, 4)}
+
+
+def get_node_key(stage: str, model: str, data_date: date) -> str:
+    return f"{stage}:{model}:{data_date.strftime('%Y%m%d')}"
+
+
+def parse_node_key(key: str) -> tuple[str, str, str]:
+    stage, model, date_str = key.split(":")
+    return stage, model, date_str
+
+
+def build_backfill_graph(models: list[str], start_date: date, end_date: date) -> dict[str, list[str]]:
+    """Map every backfill task to the tasks it depends on.
+
+    Each forecast date goes through download -> convert for its source data and, for cGAN models,
+    generate -> slice|counts -> prerender. cGAN models of the same IFS source share its download and
+    convert tasks.
+    """
+    graph: dict[str, list[str]] = {}
+    data_date = start_date
+    while data_date <= end_date:
+        for model in models:
+            source = model if model == "open-ifs" else get_cgan_ifs_source(model)
+            download = get_node_key("download", source, data_date)
+            convert = get_node_key("convert", source, data_date)
+            graph[download] = []
+            graph[convert] = [download]
+            if model == "open-ifs":
+                continue
+            generate = get_node_key("generate", model, data_date)
+            store = get_node_key("counts" if "count" in model else "slice", model, data_date)
+            graph[generate] = [convert]
+            graph[store] = [generate]
+            graph[get_node_key("prerender", model, data_date)] = [store]
+        data_date += timedelta(days=1)
+    return graph
+
+
+def get_forecast_dates(source: str, date_str: str) -> list[str]:
+    # YYYYMMDD_HH forecast dates of a source initialized on date_str
+    return sorted(value for value in get_gan_forecast_dates(source=source, mask_region=None) if value.startswith(date_str))
+
+
+def download_forecast_inputs(source: str, date_str: str) -> None:
+    if source == "open-ifs":
+        if getenv("USE_ICPAC_IFS", "false").lower() in ["yes", "y", "true", "t", "1"]:
+            sync_icpac_ifs_data(model="open-ifs", date_str=date_str)
+        elif run_ecmwf_ifs_sync(data_date=datetime.strptime(date_str, "%Y%m%d").date()) is None:
+            raise RuntimeError(f"open-ifs forecast data for {date_str} is not available")
+    elif (
+        getenv("IFS_SERVER_HOST", "domain.example") == "domain.example"
+        or getenv("IFS_SERVER_USER", "username") == "username"
+        or getenv("IFS_PRIVATE_KEY", None) is None
+    ):
+        sync_icpac_ifs_data(model="jurre-brishti-ens" if source == "cgan-ifs-6h-ens" else "mvua-kubwa-ens", date_str=date_str)
+    else:
+        sync_sftp_data_files(model=source, date_str=date_str)
+
+
+def convert_forecast_inputs(source: str, date_str: str, country_names: list[str]) -> None:
+    # ICPAC files are downloaded straight into the data store and need no conversion
+    downloads_path = get_data_store_path(source="jobs") / source
+    if not downloads_path.exists():
+        return None
+    if source == "open-ifs":
+        grib2_files = sorted(grib2_file.name for grib2_file in downloads_path.glob(f"{date_str}*.grib2"))
+        if len(grib2_files):
+            run_grib2_step_tasks(
+                grib2_files=grib2_files,
+                source=source,
+                force_process=True,
+                max_workers=get_grib2_steps_cost(source=source, steps=len(grib2_files))[0],
+                country_names=country_names,
+            )
+    else:
+        for gbmc_file in sorted(downloads_path.glob(f"*{date_str}_*.nc")):
+            migrate_cgan_ifs_file(gbmc_file=gbmc_file, source_model=source, country_names=country_names)
+
+
+def generate_forecasts(model: str, date_str: str, force: bool) -> None:
+    ifs_dates = get_forecast_dates(source=get_cgan_ifs_source(model), date_str=date_str)
+    gan_dates = [] if force else get_forecast_dates(source=model, date_str=date_str)
+    missing_dates = [value for value in ifs_dates if value not in gan_dates]
+    if not len(ifs_dates):
+        raise RuntimeError(f"no IFS forecasts available for {model} on {date_str}")
+    gan_requests = get_cgan_inference_requests(model=model, missing_dates=missing_dates)
+    with closing(run_cgan_inference(model=model, ifs_files=list(gan_requests.keys()))) as gan_results:
+        failed = [gan_requests[ifs_file][0] for ifs_file, status in gan_results if status]
+    if len(failed):
+        raise RuntimeError(f"{model} cGAN inference failed for {', '.join(failed)}")
+
+
+def store_forecasts(model: str, date_str: str, country_names: list[str]) -> None:
+    for gan_file in sorted((get_data_store_path(source="jobs") / model).glob(f"GAN_{date_str}_*.nc")):
+        if "count" in model:
+            if not make_cgan_forecast_counts(date_str=date_str, hour_str=gan_file.stem.split("_")[-1].replace("Z", ""), model_name=model):
+                raise RuntimeError(f"failed to compute the {model} counts of {gan_file.name}")
+        else:
+            save_to_new_filesystem_structure(file_path=gan_file, source=model, part_to_replace="GAN_", country_names=country_names)
+
+
+def prerender_forecasts(model: str, date_str: str) -> None:
+    for forecast_date in get_forecast_dates(source=model, date_str=date_str):
+        prerender_forecast_maps(model=model, data_date=datetime.strptime(date_str, "%Y%m%d"), init_time=forecast_date.split("_")[-1])
+
+
+def get_stage_cost(stage: str, model: str) -> tuple[float, float] | None:
+    if stage == "download":
+        return None
+    if stage == "generate":
+        # each inference worker holds its own copy of the model
+        cpus, memory = get_job_cost(model)
+        workers = max(get_inference_workers(), 1)
+        return cpus * workers, memory * workers
+    if stage == "convert" and model == "open-ifs":
+        return get_grib2_steps_cost(source=model, steps=len(get_relevant_forecast_steps()))[1]
+    return get_job_cost(model) if stage == "convert" else BACKFILL_STAGE_COSTS[stage]
+
+
+def get_stage_lease(stage: str, model: str, key: str) -> tuple[str, str]:
+    # (sync_type, source) of the lease held by a task. downloads and forecasts of a date are held under a scope of
+    # the source lease, which excludes the scheduled jobs of the source but not the backfill tasks of other dates
+    _, _, date_str = parse_node_key(key)
+    if stage == "prerender":
+        return "processing", f"backfill:{key}"
+    if stage == "download":
+        # the scheduled downloads of cGAN IFS sources are leased by their ens model
+        source = {"cgan-ifs-6h-ens": "jurre-brishti-ens", "cgan-ifs-7d-ens": "mvua-kubwa-ens"}.get(model, model)
+        return "download", f"{source}:{date_str}"
+    return "processing", f"{model}:{date_str}"
+
+
+def check_stage_outputs(stage: str, model: str, date_str: str) -> None:
+    # a task is only checkpointed once the forecasts of its date are available. scheduled jobs may have produced them first
+    if stage == "prerender":
+        return None
+    available = len(get_forecast_dates(source=model, date_str=date_str)) > 0
+    if not available and stage in ["download", "generate"]:
+        jobs_path = get_data_store_path(source="jobs") / model
+        pattern = {"download": f"{date_str}*.grib2" if model == "open-ifs" else f"*{date_str}_*.nc", "generate": f"GAN_{date_str}_*.nc"}[stage]
+        available = jobs_path.exists() and any(jobs_path.glob(pattern))
+    if not available:
+        raise RuntimeError(f"backfill task {stage}:{model}:{date_str} produced no forecasts")
+
+
+def run_backfill_task(key: str, country_names: list[str], force: bool, poll_interval: float = 15) -> None:
+    stage, model, date_str = parse_node_key(key)
+    sync_type, lease_source = get_stage_lease(stage, model, key)
+    # tasks share the resource limits of the machine with the scheduled jobs
+    cost = get_stage_cost(stage, model)
+    while not acquire_task_lease(sync_type=sync_type, source=lease_source, cost=cost):
+        sleep(poll_interval)
+    start = monotonic()
+    try:
+        if stage == "download":
+            download_forecast_inputs(source=model, date_str=date_str)
+        elif stage == "convert":
+            convert_forecast_inputs(source=model, date_str=date_str, country_names=country_names)
+        elif stage == "generate":
+            generate_forecasts(model=model, date_str=date_str, force=force)
+        elif stage in ["slice", "counts"]:
+            store_forecasts(model=model, date_str=date_str, country_names=country_names)
+        else:
+            prerender_forecasts(model=model, date_str=date_str)
+        check_stage_outputs(stage=stage, model=model, date_str=date_str)
+    finally:
+        release_task_lease(sync_type=sync_type, source=lease_source)
+    logger.debug(f"backfill task {key} completed in {round(monotonic() - start, 2)}s")
+
+
+def get_checkpoint_file(run_name: str) -> Path:
+    return get_data_store_path(source="jobs") / "backfill" / f"{run_name}.json"
+
+
+def load_checkpoint(checkpoint_file: Path) -> set[str]:
+    if not checkpoint_file.exists():
+        return set()
+    try:
+        with checkpoint_file.open("r") as f:
+            return set(json.load(f)["completed"])
+    except Exception as err:
+        logger.warning(f"failed to read backfill checkpoint {checkpoint_file} with error {err}. starting over")
+        return set()
+
+
+def save_checkpoint(checkpoint_file: Path, completed: set[str]) -> None:
+    if not checkpoint_file.parent.exists():
+        checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = checkpoint_file.with_name(f".{checkpoint_file.name}.{getpid()}")
+    with tmp_file.open("w") as f:
+        json.dump({"completed": sorted(completed), "updated_at": time()}, f)
+    tmp_file.replace(checkpoint_file)
+
+
+def run_backfill_graph(
+    graph: dict[str, list[str]],
+    run_task: Callable[[str], None],
+    checkpoint_file: Path,
+    max_workers: int,
+) -> tuple[int, int]:
+    """Run the tasks of `graph` on `max_workers` workers as soon as their dependencies complete.
+
+    Completed tasks are recorded in `checkpoint_file` and skipped when the backfill is resumed. Tasks of
+    a failed task are skipped. Returns the number of completed and failed forecasts, which are the tasks
+    no other task depends on.
+    """
+    completed = load_checkpoint(checkpoint_file) & set(graph)
+    final_tasks = set(graph) - {dep for deps in graph.values() for dep in deps}
+    pending = set(graph) - completed
+    failed: set[str] = set()
+    resumed = len(final_tasks & completed)
+    logger.info(f"running {len(pending)} of {len(graph)} backfill tasks for {len(final_tasks)} forecasts. {resumed} forecasts already completed")
+    start = monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running: dict[concurrent.futures.Future, str] = {}
+        while True:
+            while len(skipped := [key for key in pending if any(dep in failed for dep in graph[key])]):
+                logger.warning(f"backfill tasks {', '.join(sorted(skipped))} skipped due to failed dependencies")
+                pending.difference_update(skipped)
+                failed.update(skipped)
+            # later stages first, so that forecasts complete early instead of every stage completing at the end
+            ready = [key for key in pending if all(dep in completed for dep in graph[key])]
+            for key in sorted(ready, key=lambda task: (-BACKFILL_STAGES.index(parse_node_key(task)[0]), task)):
+                pending.remove(key)
+                running[executor.submit(run_task, key)] = key
+            if not len(running):
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    future.result()
+                except Exception as err:
+                    logger.error(f"backfill task {key} failed with error {err}")
+                    failed.add(key)
+                    continue
+                completed.add(key)
+                save_checkpoint(checkpoint_file, completed)
+                if key in final_tasks:
+                    forecasts = len(final_tasks & completed)
+                    hours = (monotonic() - start) / 3600
+                    logger.info(
+                        f"completed {forecasts} of {len(final_tasks)} backfill forecasts. "
+                        + f"throughput of {(forecasts - resumed) / max(hours, 1e-6):.1f} forecasts/hour"
+                    )
+    hours = (monotonic() - start) / 3600
+    logger.info(
+        f"backfill completed {len(final_tasks & completed)} and failed {len(final_tasks & failed)} forecasts in {hours:.2f} hours. "
+        + f"throughput of {(len(final_tasks & completed) - resumed) / max(hours, 1e-6):.1f} forecasts/hour"
+    )
+    return len(final_tasks & completed), len(final_tasks & failed)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="backfill",
+        description="a program for re-generating historical forecasts over a date range",
+        usage="python backfill.py -s <YYYY-MM-DD> -e <YYYY-MM-DD> -m <model>,<model> -r <country>,<country>",
+    )
+    parser.add_argument("-s", "--start", dest="start", type=str, required=True, help="first forecast date as YYYY-MM-DD")
+    parser.add_argument("-e", "--end", dest="end", type=str, default=None, help="last forecast date as YYYY-MM-DD. defaults to the start date")
+    parser.add_argument(
+        "-m",
+        "--models",
+        dest="models",
+        type=str,
+        default=",".join(BACKFILL_MODELS),
+        help=f"forecast models separated by comma. options are {','.join(BACKFILL_MODELS)}",
+    )
+    parser.add_argument(
+        "-r",
+        "--regions",
+        dest="regions",
+        type=str,
+        default=None,
+        help="countries to save forecast slices for separated by comma. defaults to all countries",
+    )
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=int(getenv("BACKFILL_WORKERS", 4)), help="number of concurrent tasks")
+    parser.add_argument("-n", "--name", dest="name", type=str, default=None, help="backfill run name used for checkpointing")
+    parser.add_argument("-f", "--force", dest="force", action="store_true", help="re-generate cGAN forecasts that already exist")
+    parser.add_argument("--restart", dest="restart", action="store_true", help="ignore the checkpoint of a previous run")
+    args = parser.parse_args()
+    start_date = datetime.strptime(args.start, "%Y-%m-%d").date()
+    end_date = start_date if args.end is None else datetime.strptime(args.end, "%Y-%m-%d").date()
+    models = args.models.split(",")
+    if len(invalid := [model for model in models if model not in BACKFILL_MODELS]):
+        parser.error(f"invalid models {', '.join(invalid)}")
+    country_names = COUNTRY_NAMES[1:] if args.regions is None else args.regions.split(",")
+    if len(invalid := [country for country in country_names if country not in COUNTRY_NAMES[1:]]):
+        parser.error(f"invalid regions {', '.join(invalid)}")
+    run_name = args.name if args.name is not None else f"{'-'.join(sorted(models))}-{start_date:%Y%m%d}-{end_date:%Y%m%d}"
+    checkpoint_file = get_checkpoint_file(run_name)
+    if args.restart:
+        checkpoint_file.unlink(missing_ok=True)
+    run_backfill_graph(
+        graph=build_backfill_graph(models=models, start_date=start_date, end_date=end_date),
+        run_task=lambda key: run_backfill_task(key=key, country_names=country_names, force=args.force),
+        checkpoint_file=checkpoint_file,
+        max_workers=args.workers,
+    )
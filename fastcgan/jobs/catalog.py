@@ -0,0 +1,255 @@
+import os
+import re
+import sqlite3
+import threading
+from argparse import ArgumentParser
+from collections.abc import Iterable
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+from fastcgan.tools.config import settings
+
+# forecast file naming patterns used across the data store
+COUNTS_FILE_PTN = re.compile(r"^counts_([0-9]{8})_([0-9]{2})_([0-9]{1,3})h\.nc$")
+ENS_FILE_PTN = re.compile(r"^[a-z_]*-[a-z0-9_]+-([0-9]{8})_([0-9]{2})Z\.nc$")
+OPEN_IFS_FILE_PTN = re.compile(r"^[a-z_]*-open_ifs-([0-9]{8})([0-9]{2})0000-([0-9]{1,3})h-[a-z]+-[a-z]+\.nc$")
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecast_files (
+    file_path TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    mask_region TEXT,
+    init_date TEXT NOT NULL,
+    init_time INTEGER,
+    valid_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS forecast_files_lookup
+    ON forecast_files (source, mask_region, init_date, init_time, valid_time);
+CREATE INDEX IF NOT EXISTS forecast_files_dates
+    ON forecast_files (source, init_date, init_time, valid_time);
+CREATE TABLE IF NOT EXISTS indexed_sources (
+    source TEXT PRIMARY KEY,
+    indexed_at TEXT NOT NULL
+);
+"""
+
+
+# catalog files whose schema was created by this process
+initialized_catalogs: set[str] = set()
+initialized_catalogs_lock = threading.Lock()
+
+
+def init_catalog(catalog_file: Path) -> None:
+    with initialized_catalogs_lock:
+        if str(catalog_file) in initialized_catalogs:
+            return None
+        if not catalog_file.parent.exists():
+            catalog_file.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(catalog_file, timeout=30)) as conn:
+            # WAL lets the API read while ingest jobs in other containers write. the journal mode is kept in the file
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(CATALOG_SCHEMA)
+        initialized_catalogs.add(str(catalog_file))
+
+
+def get_catalog_connection() -> sqlite3.Connection:
+    catalog_file = Path(settings.FORECASTS_CATALOG_FILE)
+    init_catalog(catalog_file)
+    conn = sqlite3.connect(catalog_file, timeout=30)
+    # synchronous is a setting of the connection
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def parse_forecast_file_name(file_name: str) -> tuple[str, int | None, int | None] | None:
+    if (match := COUNTS_FILE_PTN.match(file_name)) is not None:
+        return match.group(1), int(match.group(2)), int(match.group(3))
+    if (match := OPEN_IFS_FILE_PTN.match(file_name)) is not None:
+        return match.group(1), int(match.group(2)), int(match.group(3))
+    if (match := ENS_FILE_PTN.match(file_name)) is not None:
+        return match.group(1), int(match.group(2)), None
+    return None
+
+
+def _make_catalog_entry(file_path: Path, source: str) -> tuple | None:
+    meta = parse_forecast_file_name(file_path.name)
+    if meta is None:
+        return None
+    source_dir = Path(settings.ASSETS_DIR_MAP["forecasts"]) / source
+    try:
+        rel_parts = file_path.absolute().relative_to(source_dir.absolute()).parts
+    except ValueError:
+        logger.warning(f"{file_path} is not within {source} data store and will not be catalogued")
+        return None
+    # files are stored as <source>/[<mask_region>/]<year>/<month>/<file_name>
+    mask_region = rel_parts[0] if len(rel_parts) > 3 else None
+    return (str(file_path.absolute()), file_path.name, source, mask_region, *meta)
+
+
+def _make_catalog_entries(file_paths: Iterable[Path], source: str) -> list[tuple]:
+    return [entry for entry in (_make_catalog_entry(Path(fpath), source) for fpath in file_paths) if entry is not None]
+
+
+def _insert_catalog_entries(conn: sqlite3.Connection, entries: list[tuple]) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO forecast_files "
+        + "(file_path, file_name, source, mask_region, init_date, init_time, valid_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        entries,
+    )
+
+
+def register_forecast_files(file_paths: Iterable[Path], source: str) -> int:
+    entries = _make_catalog_entries(file_paths, source=source)
+    if not len(entries):
+        return 0
+    try:
+        with closing(get_catalog_connection()) as conn, conn:
+            _insert_catalog_entries(conn, entries)
+    except sqlite3.Error as err:
+        logger.error(f"failed to register {len(entries)} {source} files into forecasts catalog with error {err}")
+        return 0
+    return len(entries)
+
+
+def register_forecast_file(file_path: Path, source: str) -> bool:
+    return bool(register_forecast_files([file_path], source=source))
+
+
+def unregister_forecast_files(file_paths: Iterable[Path]) -> None:
+    paths = [(str(Path(fpath).absolute()),) for fpath in file_paths]
+    if not len(paths):
+        return None
+    try:
+        with closing(get_catalog_connection()) as conn, conn:
+            conn.executemany("DELETE FROM forecast_files WHERE file_path = ?", paths)
+    except sqlite3.Error as err:
+        logger.error(f"failed to remove {len(paths)} files from forecasts catalog with error {err}")
+
+
+def is_source_indexed(conn: sqlite3.Connection, source: str) -> bool:
+    return conn.execute("SELECT 1 FROM indexed_sources WHERE source = ?", (source,)).fetchone() is not None
+
+
+def index_source_files(source: str, force: bool = True) -> int:
+    """Rebuild the catalog entries of `source` from its data store and return the number of indexed files.
+
+    The entries are replaced in a single transaction, so readers never see a partial catalog of the source.
+    Without `force` nothing is done when another process indexed the source first.
+    """
+    source_dir = Path(settings.ASSETS_DIR_MAP["forecasts"]) / source
+    data_files = []
+    if source_dir.exists():
+        for root, _, files in os.walk(source_dir):
+            data_files.extend([Path(root) / fname for fname in files if fname.endswith(".nc")])
+    entries = _make_catalog_entries(data_files, source=source)
+    with closing(get_catalog_connection()) as conn:
+        # take the write lock before checking, so that concurrent first queries index the source once
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not force and is_source_indexed(conn, source=source):
+                conn.rollback()
+                return 0
+            logger.info(f"indexing {len(entries)} {source} data files into forecasts catalog")
+            conn.execute("DELETE FROM forecast_files WHERE source = ?", (source,))
+            _insert_catalog_entries(conn, entries)
+            conn.execute(
+                "INSERT OR REPLACE INTO indexed_sources (source, indexed_at) VALUES (?, ?)",
+                (source, datetime.now().isoformat()),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(entries)
+
+
+def ensure_source_indexed(source: str) -> None:
+    # build the catalog from the filesystem the first time a source is queried
+    with closing(get_catalog_connection()) as conn:
+        indexed = is_source_indexed(conn, source=source)
+    if not indexed:
+        index_source_files(source=source, force=False)
+
+
+def _query_catalog(query: str, source: str, mask_region: str | None = None, filters: str = "", params: tuple = (), suffix: str = "") -> list[tuple]:
+    ensure_source_indexed(source=source)
+    conditions = "WHERE source = ?"
+    values: tuple = (source,)
+    if mask_region is not None:
+        conditions += " AND mask_region = ?"
+        values += (mask_region,)
+    with closing(get_catalog_connection()) as conn:
+        return conn.execute(f"{query} {conditions} {filters} {suffix}", values + params).fetchall()
+
+
+def get_catalog_file_names(source: str, mask_region: str | None = None) -> list[str]:
+    return [row[0] for row in _query_catalog("SELECT file_name FROM forecast_files", source=source, mask_region=mask_region)]
+
+
+def get_catalog_init_dates(source: str, mask_region: str | None = None) -> list[str]:
+    rows = _query_catalog(
+        "SELECT DISTINCT init_date FROM forecast_files",
+        source=source,
+        mask_region=mask_region,
+        suffix="ORDER BY init_date DESC",
+    )
+    return [row[0] for row in rows]
+
+
+def get_catalog_complete_init_dates(source: str, valid_times: list[int], mask_region: str | None = None) -> list[str]:
+    # init dates for which every one of the valid times is available
+    rows = _query_catalog(
+        "SELECT init_date FROM forecast_files",
+        source=source,
+        mask_region=mask_region,
+        filters=f"AND valid_time IN ({','.join('?' * len(valid_times))})",
+        params=tuple(valid_times),
+        suffix=f"GROUP BY init_date HAVING COUNT(DISTINCT valid_time) = {len(set(valid_times))} ORDER BY init_date DESC",
+    )
+    return [row[0] for row in rows]
+
+
+def get_catalog_init_times(source: str, init_date: str, mask_region: str | None = None) -> list[int]:
+    rows = _query_catalog(
+        "SELECT DISTINCT init_time FROM forecast_files",
+        source=source,
+        mask_region=mask_region,
+        filters="AND init_date = ? AND init_time IS NOT NULL",
+        params=(init_date,),
+        suffix="ORDER BY init_time",
+    )
+    return [row[0] for row in rows]
+
+
+def get_catalog_forecasts(source: str, mask_region: str | None = None) -> list[tuple[str, int | None, int | None]]:
+    return _query_catalog(
+        "SELECT DISTINCT init_date, init_time, valid_time FROM forecast_files",
+        source=source,
+        mask_region=mask_region,
+        suffix="ORDER BY init_date DESC, valid_time DESC, init_time DESC",
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="forecasts-catalog",
+        description="a program for re-building the forecast files catalog from the data store",
+        usage="python catalog.py -s <source>,<source>",
+    )
+    parser.add_argument(
+        "-s",
+        "--sources",
+        dest="sources",
+        type=str,
+        default=None,
+        help="a list of data sources separated by comma. defaults to all sources in the data store",
+    )
+    args = parser.parse_args()
+    forecasts_dir = Path(settings.ASSETS_DIR_MAP["forecasts"])
+    sources = [src.name for src in forecasts_dir.iterdir() if src.is_dir()] if args.sources is None else args.sources.split(",")
+    for source in sources:
+        logger.info(f"indexed {index_source_files(source=source)} {source} data files")
@@ -1,7 +1,8 @@
-import subprocess
 from argparse import ArgumentParser
+from contextlib import closing
 from datetime import datetime
 from os import getenv
+from pathlib import Path
 from time import sleep
 
 import schedule
@@ -10,150 +11,201 @@ from show_forecasts.constants import COUNTRY_NAMES
 
 from fastcgan.jobs.counts import make_cgan_forecast_counts
 from fastcgan.jobs.icpac_ftp import sync_icpac_ifs_data
+from fastcgan.jobs.inference import get_inference_workers, run_cgan_inference
+from fastcgan.jobs.pipeline import enqueue_forecast_generation, enqueue_task, run_job_worker, use_job_queue
+from fastcgan.jobs.prerender import prerender_forecast_maps
 from fastcgan.jobs.sftp import sync_sftp_data_files
+from fastcgan.jobs.status import acquire_task_lease, get_job_cost, release_task_lease
 from fastcgan.jobs.stubs import cgan_model_literal
 from fastcgan.jobs.utils import (
     get_data_store_path,
-    get_data_sycn_status,
     get_dataset_file_path,
     get_gan_forecast_dates,
-    get_processing_task_status,
     migrate_files,
+    reset_data_sycn_status,
     save_to_new_filesystem_structure,
-    set_data_sycn_status,
 )
 
 
+def get_cgan_ifs_source(model: cgan_model_literal) -> str:
+    return "cgan-ifs-7d-ens" if "mvua-kubwa" in model else "cgan-ifs-6h-ens"
+
+
+def get_cgan_inference_requests(
+    model: cgan_model_literal,
+    missing_dates: list[str],
+    mask_region: str | None = COUNTRY_NAMES[0],
+) -> dict[str, tuple[str, Path]]:
+    # maps the IFS file passed to the forecast script to its forecast date and IFS store file
+    gbmc_source = get_cgan_ifs_source(model)
+    store_path = get_data_store_path(source=gbmc_source, mask_region=mask_region)
+    gan_requests = {}
+    for missing_date in missing_dates:
+        date_str, init_time = missing_date.split("_")
+        data_date = datetime.strptime(date_str, "%Y%m%d")
+        gbmc_filename = get_dataset_file_path(
+            source=gbmc_source,
+            data_date=data_date,
+            file_name=f"{data_date.strftime('%Y%m%d')}_{init_time}Z.nc",
+            mask_region=mask_region,
+        )
+        gan_requests[str(gbmc_filename).replace(f"{store_path}/", "")] = (missing_date, gbmc_filename)
+    return gan_requests
+
+
+def migrate_cgan_ifs_file(gbmc_file: Path, source_model: str, country_names: list[str] = COUNTRY_NAMES[1:]) -> None:
+    save_to_new_filesystem_structure(
+        file_path=gbmc_file,
+        source=source_model,
+        part_to_replace=(
+            "IFS_"
+            if "IFS_" in gbmc_file.name
+            else f"east_africa-{source_model.replace('-','_')}-"
+        ),
+        country_names=country_names,
+    )
+
+
 def generate_cgan_forecasts(
     model: cgan_model_literal,
     mask_region: str | None = COUNTRY_NAMES[0],
     min_gbmc_size: int | None = 40,
-):
-    # start an infinite loop that will execute when other data-processing jobs are completed
+    wait: bool | None = True,
+) -> bool:
+    # start an infinite loop that will execute when the machine has room for the model inference.
+    # returns False without waiting when the resources are in use and wait is False
     while True:
-        if not get_processing_task_status():
+        # reserve the cpus and memory of the job atomically. other jobs keep running alongside it within the machine limits.
+        # each inference worker holds its own copy of the model
+        cpus, memory = get_job_cost(model)
+        workers = max(get_inference_workers(), 1)
+        if acquire_task_lease(sync_type="processing", source=model, cost=(cpus * workers, memory * workers)):
             logger.debug(f"starting cGAN forecast generation for {model} model")
-            set_data_sycn_status(source=model, sync_type="processing", status=True)
-            gbmc_source = (
-                "cgan-ifs-7d-ens" if "mvua-kubwa" in model else "cgan-ifs-6h-ens"
-            )
-            ifs_dates = sorted(
-                get_gan_forecast_dates(mask_region=None, source=gbmc_source),
-                reverse=True,
-            )
-            gan_dates = get_gan_forecast_dates(
-                mask_region=None if "count" in model else mask_region, source=model
-            )
-            missing_dates = [
-                data_date
-                for data_date in ifs_dates
-                if data_date not in gan_dates and int(data_date[:4]) > 2018
-            ]
-            logger.debug(
-                f"launching forecast generation workers for data dates {' ==> '.join(missing_dates)}"
-            )
-            for missing_date in missing_dates:
-                logger.info(f"generating {model} cGAN forecast for {missing_date}")
-                date_str, init_time = missing_date.split("_")
-                # generate forecast for date
-                data_date = datetime.strptime(date_str, "%Y%m%d")
-                gbmc_filename = get_dataset_file_path(
-                    source=gbmc_source,
-                    data_date=data_date,
-                    file_name=f"{data_date.strftime('%Y%m%d')}_{init_time}Z.nc",
-                    mask_region=mask_region,
+            try:
+                gbmc_source = get_cgan_ifs_source(model)
+                ifs_dates = sorted(
+                    get_gan_forecast_dates(mask_region=None, source=gbmc_source),
+                    reverse=True,
                 )
-                store_path = get_data_store_path(
-                    source=gbmc_source, mask_region=mask_region
+                gan_dates = get_gan_forecast_dates(
+                    mask_region=None if "count" in model else mask_region, source=model
                 )
-                gan_ifs = str(gbmc_filename).replace(f"{store_path}/", "")
+                missing_dates = [
+                    data_date
+                    for data_date in ifs_dates
+                    if data_date not in gan_dates and int(data_date[:4]) > 2018
+                ]
+                if "count" in model:
+                    # forecasts kept by counts that failed before are counted again instead of running their inference again.
+                    # a forecast that fails again is removed, so that its date is generated again
+                    kept_dates = [
+                        value for value in missing_dates if (get_data_store_path(source="jobs") / model / f"GAN_{value}Z.nc").exists()
+                    ]
+                    for kept_date in kept_dates:
+                        date_str, init_time = kept_date.split("_")
+                        if make_cgan_forecast_counts(date_str=date_str, hour_str=init_time, model_name=model):
+                            prerender_forecast_maps(model=model, data_date=datetime.strptime(date_str, "%Y%m%d"), init_time=init_time)
+                        else:
+                            (get_data_store_path(source="jobs") / model / f"GAN_{kept_date}Z.nc").unlink(missing_ok=True)
+                    missing_dates = [value for value in missing_dates if value not in kept_dates]
                 logger.debug(
-                    f"starting {model} forecast generation with IFS file {gan_ifs}"
+                    f"launching forecast generation workers for data dates {' ==> '.join(missing_dates)}"
                 )
-                py_script = (
-                    "forecast_date.py" if "mvua-kubwa" in model else "test_forecast.py"
+                gan_requests = get_cgan_inference_requests(
+                    model=model, missing_dates=missing_dates, mask_region=mask_region
                 )
-                model_dir = "Mvua_Kubwa" if 'mvua-kubwa' in model else "Jurre_Brishti"
-                gan_status = subprocess.call(
-                    shell=True,
-                    cwd=f'{getenv("WORK_HOME","/opt/cgan")}/{model_dir}/ensemble-cgan/dsrnngan',
-                    args=f"python {py_script} -f {gan_ifs}",
-                )
-                cgan_file_path = (
-                    get_data_store_path(source="jobs")
-                    / model
-                    / f"GAN_{date_str}_{init_time}Z.nc"
-                )
-                if gan_status:
-                    logger.error(
-                        f"failed to generate {model} cGAN forecast for {missing_date}. deleting intermediary forecast file {cgan_file_path}"
-                    )
-                    cgan_file_path.unlink(missing_ok=True)
-                    if gbmc_filename.stat().st_size / (1024 * 1024) < min_gbmc_size:
-                        logger.error(
-                            f"deleting intermediarty IFS file {gbmc_filename} due "
-                            + f"to invalid size of {round(gbmc_filename.stat().st_size / (1024 * 1024), 2)} Mib"
-                        )
-                        gbmc_filename.unlink(missing_ok=True)
-                else:
-                    if "count" in model:
-                        make_cgan_forecast_counts(
-                            date_str=date_str,
-                            hour_str=init_time,
-                            model_name=model,
-                        )
-                    else:
-                        save_to_new_filesystem_structure(
-                            file_path=cgan_file_path,
-                            source=model,
-                            part_to_replace="GAN_",
+                # forecasts are post-processed as soon as their inference completes while the workers take on the next dates
+                # the workers are stopped before the lease is released, also when post-processing fails
+                with closing(run_cgan_inference(model=model, ifs_files=list(gan_requests.keys()))) as gan_results:
+                    for gan_ifs, gan_status in gan_results:
+                        missing_date, gbmc_filename = gan_requests[gan_ifs]
+                        date_str, init_time = missing_date.split("_")
+                        data_date = datetime.strptime(date_str, "%Y%m%d")
+                        cgan_file_path = (
+                            get_data_store_path(source="jobs")
+                            / model
+                            / f"GAN_{date_str}_{init_time}Z.nc"
                         )
-            set_data_sycn_status(source=model, sync_type="processing", status=False)
-            # break the infinite loop
-            break
+                        if gan_status:
+                            logger.error(
+                                f"failed to generate {model} cGAN forecast for {missing_date}. deleting intermediary forecast file {cgan_file_path}"
+                            )
+                            cgan_file_path.unlink(missing_ok=True)
+                            if gbmc_filename.stat().st_size / (1024 * 1024) < min_gbmc_size:
+                                logger.error(
+                                    f"deleting intermediarty IFS file {gbmc_filename} due "
+                                    + f"to invalid size of {round(gbmc_filename.stat().st_size / (1024 * 1024), 2)} Mib"
+                                )
+                                gbmc_filename.unlink(missing_ok=True)
+                        else:
+                            logger.info(f"generated {model} cGAN forecast for {missing_date}")
+                            if "count" in model:
+                                make_cgan_forecast_counts(
+                                    date_str=date_str,
+                                    hour_str=init_time,
+                                    model_name=model,
+                                )
+                            else:
+                                save_to_new_filesystem_structure(
+                                    file_path=cgan_file_path,
+                                    source=model,
+                                    part_to_replace="GAN_",
+                                )
+                            prerender_forecast_maps(
+                                model=model, data_date=data_date, init_time=init_time
+                            )
+            finally:
+                release_task_lease(sync_type="processing", source=model)
+            return True
+        if not wait:
+            return False
         # sleep for 10 minutes
         sleep(10 * 60)
 
 
-def post_process_downloaded_cgan_ifs(model: cgan_model_literal):
-    # start an infinite loop that is executed when there are no other jobs running
+def post_process_downloaded_cgan_ifs(model: cgan_model_literal, wait: bool | None = True) -> bool:
+    # start an infinite loop that is executed when the machine has room for the post-processing
     # TODO: split tasks to coiled clusters
+    source_model = (
+        "cgan-ifs-6h-ens" if "jurre-brishti" in model else "cgan-ifs-7d-ens"
+    )
     while True:
-        if not get_processing_task_status():
-            source_model = (
-                "cgan-ifs-6h-ens" if "jurre-brishti" in model else "cgan-ifs-7d-ens"
-            )
-            downloads_path = get_data_store_path(source="jobs") / source_model
-            if downloads_path.exists():
-                gbmc_files = [
-                    file_path
-                    for file_path in downloads_path.iterdir()
-                    if file_path.name.endswith(".nc")
-                ]
-                if not len(gbmc_files):
-                    logger.warning(
-                        f"no un-processed {source_model} datasets found. task skipped!"
-                    )
-                else:
-                    logger.info(
-                        f"starting {source_model} forecasts batch post-processing task for "
-                        + f"{'  <---->  '.join([gbmc_file.name for gbmc_file in gbmc_files])}"
-                    )
-                    for gbmc_file in gbmc_files:
-                        save_to_new_filesystem_structure(
-                            file_path=gbmc_file,
-                            source=source_model,
-                            part_to_replace=(
-                                "IFS_"
-                                if "IFS_" in gbmc_file.name
-                                else f"east_africa-{source_model.replace('-','_')}-"
-                            ),
+        # the downloads of a source are shared by its ens and count jobs. only one of them processes them
+        if acquire_task_lease(sync_type="processing", source=source_model, cost=get_job_cost(source_model)):
+            try:
+                downloads_path = get_data_store_path(source="jobs") / source_model
+                if downloads_path.exists():
+                    gbmc_files = [
+                        file_path
+                        for file_path in downloads_path.iterdir()
+                        if file_path.name.endswith(".nc")
+                    ]
+                    if not len(gbmc_files):
+                        logger.warning(
+                            f"no un-processed {source_model} datasets found. task skipped!"
+                        )
+                    else:
+                        logger.info(
+                            f"starting {source_model} forecasts batch post-processing task for "
+                            + f"{'  <---->  '.join([gbmc_file.name for gbmc_file in gbmc_files])}"
                         )
-                # purge invalid files
-                for file_path in downloads_path.iterdir():
-                    file_path.unlink(missing_ok=True)
-            # break the loop
-            break
+                        for gbmc_file in gbmc_files:
+                            migrate_cgan_ifs_file(gbmc_file=gbmc_file, source_model=source_model)
+                        if use_job_queue():
+                            # start forecast generation as soon as the IFS forecasts are available
+                            enqueue_forecast_generation(
+                                ifs_source=source_model,
+                                trigger="-".join(sorted(gbmc_file.stem for gbmc_file in gbmc_files)),
+                            )
+                    # purge invalid files. partial sftp transfers are kept so that they can be resumed
+                    for file_path in downloads_path.iterdir():
+                        if not file_path.name.endswith(".part"):
+                            file_path.unlink(missing_ok=True)
+            finally:
+                release_task_lease(sync_type="processing", source=source_model)
+            return True
+        if not wait:
+            return False
         # sleep for 10 minutes
         sleep(60 * 10)
 
@@ -161,23 +213,22 @@ def post_process_downloaded_cgan_ifs(model: cgan_model_literal):
 def syncronize_post_processed_ifs_data(model: cgan_model_literal):
     logger.debug(f"received cGAN data syncronization for {model}")
     # syncronize on cGAN ens jobs ony!
-    if (
-        not get_data_sycn_status(source=model, sync_type="download")
-        and "count" not in model
-    ):
-        # set data syncronization status
-        set_data_sycn_status(source=model, sync_type="download", status=True)
-        # sync from ICPAC if GBMC server credentials are not provided
-        if (
-            getenv("IFS_SERVER_HOST", "domain.example") == "domain.example"
-            or getenv("IFS_SERVER_USER", "username") == "username"
-            or getenv("IFS_PRIVATE_KEY", None) is None
-        ):
-            sync_icpac_ifs_data(model=model)
-        else:
-            sync_sftp_data_files(model="cgan-ifs-6h-ens" if "jurre-brishti" in model else "cgan-ifs-7d-ens")
-        set_data_sycn_status(source=model, sync_type="download", status=False)
-    post_process_downloaded_cgan_ifs(model=model)
+    if "count" not in model and acquire_task_lease(sync_type="download", source=model):
+        try:
+            # sync from ICPAC if GBMC server credentials are not provided
+            if (
+                getenv("IFS_SERVER_HOST", "domain.example") == "domain.example"
+                or getenv("IFS_SERVER_USER", "username") == "username"
+                or getenv("IFS_PRIVATE_KEY", None) is None
+            ):
+                sync_icpac_ifs_data(model=model)
+            else:
+                sync_sftp_data_files(model="cgan-ifs-6h-ens" if "jurre-brishti" in model else "cgan-ifs-7d-ens")
+        finally:
+            release_task_lease(sync_type="download", source=model)
+    # hand the downloads over to the job queue worker. fall back to processing them here
+    if not use_job_queue() or not enqueue_task("process_downloads_task", model=model):
+        post_process_downloaded_cgan_ifs(model=model)
 
 
 if __name__ == "__main__":
@@ -195,13 +246,12 @@ if __name__ == "__main__":
         "--command",
         dest="command",
         type=str,
-        help="command to be executed. either download or process",
+        help="command to be executed. either download, process, migrate or worker",
         default=None,
     )
     args = parser.parse_args()
     dict_args = {key: value for key, value in args.__dict__.items() if key != "command"}
-    set_data_sycn_status(source=args.model, sync_type="download", status=False)
-    set_data_sycn_status(source=args.model, sync_type="processing", status=False)
+    reset_data_sycn_status(source=args.model)
     if args.command == "download":
         syncronize_post_processed_ifs_data(model=args.model)
     elif args.command == "migrate":
@@ -209,6 +259,8 @@ if __name__ == "__main__":
             migrate_files(source)
     elif args.command == "process":
         post_process_downloaded_cgan_ifs(model=args.model)
+    elif args.command == "worker" or (args.command is None and use_job_queue()):
+        run_job_worker(model=args.model)
     else: # drop to scheduler by default
         # no need of executing sync task on count jobs
         if 'ens' in args.model:
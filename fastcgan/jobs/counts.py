@@ -1,21 +1,209 @@
 # Script to compute the histogram data from 1000 member ensembles
 
-import sys
+import concurrent
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, get_context
+from os import getenv
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
 from typing import Literal
 
 import netCDF4 as nc
 import numpy as np
 from loguru import logger
 
+from fastcgan.jobs.catalog import register_forecast_file
 from fastcgan.jobs.utils import get_data_store_path
 
+# Define the bins we will use on an approximate log scale (mm/h)
+BIN_SPEC_1H = np.array(
+    [
+        0,
+        0.04,
+        0.1,
+        0.25,
+        0.4,
+        0.6,
+        0.8,
+        1,
+        1.25,
+        1.5,
+        1.8,
+        2.2,
+        2.6,
+        3,
+        3.5,
+        4,
+        4.7,
+        5.4,
+        6.1,
+        7,
+        8,
+        9.1,
+        10.3,
+        11.7,
+        13.25,
+        15,
+        1000,
+    ]
+)
+
+# compression settings compared by benchmark_counts_compression
+BENCHMARK_COMPRESSION = [
+    {"complevel": complevel, "shuffle": shuffle, "chunksizes": None} for complevel in [0, 1, 4, 6, 9] for shuffle in [False, True]
+]
+
+
+def bin_ensemble_counts(ensemble: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    # Compute the histogram counts of every grid point of an ensemble with shape (members, ...) at once.
+    # Matches np.histogram(ensemble[:, point], bin_edges) at each point, including the closed last bin.
+    num_members = ensemble.shape[0]
+    grid_shape = ensemble.shape[1:]
+    # one row of sorted ensemble members per grid point. NaNs are sorted to the end of each row
+    members = np.sort(ensemble.reshape(num_members, -1).T, axis=1)
+    rows = np.arange(members.shape[0])[:, np.newaxis]
+    closed = np.arange(len(bin_edges)) == len(bin_edges) - 1
+    # binary search for the number of members below each bin edge, in all rows at the same time
+    lower = np.zeros((members.shape[0], len(bin_edges)), dtype=np.intp)
+    upper = np.full_like(lower, num_members)
+    while (searching := lower < upper).any():
+        middle = (lower + upper) // 2
+        value = members[rows, np.minimum(middle, num_members - 1)]
+        below = np.where(closed, value <= bin_edges, value < bin_edges)
+        lower = np.where(searching & below, middle + 1, lower)
+        upper = np.where(searching & ~below, middle, upper)
+    return np.diff(lower, axis=1).reshape(*grid_shape, len(bin_edges) - 1)
+
+
+def get_counts_compression() -> dict:
+    chunk_shape = getenv("COUNTS_CHUNK_SHAPE", "")
+    return {
+        "complevel": int(getenv("COUNTS_COMPLEVEL", 4)),
+        "shuffle": getenv("COUNTS_SHUFFLE", "true").lower() in ["yes", "y", "true", "t", "1"],
+        # (bins, latitude, longitude) chunk shape. netCDF default chunking is used when not set
+        "chunksizes": None if not chunk_shape else [int(size) for size in chunk_shape.split(",")],
+    }
+
+
+def create_counts_file(
+    file_name: str,
+    model_name: str,
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    time: np.ndarray,
+    valid_time: float,
+    bin_spec: np.ndarray,
+    num_ensemble_members: int,
+    compression: dict | None = None,
+) -> nc.Dataset:
+    compression = compression if compression is not None else get_counts_compression()
+    # Create a new NetCDF file
+    rootgrp = nc.Dataset(file_name, "w", format="NETCDF4")
+
+    # Describe where this data comes from
+    rootgrp.description = f"{model_name.replace('-','').replace('count','').title()} cGAN forecast histogram counts"
+
+    # Create dimensions
+    rootgrp.createDimension("longitude", len(longitude))
+    rootgrp.createDimension("latitude", len(latitude))
+    rootgrp.createDimension("time", 1)
+    rootgrp.createDimension("valid_time", 1)
+    rootgrp.createDimension("bins", len(bin_spec) - 2)
+    logger.info(f"processing {rootgrp.description}")
+    # Create the longitude variable
+    longitude_data = rootgrp.createVariable("longitude", "f4", ("longitude"), zlib=False)
+    longitude_data.units = "degrees_east"
+    longitude_data[:] = longitude  # Write the longitude data
+
+    # Create the latitude variable
+    latitude_data = rootgrp.createVariable("latitude", "f4", ("latitude"), zlib=False)
+    latitude_data.units = "degrees_north"
+    latitude_data[:] = latitude  # Write the latitude data
+
+    # Create the time variable
+    time_data = rootgrp.createVariable("time", "f4", ("time"), zlib=False)
+    time_data.units = "hours since 1900-01-01 00:00:00.0"
+    time_data.description = "Time corresponding to forecast model start"
+    time_data[:] = time  # Write the forecast model start time
+
+    # Create the valid_time variable
+    valid_time_data = rootgrp.createVariable("valid_time", "f4", ("valid_time"), zlib=False)
+    valid_time_data.units = "hours since 1900-01-01 00:00:00.0"
+    valid_time_data.description = "Time corresponding to forecast prediction"
+    valid_time_data[:] = valid_time  # Write the forecast model valid times
+
+    # Bin specification. First bin is zero, final bin is infinity.
+    bins_data = rootgrp.createVariable("bins", "f4", ("bins"), zlib=False)
+    bins_data.units = "mm/h"
+    bins_data.description = "Histogram bin edges"
+    bins_data[:] = bin_spec[1:-1]  # Write histogram bin specification
+
+    # Create the counts variable. Counts are written in latitude bands as they are computed
+    counts_data = rootgrp.createVariable(
+        "counts",
+        "i2",
+        ("bins", "latitude", "longitude"),
+        zlib=compression["complevel"] > 0,
+        complevel=compression["complevel"],
+        shuffle=compression["shuffle"],
+        chunksizes=compression["chunksizes"],
+    )
+    counts_data.description = "Histogram bin counts"
+    counts_data.num_members = num_ensemble_members
+    return rootgrp
+
+
+def make_valid_time_counts(
+    in_file_name: str,
+    file_name: str,
+    model_name: str,
+    valid_time_num: int,
+    chunk_rows: int,
+    compression: dict,
+) -> str:
+    # Open the NetCDF file for reading. Only one valid time is read, a latitude band at a time
+    with nc.Dataset(in_file_name, "r") as nc_file:
+        latitude = np.array(nc_file["latitude"][:])
+        longitude = np.array(nc_file["longitude"][:])
+        precip = nc_file["precipitation"]
+        chunk_rows = len(latitude) if chunk_rows < 1 else chunk_rows
+        logger.info(f"creating new NetCDF file {file_name} for {model_name}:{valid_time_num}")
+        rootgrp = create_counts_file(
+            file_name=file_name,
+            model_name=model_name,
+            latitude=latitude,
+            longitude=longitude,
+            time=np.array(nc_file["time"][:]),
+            valid_time=np.array(nc_file["fcst_valid_time"][:])[0][valid_time_num],
+            bin_spec=BIN_SPEC_1H,
+            num_ensemble_members=precip.shape[1],
+            compression=compression,
+        )
+        for lat_start in range(0, len(latitude), chunk_rows):
+            lat_end = min(lat_start + chunk_rows, len(latitude))
+            logger.debug(f"computing the counts for {file_name} latitude rows {lat_start} to {lat_end}")
+            counts = bin_ensemble_counts(
+                np.array(precip[0, :, valid_time_num, lat_start:lat_end, :]),
+                BIN_SPEC_1H,
+            )
+            # counts in bin zero are not stored. Compression is better if we move the bins axis first
+            rootgrp["counts"][:, lat_start:lat_end, :] = np.moveaxis(counts, -1, 0)[1:]
+
+        # Close the netCDF file
+        rootgrp.close()
+    return file_name
+
 
 def make_cgan_forecast_counts(
     date_str: str,
     hour_str: str,
     model_name: Literal["jurre-brishti-count", "mvua-kubwa-count"],
-):
+    chunk_rows: int | None = None,
+    max_workers: int | None = None,
+) -> bool:
+    # returns whether the counts of every valid time were computed and registered
     year = int(date_str[0:4])
     month = int(date_str[4:6])
     day = int(date_str[6:8])
@@ -30,135 +218,145 @@ def make_cgan_forecast_counts(
     # model incremetor time in hours
     multiplier = 6 if model_name == "jurre-brishti-count" else 24
     time_steps = 30 if model_name == "jurre-brishti-count" else 6
+    # number of latitude rows binned at a time. Bounds peak memory to about
+    # members * chunk_rows * longitudes * 8 bytes for each worker. 0 bins the whole grid at once.
+    chunk_rows = chunk_rows if chunk_rows is not None else int(getenv("COUNTS_CHUNK_ROWS", 32))
+    max_workers = max_workers if max_workers is not None else int(getenv("COUNTS_WORKERS", max(cpu_count() // 4, 1)))
     if not Path(in_file_name).exists():
         logger.error(f"{model_name} forecast file {in_file_name} does not exist on the filesystem")
-        return None
+        return False
     logger.debug(f"reading {model_name} forecast file {in_file_name} with multiplier {multiplier} and time steps {time_steps}")
-    # Open a NetCDF file for reading
-    nc_file = nc.Dataset(in_file_name, "r")
-    latitude = np.array(nc_file["latitude"][:])
-    longitude = np.array(nc_file["longitude"][:])
-    time = np.array(nc_file["time"][:])
-    valid_time = np.array(nc_file["fcst_valid_time"][:])[0]
-    precip = np.array(nc_file["precipitation"][:])
-    nc_file.close()
-    logger.debug(f"completed reading input data file {in_file_name}")
-
-    num_ensemble_members = precip.shape[1]
-    # Define the bins we will use on an approximate log scale (mm/h)
-    bin_spec_1h = np.array(
-        [
-            0,
-            0.04,
-            0.1,
-            0.25,
-            0.4,
-            0.6,
-            0.8,
-            1,
-            1.25,
-            1.5,
-            1.8,
-            2.2,
-            2.6,
-            3,
-            3.5,
-            4,
-            4.7,
-            5.4,
-            6.1,
-            7,
-            8,
-            9.1,
-            10.3,
-            11.7,
-            13.25,
-            15,
-            1000,
-        ]
-    )
-    # Compute the counts at each valuid time, latitude and longitude
-    logger.debug("computing the counts at each valuid time, latitude and longitude")
-    counts = np.zeros(
-        (len(valid_time), len(latitude), len(longitude), len(bin_spec_1h) - 1),
-        dtype=int,
-    )
-    for valid_time_num in range(len(valid_time)):
-        for j in range(len(latitude)):
-            for i in range(len(longitude)):
-                counts[valid_time_num, j, i, :], _ = np.histogram(precip[0, :, valid_time_num, j, i], bin_spec_1h)
+    with nc.Dataset(in_file_name, "r") as nc_file:
+        num_valid_times = nc_file["fcst_valid_time"].shape[-1]
 
     # Save each valid time in a different file
-    logger.debug("saving each valid time in a different file")
-    for valid_time_num in range(len(valid_time)):
-        # counts in bin zero are not stored.
-        pref_outdir = Path(f"{output_dir}/{year}/{month:02d}")
-        if not pref_outdir.exists():
-            pref_outdir.mkdir(parents=True, exist_ok=True)
-        fcst_valid_time = valid_time_num * multiplier + time_steps
-        file_name = f"{pref_outdir}/counts_{year}{month:02d}{day:02d}_{hour:02d}_{fcst_valid_time}h.nc"
-
-        # Create a new NetCDF file
-        logger.info(f"creating new NetCDF file {file_name} for {model_name}:{valid_time_num}")
-        rootgrp = nc.Dataset(file_name, "w", format="NETCDF4")
-
-        # Describe where this data comes from
-        rootgrp.description = f"{model_name.replace('-','').replace('count','').title()} cGAN forecast histogram counts"
-
-        # Create dimensions
-        rootgrp.createDimension("longitude", len(longitude))
-        rootgrp.createDimension("latitude", len(latitude))
-        rootgrp.createDimension("time", 1)
-        rootgrp.createDimension("valid_time", 1)
-        rootgrp.createDimension("bins", len(bin_spec_1h) - 2)
-        logger.info(f"processing {rootgrp.description}")
-        # Create the longitude variable
-        longitude_data = rootgrp.createVariable("longitude", "f4", ("longitude"), zlib=False)
-        longitude_data.units = "degrees_east"
-        longitude_data[:] = longitude  # Write the longitude data
-
-        # Create the latitude variable
-        latitude_data = rootgrp.createVariable("latitude", "f4", ("latitude"), zlib=False)
-        latitude_data.units = "degrees_north"
-        latitude_data[:] = latitude  # Write the latitude data
-
-        # Create the time variable
-        time_data = rootgrp.createVariable("time", "f4", ("time"), zlib=False)
-        time_data.units = "hours since 1900-01-01 00:00:00.0"
-        time_data.description = "Time corresponding to forecast model start"
-        time_data[:] = time  # Write the forecast model start time
-
-        # Create the valid_time variable
-        valid_time_data = rootgrp.createVariable("valid_time", "f4", ("valid_time"), zlib=False)
-        valid_time_data.units = "hours since 1900-01-01 00:00:00.0"
-        valid_time_data.description = "Time corresponding to forecast prediction"
-        valid_time_data[:] = valid_time[valid_time_num]  # Write the forecast model valid times
-
-        # Bin specification. First bin is zero, final bin is infinity.
-        bins_data = rootgrp.createVariable("bins", "f4", ("bins"), zlib=False)
-        bins_data.units = "mm/h"
-        bins_data.description = "Histogram bin edges"
-        bins_data[:] = bin_spec_1h[1:-1]  # Write histogram bin specification
-
-        # Create the counts variable
-        counts_data = rootgrp.createVariable("counts", "i2", ("bins", "latitude", "longitude"), zlib=True, complevel=9)
-        counts_data.description = "Histogram bin counts"
-        counts_data.num_members = num_ensemble_members
-        # Compression is better if we move the axis order
-        logger.info("compressing and re-arranging axis orger")
-        counts_data[:] = np.moveaxis(counts, [0, 1, 2, 3], [0, 2, 3, 1])[valid_time_num, 1:, :, :]
+    pref_outdir = Path(f"{output_dir}/{year}/{month:02d}")
+    if not pref_outdir.exists():
+        pref_outdir.mkdir(parents=True, exist_ok=True)
+    file_names = [
+        f"{pref_outdir}/counts_{year}{month:02d}{day:02d}_{hour:02d}_{valid_time_num * multiplier + time_steps}h.nc"
+        for valid_time_num in range(num_valid_times)
+    ]
+    compression = get_counts_compression()
+    # valid times that fail are computed again, up to COUNTS_RETRIES more times
+    retries = int(getenv("COUNTS_RETRIES", 2))
+    pending = dict(enumerate(file_names))
+    for attempt in range(retries + 1):
+        logger.debug(
+            f"computing the counts for {len(pending)} of {num_valid_times} valid times with {max_workers} workers "
+            + f"and compression {compression}" + ("" if not attempt else f". retry {attempt} of {retries}")
+        )
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(pending)), mp_context=get_context("spawn")) as executor:
+            results = {
+                executor.submit(
+                    make_valid_time_counts,
+                    in_file_name=in_file_name,
+                    file_name=file_name,
+                    model_name=model_name,
+                    valid_time_num=valid_time_num,
+                    chunk_rows=chunk_rows,
+                    compression=compression,
+                ): valid_time_num
+                for valid_time_num, file_name in pending.items()
+            }
+            for future in concurrent.futures.as_completed(results):
+                try:
+                    future.result()
+                except Exception as err:
+                    logger.error(f"failed to compute {model_name} counts of valid time {results[future]} for {date_str}_{hour_str} with error {err}")
+                else:
+                    pending.pop(results[future])
+        if not len(pending):
+            break
 
-        # Close the netCDF file
-        rootgrp.close()
-        input_path = Path(in_file_name)
-        logger.debug(f"removing input forecast file {input_path}")
-        input_path.unlink(missing_ok=True)
+    input_path = Path(in_file_name)
+    if len(pending):
+        # a date is only registered once all its valid times are computed. the partial counts are removed and the
+        # forecast file is kept, so that the counts can be computed again without a new inference
+        logger.error(f"{len(pending)} {model_name} valid times for {date_str}_{hour_str} failed after {retries} retries. keeping {input_path}")
+        for file_name in file_names:
+            Path(file_name).unlink(missing_ok=True)
+        return False
+    for file_name in file_names:
+        register_forecast_file(file_path=Path(file_name), source=model_name)
+    logger.debug(f"removing input forecast file {input_path}")
+    input_path.unlink(missing_ok=True)
+    return True
 
 
-if __name__ == "__main__":
-    # Get the date from the command line argument
-    date_str = sys.argv[1]
-    hour_str = sys.argv[2]
-    model = sys.argv[3]
+def benchmark_counts_compression(
+    in_file_name: str,
+    model_name: str = "jurre-brishti-count",
+    valid_time_num: int = 0,
+    compression_settings: list[dict] | None = None,
+) -> list[dict]:
+    # write the counts of one valid time with each compression setting and report write time, file size and read time
+    compression_settings = compression_settings if compression_settings is not None else BENCHMARK_COMPRESSION
+    with nc.Dataset(in_file_name, "r") as nc_file:
+        latitude = np.array(nc_file["latitude"][:])
+        longitude = np.array(nc_file["longitude"][:])
+        time = np.array(nc_file["time"][:])
+        valid_time = np.array(nc_file["fcst_valid_time"][:])[0][valid_time_num]
+        precip = nc_file["precipitation"]
+        num_ensemble_members = precip.shape[1]
+        counts = np.moveaxis(bin_ensemble_counts(np.array(precip[0, :, valid_time_num, :, :]), BIN_SPEC_1H), -1, 0)[1:]
+    results = []
+    with TemporaryDirectory() as tmp_dir:
+        for num, compression in enumerate(compression_settings):
+            file_name = f"{tmp_dir}/counts_{num}.nc"
+            start = perf_counter()
+            rootgrp = create_counts_file(
+                file_name=file_name,
+                model_name=model_name,
+                latitude=latitude,
+                longitude=longitude,
+                time=time,
+                valid_time=valid_time,
+                bin_spec=BIN_SPEC_1H,
+                num_ensemble_members=num_ensemble_members,
+                compression=compression,
+            )
+            rootgrp["counts"][:] = counts
+            rootgrp.close()
+            write_time = perf_counter() - start
+            start = perf_counter()
+            with nc.Dataset(file_name, "r") as counts_file:
+                counts_file["counts"][:]
+            read_time = perf_counter() - start
+            results.append(
+                {
+                    **compression,
+                    "write_seconds": round(write_time, 4),
+                    "read_seconds": round(read_time, 4),
+                    "size_kib": round(Path(file_name).stat().st_size / 1024, 1),
+                }
+            )
+            logger.info(
+                f"complevel={compression['complevel']} shuffle={compression['shuffle']} chunksizes={compression['chunksizes']} "
+                + f"write={results[-1]['write_seconds']}s read={results[-1]['read_seconds']}s size={results[-1]['size_kib']}KiB"
+            )
+    return results
 
-    make_cgan_forecast_counts(date_str=date_str, hour_str=hour_str, model_name=model)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="cgan-counts",
+        description="a program for computing cGAN forecast histogram counts from 1000 member ensembles",
+        usage="python counts.py <YYYYMMDD> <HH> <model-name> or python counts.py -b <forecast-file>",
+    )
+    parser.add_argument("date_str", type=str, nargs="?", help="forecast initialization date in the format YYYYMMDD")
+    parser.add_argument("hour_str", type=str, nargs="?", help="forecast initialization hour")
+    parser.add_argument("model", type=str, nargs="?", help="count model name. Options are jurre-brishti-count, mvua-kubwa-count")
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        dest="benchmark_file",
+        type=str,
+        default=None,
+        help="benchmark counts compression settings using the given cGAN forecast file",
+    )
+    args = parser.parse_args()
+    if args.benchmark_file is not None:
+        benchmark_counts_compression(in_file_name=args.benchmark_file)
+    else:
+        make_cgan_forecast_counts(date_str=args.date_str, hour_str=args.hour_str, model_name=args.model)
@@ -0,0 +1,191 @@
+import concurrent
+import json
+import re
+import threading
+from collections.abc import Callable
+from os import getenv, getpid
+from pathlib import Path
+from time import monotonic, sleep, time
+from urllib.parse import urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from loguru import logger
+
+from fastcgan.jobs.downloads import make_http_session
+from fastcgan.jobs.utils import get_data_store_path
+
+
+class HostRateLimiter:
+    # spaces out requests to the same host so that concurrent workers do not flood the data provider
+    def __init__(self, max_rate: float):
+        self.interval = 0 if max_rate <= 0 else 1 / max_rate
+        self.lock = threading.Lock()
+        self.next_slot: dict[str, float] = {}
+
+    def wait(self, url: str) -> None:
+        host = urlparse(url).netloc
+        with self.lock:
+            now = monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+
+def follow_sub_directories(data_page: str, href: str) -> list[str]:
+    return [href[:-1]] if "../" not in href and href.endswith("/") else []
+
+
+def get_crawl_manifest_file(data_pages: list[str]) -> Path:
+    manifest_name = re.sub(r"[^a-zA-Z0-9]+", "_", "-".join(sorted(data_pages))).strip("_")
+    return get_data_store_path(source="jobs") / "crawl-manifests" / f"{manifest_name}.json"
+
+
+def load_crawl_manifest(manifest_file: Path) -> dict[str, dict]:
+    if not manifest_file.exists():
+        return {}
+    try:
+        with manifest_file.open("r") as f:
+            return json.load(f)
+    except Exception as err:
+        logger.warning(f"failed to read crawl manifest {manifest_file} with error {err}. starting a full crawl")
+        return {}
+
+
+def save_crawl_manifest(manifest_file: Path, manifest: dict[str, dict]) -> None:
+    if not manifest_file.parent.exists():
+        manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_name(f".{manifest_file.name}.{getpid()}")
+    with tmp_file.open("w") as f:
+        json.dump(manifest, f)
+    tmp_file.replace(manifest_file)
+
+
+def fetch_page_links(
+    session: requests.Session,
+    rate_limiter: HostRateLimiter,
+    data_page: str,
+    cached: dict | None = None,
+) -> tuple[list[str], dict | None, bool]:
+    # conditional GET of a directory listing. returns the listing links, its manifest entry and whether it changed
+    headers = {}
+    if cached is not None and cached.get("etag") is not None:
+        headers["If-None-Match"] = cached["etag"]
+    if cached is not None and cached.get("last_modified") is not None:
+        headers["If-Modified-Since"] = cached["last_modified"]
+    rate_limiter.wait(data_page)
+    r = session.get(data_page, allow_redirects=True, timeout=60, headers=headers)
+    if r.status_code == 304 and cached is not None:
+        return cached["hrefs"], {**cached, "fetched_at": time()}, False
+    if r.status_code != 200:
+        logger.warning(f"failed to crawl links from {data_page} with status code {r.status_code} due to {r.reason}")
+        return ([], None, False) if cached is None else (cached["hrefs"], cached, False)
+    soup = BeautifulSoup(r.text, features="html.parser")
+    hrefs = [f"{data_page}/{a['href']}" for a in soup.find_all("a") if a.has_attr("href")]
+    # servers without conditional request support answer 200 every time, so compare the listing too
+    changed = cached is None or hrefs != cached["hrefs"]
+    entry = {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "hrefs": hrefs,
+        "changed_at": time() if changed else cached["changed_at"],
+        "fetched_at": time(),
+    }
+    return hrefs, entry, changed
+
+
+def crawl_dataset_links(
+    data_pages: list[str],
+    data_ext: str | None = "nc",
+    get_child_pages: Callable[[str, str], list[str]] = follow_sub_directories,
+    max_workers: int | None = None,
+    max_rate: float | None = None,
+    use_manifest: bool | None = None,
+    refresh_days: float | None = None,
+    max_age_hours: float | None = None,
+) -> set[str]:
+    """Crawl the HTTP directory listings under `data_pages` breadth first and return the data file links.
+
+    `get_child_pages(data_page, href)` returns the listing pages to visit for a link which is not a data file.
+    Each level of the directory tree is fetched concurrently by up to `max_workers` workers.
+
+    Listings are recorded with their ETag/Last-Modified headers in a manifest under the jobs directory and
+    re-fetched with conditional requests. Sub-directories of an unchanged listing are only re-fetched when they
+    changed within the last `refresh_days`, were last fetched more than `max_age_hours` ago or are the newest
+    sub-directory of their parent. Index servers do not update a parent listing when files are added to a child,
+    so the newest (current period) listings are always checked. Other subtrees are served from the manifest.
+    """
+    max_workers = max_workers if max_workers is not None else int(getenv("CRAWL_WORKERS", 8))
+    max_rate = max_rate if max_rate is not None else float(getenv("CRAWL_RATE_LIMIT", 10))
+    if use_manifest is None:
+        use_manifest = getenv("CRAWL_MANIFEST", "true").lower() in ["yes", "y", "true", "t", "1"]
+    refresh_days = refresh_days if refresh_days is not None else float(getenv("CRAWL_REFRESH_DAYS", 3))
+    max_age_hours = max_age_hours if max_age_hours is not None else float(getenv("CRAWL_MAX_AGE_HOURS", 24))
+    manifest_file = get_crawl_manifest_file(data_pages=data_pages)
+    manifest = load_crawl_manifest(manifest_file) if use_manifest else {}
+    updated_manifest: dict[str, dict] = {}
+    rate_limiter = HostRateLimiter(max_rate=max_rate)
+    links: set[str] = set()
+    visited = set(data_pages)
+    frontier = list(data_pages)
+    fetched, changed_pages, reused = 0, 0, 0
+
+    def is_reusable(cached: dict | None) -> bool:
+        return (
+            cached is not None
+            and time() - cached["changed_at"] >= refresh_days * 86400
+            and time() - cached.get("fetched_at", 0) < max_age_hours * 3600
+        )
+
+    def add_page_links(data_page: str, hrefs: list[str], changed: bool) -> None:
+        nonlocal reused
+        child_pages: dict[str, None] = {}
+        for href in hrefs:
+            if href.endswith(data_ext):
+                links.add(href)
+                continue
+            child_pages.update(dict.fromkeys(get_child_pages(data_page, href)))
+        # date structured listings sort the current period last
+        newest_page = max(child_pages, default=None)
+        for child_page in child_pages:
+            if child_page in visited:
+                continue
+            visited.add(child_page)
+            cached = manifest.get(child_page)
+            if changed or child_page == newest_page or not is_reusable(cached):
+                frontier.append(child_page)
+            else:
+                # unchanged subtree. reuse its listing from the manifest without a request
+                updated_manifest[child_page] = cached
+                reused += 1
+                add_page_links(child_page, cached["hrefs"], False)
+
+    with make_http_session(pool_size=max_workers) as session, concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(frontier):
+            logger.debug(f"crawling {len(frontier)} data pages")
+            results = {
+                executor.submit(fetch_page_links, session, rate_limiter, data_page, manifest.get(data_page)): data_page for data_page in frontier
+            }
+            frontier = []
+            for future in concurrent.futures.as_completed(results):
+                data_page = results[future]
+                try:
+                    hrefs, entry, changed = future.result()
+                except Exception as err:
+                    logger.error(f"failed to crawl links from {data_page} with error {err}")
+                    if (entry := manifest.get(data_page)) is None:
+                        continue
+                    hrefs, changed = entry["hrefs"], False
+                fetched += 1
+                changed_pages += int(changed)
+                if entry is not None:
+                    updated_manifest[data_page] = entry
+                add_page_links(data_page, hrefs, changed)
+    if use_manifest:
+        save_crawl_manifest(manifest_file, updated_manifest)
+    logger.info(
+        f"crawled a total of {len(links)} data files from {', '.join(data_pages)}. "
+        + f"{changed_pages} of {fetched} fetched listings changed and {reused} were reused from the manifest"
+    )
+    return links
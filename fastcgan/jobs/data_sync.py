@@ -1,19 +1,104 @@
 import concurrent
-from datetime import date
+import json
+import threading
+from datetime import date, datetime
 from multiprocessing import cpu_count
+from os import getenv
 from pathlib import Path
 
+import requests
 from ecmwf.opendata import Client
 from ecmwf.opendata.client import Result
 from loguru import logger
-from show_forecasts.constants import COUNTRY_NAMES
+from show_forecasts.constants import COUNTRY_NAMES, DATA_PARAMS
 
+from fastcgan.jobs.downloads import download_byte_ranges, make_http_session, merge_byte_ranges
 from fastcgan.jobs.utils import (
     get_data_store_path,
     get_dataset_file_path,
     get_relevant_forecast_steps,
 )
 
+# ECMWF short names of the dataset variables read from the open-ifs forecasts
+GRIB2_PARAM_NAMES = {"t2m": "2t", "u10": "10u", "v10": "10v"}
+
+
+def use_subset_download() -> bool:
+    return getenv("OPEN_IFS_SUBSET_DOWNLOAD", "true").lower() in ["yes", "y", "true", "t", "1"]
+
+
+def get_grib2_params() -> list[str]:
+    params = [param for param in DATA_PARAMS.keys() if param != "wind"] + ["u10", "v10"]
+    return [GRIB2_PARAM_NAMES.get(param, param) for param in params]
+
+
+def get_grib2_index_parts(data_url: str, session: requests.Session, params: list[str]) -> list[tuple[int, int]]:
+    # every line of the .index file beside a grib2 file describes one of its fields and where it is stored
+    index_url = f"{data_url.rsplit('.', 1)[0]}.index"
+    r = session.get(index_url, timeout=60)
+    r.raise_for_status()
+    parts = []
+    for line in r.text.splitlines():
+        if not line.strip():
+            continue
+        field = json.loads(line)
+        if field.get("param") in params:
+            parts.append((int(field["_offset"]), int(field["_length"])))
+    return parts
+
+
+def try_subset_download(data_url: str, target_file: Path, params: list[str], session: requests.Session | None = None) -> bool:
+    # download only the fields of params instead of the whole global ensemble file
+    if session is None:
+        with requests.Session() as session:
+            return try_subset_download(data_url=data_url, target_file=target_file, params=params, session=session)
+    try:
+        parts = get_grib2_index_parts(data_url=data_url, session=session, params=params)
+    except Exception as err:
+        logger.error(f"failed to read the index of {data_url} with error {err}")
+        return False
+    if not len(parts):
+        logger.error(f"none of the {', '.join(params)} fields are listed in the index of {data_url}")
+        return False
+    ranges = merge_byte_ranges(parts)
+    logger.info(f"downloading {len(parts)} fields of {data_url} in {len(ranges)} byte ranges")
+    return download_byte_ranges(url=data_url, ranges=ranges, file_path=target_file, session=session)
+
+
+class EcmwfSyncContext:
+    # state shared by the download workers of one sync run. the latest available forecast is probed once, data urls
+    # are resolved once per (date, step) and all downloads reuse the connections of one pooled http session
+    def __init__(self, model: str | None = "ifs", resolution: str | None = "0p25", pool_size: int | None = None):
+        self.session = make_http_session(pool_size=pool_size if pool_size is not None else cpu_count() * 4)
+        self.client = Client(source="ecmwf", model=model, resol=resolution)
+        self.client.session = self.session
+        self.lock = threading.Lock()
+        self.latest_date: datetime | None = None
+        self.urls: dict[tuple, str] = {}
+
+    def latest(self) -> datetime:
+        with self.lock:
+            if self.latest_date is None:
+                self.latest_date = self.client.latest()
+                logger.info(f"latest available ECMWF open data forecast is {self.latest_date}")
+            return self.latest_date
+
+    def get_url(self, request: dict[str, str | date]) -> str:
+        key = (request["date"], request["step"], request.get("stream"))
+        with self.lock:
+            if key not in self.urls:
+                self.urls[key] = self.client._get_urls(request=request, use_index=False).urls[0]
+            return self.urls[key]
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 def try_data_download(
     client: Client,
@@ -45,9 +130,30 @@ def open_ifs_data_download_task(
     default_mask: str | None = COUNTRY_NAMES[0],
     re_try_times: int | None = 10,
     force_download: bool | None = False,
-    min_grib2_size: float | None = 4.5 * 1024,
+    min_grib2_size: float | None = None,
     min_nc_size: float | None = 360,
+    context: EcmwfSyncContext | None = None,
 ):
+    if context is None:
+        with EcmwfSyncContext(model=model, resolution=resolution, pool_size=1) as context:
+            return open_ifs_data_download_task(
+                request=request,
+                data_date=data_date,
+                source=source,
+                model=model,
+                resolution=resolution,
+                stream=stream,
+                default_mask=default_mask,
+                re_try_times=re_try_times,
+                force_download=force_download,
+                min_grib2_size=min_grib2_size,
+                min_nc_size=min_nc_size,
+                context=context,
+            )
+    subset_download = use_subset_download()
+    # subset files only exist once every byte range is verified, so any existing file is complete
+    if min_grib2_size is None:
+        min_grib2_size = 0 if subset_download else 4.5 * 1024
     file_name = f"{request['date'].strftime('%Y%m%d')}000000-{request['step']}h-{stream}-ef.grib2"
     mask_file = get_dataset_file_path(
         source="open-ifs",
@@ -59,13 +165,17 @@ def open_ifs_data_download_task(
     target_file = downloads_path / file_name
     target_size = 0 if not target_file.exists() else target_file.stat().st_size / (1024 * 1024)
     mask_size = 0 if not mask_file.exists() else mask_file.stat().st_size / (1024 * 1024)
-    client = Client(source="ecmwf", model=model, resol=resolution)
     if not (target_file.exists() or mask_file.exists()) or not (target_size >= min_grib2_size or mask_size >= min_nc_size) or force_download:
-        get_url = client._get_urls(request=request, target=str(target_file), use_index=False)
-        logger.info(f"trying {model} data download with payload {request} on URL {get_url.urls[0]}")
+        data_url = context.get_url(request)
+        logger.info(f"trying {model} data download with payload {request} on URL {data_url}")
         for _ in range(re_try_times):
+            if subset_download:
+                if try_subset_download(data_url=data_url, target_file=target_file, params=get_grib2_params(), session=context.session):
+                    logger.info(f"dataset subset for {model} forecast, {request['step']}h step successfully downloaded")
+                    break
+                continue
             result = try_data_download(
-                client=client,
+                client=context.client,
                 request=request,
                 target_file=str(target_file),
                 model=model,
@@ -91,11 +201,23 @@ def run_ecmwf_ifs_sync(
     stream: str | None = "enfo",
     start_step: int | None = 30,
     final_step: int | None = 54,
+    context: EcmwfSyncContext | None = None,
 ):
-    # create data download client
-    client = Client(source="ecmwf", model=model, resol=resolution)
+    # sync runs over several dates share one context. a single date sync gets its own
+    if context is None:
+        with EcmwfSyncContext(model=model, resolution=resolution) as context:
+            return run_ecmwf_ifs_sync(
+                data_date=data_date,
+                source=source,
+                model=model,
+                resolution=resolution,
+                stream=stream,
+                start_step=start_step,
+                final_step=final_step,
+                context=context,
+            )
     # get latest available forecast date
-    latest_fdate = client.latest()
+    latest_fdate = context.latest()
     # construct data store path
     downloads_path = get_data_store_path(source="jobs") / source
     # create data directory if it doesn't exist
@@ -114,7 +236,19 @@ def run_ecmwf_ifs_sync(
         ]
         grib2_files = []
         with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_count() * 4) as executor:
-            results = [executor.submit(open_ifs_data_download_task, data_date=data_date, request=request) for request in requests]
+            results = [
+                executor.submit(
+                    open_ifs_data_download_task,
+                    data_date=data_date,
+                    request=request,
+                    source=source,
+                    model=model,
+                    resolution=resolution,
+                    stream=stream,
+                    context=context,
+                )
+                for request in requests
+            ]
         for future in concurrent.futures.as_completed(results):
             if future.result() is not None:
                 grib2_files.append(future.result())
@@ -0,0 +1,193 @@
+import concurrent
+from collections.abc import Callable
+from os import getenv
+from pathlib import Path
+from time import perf_counter
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+# size of the blocks written to disk while streaming a download
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# leading bytes of classic NetCDF and NetCDF4/HDF5 files
+NETCDF_SIGNATURES = [b"CDF\x01", b"CDF\x02", b"CDF\x05", b"\x89HDF\r\n\x1a\n"]
+
+
+def make_http_session(pool_size: int) -> requests.Session:
+    # keep connections to the data provider alive across all download workers
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_partial_file_path(file_path: Path) -> Path:
+    return file_path.with_name(f"{file_path.name}.part")
+
+
+def is_valid_netcdf(file_path: Path) -> bool:
+    # catches html error pages and truncated files served with a 200 status
+    with file_path.open("rb") as f:
+        header = f.read(8)
+    return any(header.startswith(signature) for signature in NETCDF_SIGNATURES)
+
+
+def get_expected_size(r: requests.Response, offset: int) -> int | None:
+    # iter_content decodes compressed responses, so sizes are only comparable for identity encoding
+    if r.headers.get("Content-Encoding"):
+        return None
+    if r.status_code == 206 and "/" in r.headers.get("Content-Range", ""):
+        total = r.headers["Content-Range"].split("/")[-1]
+        return None if total == "*" else int(total)
+    content_length = r.headers.get("Content-Length")
+    return None if content_length is None else offset + int(content_length)
+
+
+def stream_download(
+    url: str,
+    file_path: Path,
+    session: requests.Session | None = None,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    timeout: float | None = 60,
+    resume: bool = True,
+    validate: Callable[[Path], bool] | None = None,
+) -> bool:
+    # stream the response into a `.part` file and only move it into place once it is complete and valid,
+    # so that memory use stays flat and an interrupted transfer is never mistaken for a complete file.
+    # an existing `.part` file from an interrupted transfer is resumed with an HTTP range request
+    partial_file = get_partial_file_path(file_path)
+    if not file_path.parent.exists():
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+    offset = partial_file.stat().st_size if resume and partial_file.exists() else 0
+    headers = {} if not offset else {"Range": f"bytes={offset}-"}
+    logger.debug(f"downloading {url} into {file_path}" + ("" if not offset else f" resuming from byte {offset}"))
+    start = perf_counter()
+    try:
+        with (requests if session is None else session).get(url, stream=True, timeout=timeout, headers=headers) as r:
+            if r.status_code == 416 and offset:
+                # the partial file does not match the remote file anymore. start over
+                partial_file.unlink(missing_ok=True)
+                return stream_download(
+                    url=url,
+                    file_path=file_path,
+                    session=session,
+                    chunk_size=chunk_size,
+                    timeout=timeout,
+                    resume=False,
+                    validate=validate,
+                )
+            if r.status_code not in [200, 206]:
+                logger.error(f"failed to download dataset file {url} with http response {r.status_code} {r.reason}")
+                return False
+            # servers without range support send the whole file
+            offset = offset if r.status_code == 206 else 0
+            expected_size = get_expected_size(r, offset)
+            received = 0
+            with partial_file.open(mode="ab" if offset else "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    received += len(chunk)
+    except Exception as err:
+        # keep the partial file so that the next attempt resumes it
+        logger.error(f"failed to download {url} with error {err}")
+        return False
+    if expected_size is not None and offset + received != expected_size:
+        logger.error(f"incomplete download of {url}. received {offset + received} of {expected_size} bytes")
+        if offset + received > expected_size:
+            partial_file.unlink(missing_ok=True)
+        return False
+    if validate is not None and not validate(partial_file):
+        logger.error(f"downloaded file {url} failed validation and will be discarded")
+        partial_file.unlink(missing_ok=True)
+        return False
+    partial_file.replace(file_path)
+    elapsed = perf_counter() - start
+    size_mb = received / (1024 * 1024)
+    logger.info(f"finished downloading {url} into {file_path.name}. {size_mb:.1f}MB at {size_mb / max(elapsed, 1e-6):.2f}MB/s")
+    return True
+
+
+def merge_byte_ranges(parts: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # (offset, length) parts of a file into inclusive (start, end) http ranges. adjacent parts share one request
+    ranges: list[tuple[int, int]] = []
+    for offset, length in sorted(parts):
+        if len(ranges) and offset <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], offset + length - 1))
+        else:
+            ranges.append((offset, offset + length - 1))
+    return ranges
+
+
+def download_byte_ranges(
+    url: str,
+    ranges: list[tuple[int, int]],
+    file_path: Path,
+    session: requests.Session | None = None,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    timeout: float | None = 60,
+) -> bool:
+    # fetch the byte ranges of url one after another into a `.part` file and move it into place once every
+    # range is complete. an existing `.part` file resumes from the range it stopped in
+    partial_file = get_partial_file_path(file_path)
+    if not file_path.parent.exists():
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+    expected_size = sum(end - start + 1 for start, end in ranges)
+    offset = partial_file.stat().st_size if partial_file.exists() else 0
+    if offset > expected_size:
+        partial_file.unlink(missing_ok=True)
+        offset = 0
+    logger.debug(f"downloading {len(ranges)} byte ranges of {url} into {file_path}" + ("" if not offset else f" resuming from byte {offset}"))
+    start_time = perf_counter()
+    received, covered = 0, 0
+    try:
+        with partial_file.open(mode="ab" if offset else "wb") as f:
+            for start, end in ranges:
+                # skip the ranges that are already in the partial file
+                if covered + end - start + 1 <= offset:
+                    covered += end - start + 1
+                    continue
+                range_start = start + max(offset - covered, 0)
+                covered += end - start + 1
+                with (requests if session is None else session).get(
+                    url, stream=True, timeout=timeout, headers={"Range": f"bytes={range_start}-{end}"}
+                ) as r:
+                    if r.status_code != 206:
+                        logger.error(f"failed to download byte range {range_start}-{end} of {url} with http response {r.status_code} {r.reason}")
+                        return False
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        received += len(chunk)
+    except Exception as err:
+        # keep the partial file so that the next attempt resumes it
+        logger.error(f"failed to download byte ranges of {url} with error {err}")
+        return False
+    if (size := partial_file.stat().st_size) != expected_size:
+        logger.error(f"incomplete download of {url}. received {size} of {expected_size} bytes")
+        if size > expected_size:
+            partial_file.unlink(missing_ok=True)
+        return False
+    partial_file.replace(file_path)
+    elapsed = perf_counter() - start_time
+    size_mb = received / (1024 * 1024)
+    logger.info(
+        f"finished downloading {len(ranges)} byte ranges of {url} into {file_path.name}. "
+        + f"{size_mb:.1f}MB at {size_mb / max(elapsed, 1e-6):.2f}MB/s"
+    )
+    return True
+
+
+def run_download_tasks(download_task: Callable[[str], None], links: list[str], max_workers: int | None = None) -> None:
+    # links are submitted in the given order, so that a newest-first list is downloaded newest first
+    max_workers = max_workers if max_workers is not None else int(getenv("DOWNLOAD_WORKERS", 4))
+    if not len(links):
+        return None
+    logger.info(f"downloading {len(links)} data files with {max_workers} workers")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = {executor.submit(download_task, link): link for link in links}
+        for future in concurrent.futures.as_completed(results):
+            try:
+                future.result()
+            except Exception as err:
+                logger.error(f"download task for {results[future]} failed with error {err}")
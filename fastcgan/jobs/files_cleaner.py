@@ -6,6 +6,7 @@ from time import sleep
 import schedule
 from loguru import logger
 
+from fastcgan.jobs.catalog import unregister_forecast_files
 from fastcgan.jobs.utils import get_directory_files
 
 
@@ -18,11 +19,13 @@ def delete_old_files() -> None:
     else:
         files_dir = getenv("FORECASTS_DATA_DIR", None)
         files = get_directory_files(data_path=Path(files_dir), files=set())
+        deleted = []
         for file in files:
             file_age = (datetime.now() - datetime.fromtimestamp(file.stat().st_atime)).days
             if file_age > max_age:
                 logger.info(f"deleting data file {file} with an age of {file_age} days")
                 file.unlink(missing_ok=True)
+                deleted.append(file)
             # delete empty directories
             parent = file.parent
             for _ in file.parts[:-1]:
@@ -32,6 +35,7 @@ def delete_old_files() -> None:
                 else:
                     break
                 parent = parent.parent
+        unregister_forecast_files(deleted)
 
 
 if __name__ == "__main__":
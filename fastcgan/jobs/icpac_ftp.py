@@ -1,109 +1,97 @@
 from argparse import ArgumentParser  # noqa: I001
+from collections.abc import Callable
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 from typing import Literal
 from os import getenv
-import requests
-from bs4 import BeautifulSoup
 from loguru import logger
 from re import compile
+from fastcgan.jobs.catalog import register_forecast_file
+from fastcgan.jobs.crawler import crawl_dataset_links
+from fastcgan.jobs.downloads import is_valid_netcdf, run_download_tasks, stream_download
 from fastcgan.jobs.stubs import cgan_model_literal, open_ifs_literal
 from fastcgan.jobs.utils import get_data_store_path
 
 
-def deep_crawl_http_dataset_links(data_page: str, data_ext: str | None = "nc", links: set[str] | None = set()) -> list[str]:
+def get_icpac_child_pages(data_page: str, href: str) -> list[str]:
+    today = datetime.now()
+    env = getenv("ENVIRONMENT", "local")
+    sync_months = getenv("SYNC_DATA_MONTHS", f"{str(today.month).rjust(2, '0')}")
+    if env in ["production", "staging"]:
+        return [href[:-1]] if "../" not in href and href.endswith("/") else []
+    entry_ptn = compile(data_page + r"/([a-zA-Z0-9%\s]{5,15})/")
+    if "open-ifs" in href and bool(entry_ptn.match(href)):
+        return [f"{href}{today.year}/{month}" for month in sync_months.split(",")]
+    elif "../" not in href and href.endswith("/") and str(today.year) in href:
+        return [f"{href}{month}" for month in sync_months.split(",")]
+    return []
+
+
+def deep_crawl_http_dataset_links(data_page: str, data_ext: str | None = "nc") -> set[str]:
     logger.debug(f"starting data links crawler task for {data_page}")
-    r = requests.get(data_page, allow_redirects=True)
-    if r.status_code == 200:
-        soup = BeautifulSoup(r.text, features="html.parser")
-        today = datetime.now()
-        env = getenv("ENVIRONMENT", "local")
-        sync_months = getenv("SYNC_DATA_MONTHS", f"{str(today.month).rjust(2, '0')}")
-        link_regx = data_page + r"/([a-zA-Z0-9%\s]{5,15})/"
-        entry_ptn = compile(link_regx)
-        for a in soup.find_all("a"):
-            href = f"{data_page}/{a['href']}"
-            if href.endswith(data_ext):
-                links.add(href)
-            if env in ["production", "staging"]:
-                if "../" not in href and href.endswith("/"):
-                    links = deep_crawl_http_dataset_links(data_page=href[:-1], links=links)
-            else:
-                if "open-ifs" in href and bool(entry_ptn.match(href)):
-                    for month in sync_months.split(","):
-                        links = deep_crawl_http_dataset_links(data_page=f"{href}{today.year}/{month}", links=links)
-                elif "../" not in href and href.endswith("/") and str(today.year) in href:
-                    for month in sync_months.split(","):
-                        links = deep_crawl_http_dataset_links(data_page=f"{href}{month}", links=links)
-        logger.info(f"crawled a total of {len(links)} data files from {data_page}")
-    else:
-        logger.warning(f"failed to crawl links from {data_page} with status code {r.status_code} due to {r.reason}")
-    return links
+    return crawl_dataset_links(data_pages=[data_page], data_ext=data_ext, get_child_pages=get_icpac_child_pages)
 
 
-def download_open_ifs_ens_dataset(link: str):
+def get_open_ifs_file_path(link: str) -> Path:
     file_name = link.split("/")[-1]
     filename_parts = file_name.split("-")
     destination = get_data_store_path(source="open-ifs", mask_region=filename_parts[0].replace("_", " ").title())
     data_date = datetime.strptime(filename_parts[2], "%Y%m%d000000")
-    file_dir = destination / str(data_date.year) / f"{data_date.month:02d}"
-    if not file_dir.exists():
-        file_dir.mkdir(parents=True, exist_ok=True)
-    file_path = file_dir / file_name
-    if not file_path.exists():
-        logger.debug(f"trying download of {link}")
-        try:
-            with requests.get(link, stream=True) as r:
-                logger.debug(f"downloading {link} into {file_path}")
+    return destination / str(data_date.year) / f"{data_date.month:02d}" / file_name
 
-                if r.status_code == 200:
-                    with file_path.open(mode="wb") as f:
-                        f.write(r.content)
-                    logger.info(f"Finished downloading {link}.\t" + f"Data stream was saved into {file_path.name}")
-                else:
-                    logger.error(f"failed to download dataset file {link} " + f"with http response {r.text}")
 
-        except Exception as err:
-            logger.error(f"failed to download {link} with error {err}")
+def get_cgan_ifs_file_path(model_name: Literal["cgan-ifs-6h-ens", "cgan-ifs-7d-ens"], link: str) -> Path:
+    link_parts = link.split("/")
+    return get_data_store_path(source=model_name) / link_parts[-3] / link_parts[-2] / link_parts[-1]
+
+
+def download_open_ifs_ens_dataset(link: str):
+    file_path = get_open_ifs_file_path(link=link)
+    if not file_path.exists():
+        logger.debug(f"trying download of {link}")
+        if stream_download(url=link, file_path=file_path, validate=is_valid_netcdf):
+            register_forecast_file(file_path=file_path, source="open-ifs")
 
 
 def download_cgan_ifs_ens_dataset(model_name: Literal["cgan-ifs-6h-ens", "cgan-ifs-7d-ens"], link: str):
-    link_parts = link.split("/")
-    destination = get_data_store_path(source=model_name) / link_parts[-3] / link_parts[-2]
-    if not destination.exists():
-        destination.mkdir(parents=True, exist_ok=True)
-    file_path = destination / link_parts[-1]
+    file_path = get_cgan_ifs_file_path(model_name=model_name, link=link)
     if not file_path.exists():
         logger.debug(f"trying download of {link}")
-        try:
-            with requests.get(link, stream=True) as r:
-                logger.debug(f"downloading {link} into {file_path}")
+        if stream_download(url=link, file_path=file_path, validate=is_valid_netcdf):
+            register_forecast_file(file_path=file_path, source=model_name)
 
-                if r.status_code == 200:
-                    with file_path.open(mode="wb") as f:
-                        f.write(r.content)
-                    logger.info(f"Finished downloading {link}.\t" + f"Data stream was saved into {file_path.name}")
-                else:
-                    logger.error(f"failed to download dataset file {link} " + f"with http response {r.text}")
 
-        except Exception as err:
-            logger.error(f"failed to download {link} with error {err}")
+def get_missing_links(links: set[str], get_file_path: Callable[[str], Path]) -> list[str]:
+    # diff the crawled remote files against the local data store, newest first
+    missing = [link for link in sorted(links, reverse=True) if not get_file_path(link).exists()]
+    logger.info(f"{len(missing)} of {len(links)} crawled data files are not available locally")
+    return missing
 
 
 def sync_icpac_ifs_data(
     model: cgan_model_literal | open_ifs_literal,
     provider_url: str | None = "https://cgan.icpac.net/ftp",
+    date_str: str | None = None,
 ) -> None:
+    # date_str (YYYYMMDD) restricts the sync to the data files of that date
     if model == "open-ifs":
         links = deep_crawl_http_dataset_links(data_page=f"{provider_url}/open-ifs")
+        links = {link for link in links if date_str is None or date_str in link.split("/")[-1]}
         logger.info(f"crawled a total of {len(links)} open-ifs data files from {provider_url}")
-        for link in sorted(links, reverse=True):
-            download_open_ifs_ens_dataset(link=link)
+        run_download_tasks(
+            download_task=download_open_ifs_ens_dataset,
+            links=get_missing_links(links=links, get_file_path=get_open_ifs_file_path),
+        )
     else:
         source_model = "cgan-ifs-6h-ens" if "jurre-brishti" in model else "cgan-ifs-7d-ens"
         links = deep_crawl_http_dataset_links(data_page=f"{provider_url}/{source_model}")
+        links = {link for link in links if date_str is None or date_str in link.split("/")[-1]}
         logger.info(f"crawled a total of {len(links)} data files from {provider_url}")
-        for link in sorted(links, reverse=True):
-            download_cgan_ifs_ens_dataset(model_name=source_model, link=link)
+        run_download_tasks(
+            download_task=partial(download_cgan_ifs_ens_dataset, source_model),
+            links=get_missing_links(links=links, get_file_path=partial(get_cgan_ifs_file_path, source_model)),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+from collections.abc import Iterator
+from importlib import import_module
+from os import getenv
+from pathlib import Path
+
+from loguru import logger
+
+
+def get_inference_workers() -> int:
+    # 0 runs one forecast script process per IFS file, one file at a time
+    return int(getenv("CGAN_INFERENCE_WORKERS", 1))
+
+
+def get_inference_entrypoint() -> str | None:
+    # a `module:function` taking an IFS file name, which keeps the generator weights loaded between calls.
+    # docker compose passes an empty value when it is not configured
+    return getenv("CGAN_INFERENCE_ENTRYPOINT") or None
+
+
+def get_model_work_dir(model: str) -> Path:
+    model_dir = "Mvua_Kubwa" if "mvua-kubwa" in model else "Jurre_Brishti"
+    return Path(getenv("WORK_HOME", "/opt/cgan")) / model_dir / "ensemble-cgan" / "dsrnngan"
+
+
+def get_forecast_script(model: str) -> str:
+    return "forecast_date.py" if "mvua-kubwa" in model else "test_forecast.py"
+
+
+def serve_forecast_requests(entrypoint: str) -> None:
+    # inference worker loop. reads IFS file names from stdin and answers each with a json status line on stdout.
+    # the entrypoint loads the model once and keeps it loaded across files
+    results = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    # the forecast output goes to the worker log instead of the results stream
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    module_name, function_name = entrypoint.split(":")
+    forecast = getattr(import_module(module_name), function_name)
+    for line in sys.stdin:
+        if not (ifs_file := line.strip()):
+            continue
+        try:
+            forecast(ifs_file)
+        except SystemExit as exit_code:
+            status = exit_code.code if isinstance(exit_code.code, int) else int(exit_code.code is not None)
+        except Exception as err:
+            logger.error(f"cGAN inference for {ifs_file} failed with error {err}")
+            status = 1
+        else:
+            status = 0
+        results.write(json.dumps({"ifs_file": ifs_file, "status": status}) + "\n")
+
+
+def run_cgan_inference(model: str, ifs_files: list[str], max_workers: int | None = None) -> Iterator[tuple[str, int]]:
+    """Generate the `model` forecasts of `ifs_files` and yield (ifs_file, exit status) as each one completes.
+
+    Up to `max_workers` workers take IFS files from a shared queue. With CGAN_INFERENCE_ENTRYPOINT set,
+    each worker is a persistent process that loads the model once. Otherwise each file runs the forecast
+    script in a process of its own. Closing the generator stops the workers after the files in flight.
+    """
+    max_workers = max_workers if max_workers is not None else get_inference_workers()
+    work_dir = get_model_work_dir(model)
+    script = get_forecast_script(model)
+    if max_workers < 1:
+        for ifs_file in ifs_files:
+            yield ifs_file, subprocess.call(shell=True, cwd=work_dir, args=f"python {script} -f {ifs_file}")
+        return None
+    entrypoint = get_inference_entrypoint()
+    tasks: queue.Queue[str] = queue.Queue()
+    for ifs_file in ifs_files:
+        tasks.put(ifs_file)
+    results: queue.Queue[tuple[str, int] | None] = queue.Queue()
+    stop = threading.Event()
+
+    def run_worker() -> None:
+        worker = None
+        try:
+            while not stop.is_set():
+                try:
+                    ifs_file = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if entrypoint is None:
+                    results.put((ifs_file, subprocess.call(shell=True, cwd=work_dir, args=f"python {script} -f {ifs_file}")))
+                    continue
+                if worker is None:
+                    logger.debug(f"starting {model} cGAN inference worker in {work_dir}")
+                    worker = subprocess.Popen(
+                        [sys.executable, "-m", "fastcgan.jobs.inference", entrypoint],
+                        cwd=work_dir,
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        text=True,
+                        bufsize=1,
+                    )
+                worker.stdin.write(f"{ifs_file}\n")
+                worker.stdin.flush()
+                if not (response := worker.stdout.readline()):
+                    # the worker died on this file. the next file starts a new one
+                    logger.error(f"{model} cGAN inference worker exited with status {worker.wait()} on {ifs_file}")
+                    worker = None
+                    results.put((ifs_file, 1))
+                    continue
+                results.put((ifs_file, json.loads(response)["status"]))
+        except Exception as err:
+            logger.error(f"{model} cGAN inference worker failed with error {err}")
+        finally:
+            if worker is not None:
+                worker.stdin.close()
+                worker.wait()
+            results.put(None)
+
+    workers = [threading.Thread(target=run_worker, daemon=True) for _ in range(min(max_workers, len(ifs_files)))]
+    for thread in workers:
+        thread.start()
+    running = len(workers)
+    try:
+        while running:
+            if (result := results.get()) is None:
+                running -= 1
+                continue
+            yield result
+    finally:
+        # a consumer that stops early must not leave inference running once it releases its processing lease
+        stop.set()
+        for thread in workers:
+            thread.join()
+
+
+if __name__ == "__main__":
+    serve_forecast_requests(entrypoint=sys.argv[1])
@@ -1,36 +1,42 @@
 import concurrent
+import resource
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from multiprocessing import cpu_count
+from multiprocessing import cpu_count, get_context
 from os import getenv
 from pathlib import Path
-from time import sleep
+from time import perf_counter, sleep
 
 import schedule
 import xarray as xr
 from loguru import logger
 from show_forecasts.constants import COUNTRY_NAMES, DATA_PARAMS
-from show_forecasts.data_utils import get_region_extent
 
-from fastcgan.jobs.data_sync import run_ecmwf_ifs_sync
+from fastcgan.jobs.catalog import register_forecast_file
+from fastcgan.jobs.data_sync import EcmwfSyncContext, run_ecmwf_ifs_sync, use_subset_download
 from fastcgan.jobs.icpac_ftp import sync_icpac_ifs_data
+from fastcgan.jobs.pipeline import enqueue_task, run_job_worker, use_job_queue
+from fastcgan.jobs.status import acquire_task_lease, get_job_cost, get_resource_limits, release_task_lease
 from fastcgan.jobs.stubs import open_ifs_literal
 from fastcgan.jobs.utils import (
+    get_country_bbox,
     get_data_store_path,
-    get_data_sycn_status,
     get_dataset_file_path,
     get_forecast_data_dates,
     get_possible_forecast_dates,
-    get_processing_task_status,
+    get_store_encoding,
     migrate_files,
-    set_data_sycn_status,
+    reset_data_sycn_status,
+    save_country_slices,
     slice_dataset_by_bbox,
     standardize_dataset,
+    use_chunked_store,
 )
 
 
 def read_dataset(
-    file_path: str | Path, mask_area: str | None = COUNTRY_NAMES[0]
+    file_path: str | Path, mask_area: str | None = COUNTRY_NAMES[0], index_path: Path | None = None
 ) -> xr.Dataset:
     try:
         import cfgrib
@@ -39,54 +45,104 @@ def read_dataset(
             f"cgrib is not available for ECMWF data processing. attempt failed with error {err}"
         )
     else:
+        data_params = [
+            data_param for data_param in DATA_PARAMS.keys() if data_param != "wind"
+        ]
+        data_params.extend(["u10", "v10"])
+        bbox = get_country_bbox(mask_area)
         try:
-            ds = cfgrib.open_datasets(str(file_path))
+            # hypercubes are opened lazily. field values are only decoded when the selection below is loaded
+            backend_kwargs = {}
+            if index_path is not None:
+                index_path.parent.mkdir(parents=True, exist_ok=True)
+                backend_kwargs["indexpath"] = str(index_path)
+            ds = cfgrib.open_datasets(str(file_path), backend_kwargs=backend_kwargs, chunks=get_grib2_read_chunks())
         except Exception as err:
             logger.error(f"failed to read {file_path} dataset file with error {err}")
             return None
-        if isinstance(ds, list):
-            arrays = []
-            for i in range(len(ds)):
-                if "number" in ds[i].dims:
-                    arrays.append(standardize_dataset(ds[i]))
-            try:
-                ds = xr.merge(arrays, compat="override")
-            except Exception as err:
-                logger.error(f"failed to read dataset {file_path} with error {err}")
         try:
-            data_params = [
-                data_param for data_param in DATA_PARAMS.keys() if data_param != "wind"
-            ]
-            data_params.extend(["u10", "v10"])
-            return slice_dataset_by_bbox(
-                standardize_dataset(ds[data_params]),
-                get_region_extent(shape_name=mask_area),
-            )
+            # select the variables and the mask area of each hypercube before anything is materialized,
+            # so that a step never holds more than one global field next to the mask area subset
+            arrays = []
+            for cube in ds if isinstance(ds, list) else [ds]:
+                if "number" not in cube.dims:
+                    continue
+                cube = standardize_dataset(cube)
+                names = [name for name in data_params if name in cube.data_vars]
+                if len(names) and (subset := slice_dataset_by_bbox(cube[names], bbox)) is not None:
+                    arrays.append(subset)
+            return xr.merge(arrays, compat="override")[data_params].load()
         except Exception as err:
             logger.error(f"processing for {file_path} failed with error {err}")
             return None
 
 
-def clean_grib2_index_files(source: str | None = "open-ifs"):
-    # remove idx files from the disk
+def get_grib2_read_chunks() -> dict[str, int] | None:
+    # dask chunks of the ensemble members when dask is installed. without it, xarray still defers reading
+    # to the selection, one field at a time
+    try:
+        import dask  # noqa: F401
+    except ImportError:
+        return None
+    return {"number": int(getenv("GRIB2_READ_CHUNK_MEMBERS", 10))}
+
+
+def reset_peak_memory() -> None:
+    # reset the resident memory high water mark of the process, so that pooled workers report it per step
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def get_peak_memory() -> float:
+    # peak resident memory of the process in MB
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_grib2_index_dir(source: str | None = "open-ifs") -> Path:
+    # cfgrib index files are kept beside the downloads, out of the way of the grib2 file listings
+    return get_data_store_path(source="jobs") / source / ".grib2-index"
+
+
+def get_grib2_index_path(grib2_file: Path, source: str | None = "open-ifs") -> Path:
+    # indexes are keyed by the size and modification time of the grib2 file, so that retries and re-runs of a step
+    # reuse the index of an unchanged file and a re-downloaded file gets a new one. {short_hash} is filled in by
+    # cfgrib with the hash of the index keys
+    stat = grib2_file.stat()
+    return get_grib2_index_dir(source) / f"{grib2_file.name}.{stat.st_size}-{stat.st_mtime_ns}.{{short_hash}}.idx"
+
+
+def clean_grib2_index_files(source: str | None = "open-ifs") -> None:
+    # remove the cached indexes of grib2 files that were processed or replaced since they were built, and idx
+    # files left beside the downloads by earlier versions. runs once per batch. files that cannot be removed
+    # are left to the next batch
     downloads_path = get_data_store_path(source="jobs") / source
-    idx_files = [
-        idxf for idxf in downloads_path.iterdir() if idxf.name.endswith(".idx")
-    ]
-    logger.info(
-        f"cleaning up grib2 index files {' -> '.join([idxf.name for idxf in idx_files])}"
+    index_dir = get_grib2_index_dir(source)
+    live_keys = set()
+    for grib2_file in downloads_path.glob("*.grib2") if downloads_path.exists() else []:
+        try:
+            live_keys.add(get_grib2_index_path(grib2_file, source).name.split(".{short_hash}")[0])
+        except OSError:
+            continue
+    idx_files = list(downloads_path.glob("*.idx")) if downloads_path.exists() else []
+    idx_files.extend(
+        idxf for idxf in (index_dir.glob("*.idx") if index_dir.exists() else []) if idxf.name.rsplit(".", 2)[0] not in live_keys
     )
+    if not len(idx_files):
+        return None
+    logger.info(f"cleaning up {len(idx_files)} stale grib2 index files")
     for idx_file in idx_files:
-        for _ in range(10):
-            try:
-                idx_file.unlink()
-            except Exception:
-                sleep(5)
-                pass
-            else:
-                break
-        if idx_file.exists():
-            logger.error(f"failed to delete grib2 index file {idx_file}")
+        try:
+            idx_file.unlink(missing_ok=True)
+        except Exception as err:
+            logger.warning(f"failed to delete grib2 index file {idx_file} with error {err}")
 
 
 def post_process_ecmwf_grib2_dataset(
@@ -97,11 +153,15 @@ def post_process_ecmwf_grib2_dataset(
     mask_region: str | None = COUNTRY_NAMES[0],
     save_for_countries: bool | None = True,
     archive_grib2: bool | None = False,
-    min_grib2_size: float | None = 5.9 * 1024,
-) -> None:
+    min_grib2_size: float | None = None,
+    country_names: list[str] = COUNTRY_NAMES[1:],
+) -> dict[str, float]:
+    # returns the time in seconds spent on each part of the step conversion and the peak memory of the step
+    # runs in the step workers of run_grib2_step_tasks, whose parent holds the processing lease of the source
     logger.info(f"executing post-processing task for {grib2_file_name}")
-    set_data_sycn_status(source=source, sync_type="processing", status=True)
-    clean_grib2_index_files()
+    reset_peak_memory()
+    timings = {}
+    start = perf_counter()
     data_date = datetime.strptime(grib2_file_name.split("-")[0], "%Y%m%d%H%M%S")
     downloads_path = get_data_store_path(source="jobs") / source
     grib2_file = downloads_path / grib2_file_name
@@ -115,8 +175,11 @@ def post_process_ecmwf_grib2_dataset(
     grib2_size = (
         0 if not grib2_file.exists() else grib2_file.stat().st_size / (1024 * 1024)
     )
+    # subset downloads are verified against the grib2 index and are much smaller than whole files
+    if min_grib2_size is None:
+        min_grib2_size = 0 if use_subset_download() else 5.9 * 1024
     # remove grib2 file if its size is less than the required size
-    if grib2_size < min_grib2_size:
+    if not grib2_file.exists() or grib2_size < min_grib2_size:
         grib2_file.unlink(missing_ok=True)
     elif not nc_file.exists() or force_process:
         logger.info(
@@ -124,9 +187,10 @@ def post_process_ecmwf_grib2_dataset(
         )
         ds = None
         for _ in range(re_try_times):
-            ds = read_dataset(grib2_file)
+            ds = read_dataset(grib2_file, index_path=get_grib2_index_path(grib2_file, source))
             if ds is not None:
                 break
+        timings["decode"] = perf_counter() - start
         if ds is None:
             logger.error(
                 f"failed to read {grib2_file} after {re_try_times} unsuccessful trials"
@@ -134,40 +198,37 @@ def post_process_ecmwf_grib2_dataset(
             grib2_file.unlink(missing_ok=True)
         else:
             try:
-                ds.to_netcdf(nc_file, mode="w", format="NETCDF4", engine="netcdf4")
+                write_start = perf_counter()
+                ds.to_netcdf(
+                    nc_file,
+                    mode="w",
+                    format="NETCDF4",
+                    engine="netcdf4",
+                    encoding=get_store_encoding(ds) if use_chunked_store() else None,
+                )
+                timings["write"] = perf_counter() - write_start
             except Exception as error:
                 logger.error(
                     f"failed to save {source} open ifs dataset slice for {mask_region} with error {error}"
                 )
             else:
-                if save_for_countries:
-                    for country_name in COUNTRY_NAMES[1:]:
-                        logger.info(
-                            f"processing {source} open ifs dataset slice for {country_name}"
-                        )
-                        sliced = slice_dataset_by_bbox(
-                            ds, get_region_extent(country_name)
-                        )
-                        slice_file = get_dataset_file_path(
-                            source=source,
-                            mask_region=country_name,
-                            data_date=data_date,
-                            file_name=nc_file_name,
-                        )
-                        logger.debug(
-                            f"saving {source} open ifs dataset slice for {country_name} into {slice_file}"
-                        )
-                        try:
-                            sliced.to_netcdf(
-                                path=slice_file,
-                                mode="w",
-                                format="NETCDF4",
-                                engine="netcdf4",
-                            )
-                        except Exception as error:
-                            logger.error(
-                                f"failed to save {source} open ifs dataset slice for {mask_region} with error {error}"
-                            )
+                register_forecast_file(file_path=nc_file, source=source)
+                # the chunked store serves country views on read instead of saving country copies
+                if save_for_countries and not use_chunked_store():
+                    logger.info(f"processing {source} open ifs dataset slices for {len(country_names)} countries")
+                    slices_start = perf_counter()
+                    for error in save_country_slices(
+                        ds=ds,
+                        source=source,
+                        data_date=data_date,
+                        file_name=nc_file_name,
+                        country_names=country_names,
+                        engine="netcdf4",
+                        # slices are written by the step worker itself. the steps cost counts one process per worker
+                        max_workers=1,
+                    ):
+                        logger.error(error)
+                    timings["slices"] = perf_counter() - slices_start
                 # remove grib2 file from disk
                 if not archive_grib2:
                     logger.info(
@@ -199,68 +260,133 @@ def post_process_ecmwf_grib2_dataset(
                             f"failed to archive {grib2_file_name} to {archive_dir} with error {err}"
                         )
 
-                # remove idx files from the disk
-                idx_files = [
-                    idxf
-                    for idxf in downloads_path.iterdir()
-                    if idxf.name.endswith(".idx")
-                ]
-                logger.info(
-                    f"cleaning up grib2 index files {' -> '.join([idxf.name for idxf in idx_files])}"
-                )
-                for idx_file in idx_files:
-                    for _ in range(10):
-                        try:
-                            idx_file.unlink()
-                        except Exception:
-                            sleep(5)
-                            pass
-                        else:
-                            break
-                    if idx_file.exists():
-                        logger.error(f"failed to delete grib2 index file {idx_file}")
+    timings["total"] = perf_counter() - start
+    # peak resident memory of the step in MB, which is what GRIB2_STEP_MEMORY should cover
+    timings["peak_memory"] = get_peak_memory()
+    logger.info(
+        f"post-processed {grib2_file_name} in {timings['total']:.1f}s with {timings['peak_memory']:.0f}MB peak memory. "
+        + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items() if name not in ["total", "peak_memory"])
+    )
+    return timings
 
-    set_data_sycn_status(source=source, sync_type="processing", status=False)
 
+def get_grib2_step_memory() -> float:
+    # GB held by a worker while it decodes a global ensemble step and slices it
+    return float(getenv("GRIB2_STEP_MEMORY", 3))
 
-def post_process_downloaded_ecmwf_forecasts(
+
+def get_grib2_workers(steps: int) -> int:
+    # step decoding is single threaded, so workers are bounded by cores and by the memory of a step decode
+    if (workers := getenv("GRIB2_WORKERS")):
+        return max(1, min(int(workers), steps))
+    cpus, memory = get_resource_limits()
+    return max(1, min(int(cpus), int(memory // get_grib2_step_memory()), steps))
+
+
+def get_grib2_steps_cost(source: str, steps: int) -> tuple[int, tuple[float, float]]:
+    # step workers and the (cpus, memory) they reserve. the lease covers every step worker of the pool
+    max_workers = get_grib2_workers(steps)
+    cpus, memory = get_job_cost(source)
+    return max_workers, (max(cpus, max_workers), max(memory, max_workers * get_grib2_step_memory()))
+
+
+def run_grib2_step_tasks(
+    grib2_files: list[str],
     source: open_ifs_literal | None = "open-ifs",
+    force_process: bool | None = False,
+    max_workers: int | None = None,
+    country_names: list[str] = COUNTRY_NAMES[1:],
 ) -> None:
+    # convert the steps in a process pool. each step is decoded, sliced and written independently
+    max_workers = max_workers if max_workers is not None else get_grib2_workers(len(grib2_files))
+    logger.info(f"post-processing {len(grib2_files)} {source} grib2 steps with {max_workers} workers")
+    start = perf_counter()
+    timings = {}
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+        results = {
+            executor.submit(
+                post_process_ecmwf_grib2_dataset,
+                source=source,
+                grib2_file_name=grib2_file,
+                force_process=force_process,
+                country_names=country_names,
+            ): grib2_file
+            for grib2_file in grib2_files
+        }
+        for future in concurrent.futures.as_completed(results):
+            try:
+                timings[results[future]] = future.result()
+            except Exception as err:
+                logger.error(f"post-processing of {results[future]} failed with error {err}")
+    # the indexes of the processed steps are stale now
+    clean_grib2_index_files(source=source)
+    busy = sum(step_timings.get("total", 0) for step_timings in timings.values())
+    elapsed = perf_counter() - start
+    logger.info(
+        f"post-processed {len(timings)} of {len(grib2_files)} {source} grib2 steps in {elapsed:.1f}s "
+        + f"for {busy:.1f}s of step processing. {busy / max(elapsed, 1e-6):.1f}x speedup. "
+        + f"{max([step_timings.get('peak_memory', 0) for step_timings in timings.values()] or [0]):.0f}MB peak step memory"
+    )
+
+
+def post_process_ecmwf_grib2_files(
+    grib2_files: list[str],
+    source: open_ifs_literal | None = "open-ifs",
+    force_process: bool | None = False,
+    wait: bool | None = True,
+) -> bool:
+    # run infinite loop that is executed when the machine has room for the grib2 conversion.
+    # returns False without waiting when the resources are in use and wait is False
+    while True:
+        max_workers, cost = get_grib2_steps_cost(source=source, steps=len(grib2_files))
+        if acquire_task_lease(sync_type="processing", source=source, cost=cost):
+            try:
+                run_grib2_step_tasks(
+                    grib2_files=grib2_files,
+                    source=source,
+                    force_process=force_process,
+                    max_workers=max_workers,
+                )
+            finally:
+                release_task_lease(sync_type="processing", source=source)
+            return True
+        if not wait:
+            return False
+        # sleep for 10 minutes
+        sleep(60 * 10)
+
+
+def post_process_downloaded_ecmwf_forecasts(
+    source: open_ifs_literal | None = "open-ifs",
+    wait: bool | None = True,
+) -> bool:
     try:
         import cfgrib  # noqa: F401
     except Exception as err:
         logger.error(
             f"cgrib is not available for ECMWF data processing. attempt failed with error {err}"
         )
-    else:
-        # run infinite loop that is executed when there are no other active workers
-        while True:
-            if not get_processing_task_status():
-                downloads_path = get_data_store_path(source="jobs") / source
-                if downloads_path.exists():
-                    grib2_files = [
-                        dfile.name
-                        for dfile in downloads_path.iterdir()
-                        if dfile.name.endswith(".grib2")
-                    ]
-                    if not len(grib2_files):
-                        logger.warning(
-                            "no un-processed open-ifs datasets found. task skipped!"
-                        )
-                    else:
-                        logger.info(
-                            f"starting batch post-processing tasks for {'  <---->  '.join(grib2_files)}"
-                        )
-                        for grib2_file in grib2_files:
-                            post_process_ecmwf_grib2_dataset(
-                                source=source,
-                                grib2_file_name=grib2_file,
-                                force_process=True,
-                            )
-                # break the loop
-                break
-            # sleep for 10 minutes
-            sleep(60 * 10)
+        return True
+    downloads_path = get_data_store_path(source="jobs") / source
+    grib2_files = [
+        dfile.name
+        for dfile in downloads_path.iterdir()
+        if dfile.name.endswith(".grib2")
+    ] if downloads_path.exists() else []
+    if not len(grib2_files):
+        logger.warning(
+            "no un-processed open-ifs datasets found. task skipped!"
+        )
+        return True
+    logger.info(
+        f"starting batch post-processing tasks for {'  <---->  '.join(grib2_files)}"
+    )
+    return post_process_ecmwf_grib2_files(
+        grib2_files=grib2_files,
+        source=source,
+        force_process=True,
+        wait=wait,
+    )
 
 
 def syncronize_open_ifs_forecast_data(
@@ -275,77 +401,72 @@ def syncronize_open_ifs_forecast_data(
         + f"{dt_fx} with time steps {start_step} to {final_step} and {dateback} days back"
     )
 
-    if not get_data_sycn_status(source="open-ifs", sync_type="download"):
-        mask_region = getenv("DEFAULT_MASK", COUNTRY_NAMES[0])
-        sync_icpac_ifs = (
-            True
-            if getenv("USE_ICPAC_IFS", "false").lower()
-            in ["yes", "y", "true", "t", "1"]
-            else False
-        )
-        if not sync_icpac_ifs:
-            try:
-                import cfgrib  # noqa: F401
-            except Exception as err:
-                sync_icpac_ifs = True
-                logger.error(
-                    f"cgrib is not available for ECMWF data processing. attempt failed with error {err}"
-                )
-        if sync_icpac_ifs:
-            sync_icpac_ifs_data(model="open-ifs")
-        else:
-            logger.info(
-                f"starting open-ifs forecast data syncronization for {mask_region} at "
-                + f"{datetime.now().strftime('%Y-%m-%d %H:%M')} {dt_fx} with time steps "
-                + f"{start_step} to {final_step} and {dateback} days back"
-            )
-            # generate download parameters
-            data_dates = get_possible_forecast_dates(
-                data_date=date_str, dateback=dateback
+    if acquire_task_lease(sync_type="download", source="open-ifs"):
+        try:
+            mask_region = getenv("DEFAULT_MASK", COUNTRY_NAMES[0])
+            sync_icpac_ifs = (
+                True
+                if getenv("USE_ICPAC_IFS", "false").lower()
+                in ["yes", "y", "true", "t", "1"]
+                else False
             )
-            ifs_dates = [
-                datetime.strptime(value, "%b %d, %Y").date()
-                for value in get_forecast_data_dates(
-                    source="open-ifs", mask_region=mask_region
+            if not sync_icpac_ifs:
+                try:
+                    import cfgrib  # noqa: F401
+                except Exception as err:
+                    sync_icpac_ifs = True
+                    logger.error(
+                        f"cgrib is not available for ECMWF data processing. attempt failed with error {err}"
+                    )
+            if sync_icpac_ifs:
+                sync_icpac_ifs_data(model="open-ifs")
+            else:
+                logger.info(
+                    f"starting open-ifs forecast data syncronization for {mask_region} at "
+                    + f"{datetime.now().strftime('%Y-%m-%d %H:%M')} {dt_fx} with time steps "
+                    + f"{start_step} to {final_step} and {dateback} days back"
                 )
-            ]
-
-            # set data syncronization status
-            set_data_sycn_status(sync_type="download", source="open-ifs", status=True)
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=int(cpu_count() / 2)
-            ) as executor:
-                # TODO: use coiled to run parallel download jobs
-                results = [
-                    executor.submit(
-                        run_ecmwf_ifs_sync,
-                        data_date=data_date,
-                        start_step=start_step,
-                        final_step=final_step,
+                # generate download parameters
+                data_dates = get_possible_forecast_dates(
+                    data_date=date_str, dateback=dateback
+                )
+                ifs_dates = [
+                    datetime.strptime(value, "%b %d, %Y").date()
+                    for value in get_forecast_data_dates(
+                        source="open-ifs", mask_region=mask_region
                     )
-                    for data_date in [
-                        value for value in data_dates if value not in ifs_dates
-                    ]
                 ]
-                for future in concurrent.futures.as_completed(results):
-                    if future.result() is not None:
+
+                # every date of the run shares the latest forecast probe and the http connections
+                with EcmwfSyncContext() as context, concurrent.futures.ThreadPoolExecutor(
+                    max_workers=int(cpu_count() / 2)
+                ) as executor:
+                    # TODO: use coiled to run parallel download jobs
+                    results = [
+                        executor.submit(
+                            run_ecmwf_ifs_sync,
+                            data_date=data_date,
+                            start_step=start_step,
+                            final_step=final_step,
+                            context=context,
+                        )
+                        for data_date in [
+                            value for value in data_dates if value not in ifs_dates
+                        ]
+                    ]
+                    for future in concurrent.futures.as_completed(results):
                         grib2_files = future.result()
-                        if grib2_files is not None:
-                            # run infinite loop that is executed when there are no other active workers
-                            while True:
-                                # TODO: use coiled to perform parallel processing
-                                if not get_processing_task_status():
-                                    for grib2_file in grib2_files:
-                                        post_process_ecmwf_grib2_dataset(
-                                            grib2_file_name=grib2_file
-                                        )
-                                    # break the loop at the end of execution
-                                    break
-                                # sleep for 10 minutes
-                                sleep(60 * 10)
-
-        # set data syncronization status
-        set_data_sycn_status(sync_type="download", source="open-ifs", status=False)
+                        if grib2_files is not None and len(grib2_files):
+                            # hand each downloaded forecast over to the job queue worker as soon as it completes
+                            if not use_job_queue() or not enqueue_task(
+                                "process_downloads_task",
+                                model="open-ifs",
+                                trigger=grib2_files[0].split("-")[0],
+                                file_names=grib2_files,
+                            ):
+                                post_process_ecmwf_grib2_files(grib2_files=grib2_files)
+        finally:
+            release_task_lease(sync_type="download", source="open-ifs")
 
 
 if __name__ == "__main__":
@@ -355,7 +476,7 @@ if __name__ == "__main__":
         "--command",
         dest="command",
         type=str,
-        help="command to be executed. either download or process",
+        help="command to be executed. either download, process, migrate or worker",
         default=None,
     )
     parser.add_argument(
@@ -397,8 +518,7 @@ if __name__ == "__main__":
         if key != "command" and value is not None
     }
     data_model = "open-ifs"
-    set_data_sycn_status(source=data_model, sync_type="download", status=False)
-    set_data_sycn_status(source=data_model, sync_type="processing", status=False)
+    reset_data_sycn_status(source=data_model)
     if args.command == "download":
         syncronize_open_ifs_forecast_data(**dict_args)
     elif args.command == "migrate":
@@ -409,6 +529,8 @@ if __name__ == "__main__":
         )
         post_process_downloaded_ecmwf_forecasts(data_model)
         syncronize_open_ifs_forecast_data(**dict_args)
+    elif args.command == "worker" or (args.command is None and use_job_queue()):
+        run_job_worker(model=data_model)
     else:
         # drop to scheduler by defaukt
         schedule.every().hour.do(syncronize_open_ifs_forecast_data, **dict_args)
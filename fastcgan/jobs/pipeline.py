@@ -0,0 +1,124 @@
+import asyncio
+from os import getenv
+
+from arq import Retry, create_pool, cron, run_worker
+from arq.connections import RedisSettings
+from loguru import logger
+
+from fastcgan.tools.config import settings
+
+# cGAN models that consume the post-processed IFS forecasts of each source
+IFS_SOURCE_MODELS = {
+    "cgan-ifs-6h-ens": ["jurre-brishti-ens", "jurre-brishti-count"],
+    "cgan-ifs-7d-ens": ["mvua-kubwa-ens", "mvua-kubwa-count"],
+}
+
+
+def use_job_queue() -> bool:
+    return getenv("USE_JOB_QUEUE", "false").lower() in ["yes", "y", "true", "t", "1"]
+
+
+def get_queue_name(model: str) -> str:
+    return f"fastcgan:jobs:{model}"
+
+
+def get_redis_settings() -> RedisSettings:
+    return RedisSettings(host=settings.REDIS_QUEUE_HOST, port=settings.REDIS_QUEUE_PORT)
+
+
+async def _enqueue_task(task_name: str, model: str, job_id: str, **kwargs) -> bool:
+    pool = await create_pool(get_redis_settings())
+    try:
+        job = await pool.enqueue_job(task_name, model, _job_id=job_id, _queue_name=get_queue_name(model), **kwargs)
+    finally:
+        await pool.aclose()
+    return job is not None
+
+
+def enqueue_task(task_name: str, model: str, trigger: str | None = None, **kwargs) -> bool:
+    """Enqueue `task_name` on the job queue of `model` and return whether it was queued.
+
+    Tasks with the same `trigger` are only queued once while pending. Returns False when the
+    queue is unavailable, in which case the scheduled runs pick the work up.
+    """
+    job_id = f"{task_name}:{model}" + ("" if trigger is None else f":{trigger}")
+    try:
+        queued = asyncio.run(_enqueue_task(task_name, model, job_id=job_id, **kwargs))
+    except Exception as err:
+        logger.error(f"failed to enqueue {job_id} with error {err}")
+        return False
+    logger.debug(f"{'enqueued' if queued else 'skipped already queued'} task {job_id}")
+    return True
+
+
+def enqueue_forecast_generation(ifs_source: str, trigger: str | None = None) -> None:
+    for model in IFS_SOURCE_MODELS.get(ifs_source, []):
+        enqueue_task("generate_forecasts_task", model=model, trigger=trigger)
+
+
+async def sync_source_task(ctx: dict, model: str | None = None) -> None:
+    model = ctx["model"] if model is None else model
+    if model == "open-ifs":
+        from fastcgan.jobs.open_ifs import syncronize_open_ifs_forecast_data
+
+        await asyncio.to_thread(syncronize_open_ifs_forecast_data)
+    else:
+        from fastcgan.jobs.cgan_ifs import syncronize_post_processed_ifs_data
+
+        await asyncio.to_thread(syncronize_post_processed_ifs_data, model=model)
+
+
+async def process_downloads_task(ctx: dict, model: str | None = None, file_names: list[str] | None = None) -> None:
+    model = ctx["model"] if model is None else model
+    if model == "open-ifs":
+        from fastcgan.jobs.open_ifs import post_process_downloaded_ecmwf_forecasts, post_process_ecmwf_grib2_files
+
+        if file_names is None:
+            processed = await asyncio.to_thread(post_process_downloaded_ecmwf_forecasts, wait=False)
+        else:
+            processed = await asyncio.to_thread(post_process_ecmwf_grib2_files, grib2_files=file_names, wait=False)
+    else:
+        from fastcgan.jobs.cgan_ifs import post_process_downloaded_cgan_ifs
+
+        processed = await asyncio.to_thread(post_process_downloaded_cgan_ifs, model=model, wait=False)
+    if not processed:
+        # the machine has no room for the processing job. retry shortly instead of sleeping for a schedule tick
+        raise Retry(defer=int(getenv("JOBS_RETRY_DEFER", 30)))
+
+
+async def generate_forecasts_task(ctx: dict, model: str | None = None) -> None:
+    from fastcgan.jobs.cgan_ifs import generate_cgan_forecasts
+
+    model = ctx["model"] if model is None else model
+    if not await asyncio.to_thread(generate_cgan_forecasts, model=model, wait=False):
+        raise Retry(defer=int(getenv("JOBS_RETRY_DEFER", 30)))
+
+
+class WorkerSettings:
+    functions = [sync_source_task, process_downloads_task, generate_forecasts_task]
+    # processing can start while a sync task is still downloading. results are not kept so that triggers can be re-queued
+    max_jobs = 2
+    keep_result = 0
+    job_timeout = int(getenv("JOBS_TIMEOUT", 6 * 60 * 60))
+    max_tries = int(getenv("JOBS_MAX_TRIES", 240))
+
+
+def run_job_worker(model: str) -> None:
+    async def on_startup(ctx: dict) -> None:
+        # cron jobs are called without arguments and read the model of this worker from the context
+        ctx["model"] = model
+
+    # hourly runs remain as a safety net for data that arrives without a download event
+    cron_jobs = []
+    if model == "open-ifs" or "ens" in model:
+        cron_jobs.append(cron(sync_source_task, name=f"sync-{model}", minute=0, run_at_startup=True))
+    if model != "open-ifs":
+        cron_jobs.append(cron(generate_forecasts_task, name=f"generate-{model}", minute=30, run_at_startup=True))
+    logger.info(f"starting {model} job queue worker on {get_queue_name(model)}")
+    run_worker(
+        WorkerSettings,
+        queue_name=get_queue_name(model),
+        redis_settings=get_redis_settings(),
+        cron_jobs=cron_jobs,
+        on_startup=on_startup,
+    )
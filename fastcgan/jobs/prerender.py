@@ -0,0 +1,155 @@
+import asyncio
+import concurrent
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+from multiprocessing import get_context
+from os import getenv
+from pathlib import Path
+from time import monotonic
+
+from loguru import logger
+from show_forecasts.constants import COUNTRY_NAMES
+
+from fastcgan.jobs.stubs import cgan_model_literal
+from fastcgan.jobs.utils import get_gan_forecast_dates
+from fastcgan.tools.constants import PRERENDER_MATRIX
+from fastcgan.tools.enums import (
+    AccumulationTime,
+    IfsDataParameter,
+    InitializationTime,
+    MapColorScheme,
+    PrecipitationUnit,
+    ValidityTime,
+)
+from fastcgan.utils.render import warm_render_worker
+from fastcgan.views.forecast import render_cgan_map
+from fastcgan.views.tools import get_forecast_maps_path
+
+
+def get_prerender_tasks(
+    model: cgan_model_literal,
+    data_date: datetime,
+    init_time: str,
+) -> list[tuple[Path, dict]]:
+    matrix = PRERENDER_MATRIX["mvua-kubwa" if "mvua-kubwa" in model else "jurre-brishti"]
+    mask_areas = getenv("PRERENDER_MASK_AREAS", ",".join(COUNTRY_NAMES)).split(",")
+    color_styles = getenv("PRERENDER_COLOR_STYLES", MapColorScheme.icpac.value).split(",")
+    plot_units = getenv("PRERENDER_PLOT_UNITS", ",".join(matrix["plot_units"])).split(",")
+    init_time_enum = InitializationTime(f"{init_time}h")
+    acc_time = AccumulationTime(matrix["acc_time"])
+    tasks = []
+    # earlier entries of each list take priority over later ones
+    for mask_area, color_style, plot_unit, valid_time in product(mask_areas, color_styles, plot_units, matrix["valid_times"]):
+        maps_path = asyncio.run(
+            get_forecast_maps_path(
+                source=model,
+                vis_param=IfsDataParameter.tp,
+                plot_units=PrecipitationUnit(plot_unit),
+                data_date=data_date,
+                mask_area=mask_area,
+                color_style=MapColorScheme(color_style),
+                init_time=init_time_enum,
+                acc_time=acc_time,
+                valid_time=ValidityTime(valid_time),
+            )
+        )
+        if maps_path[-1].exists():
+            continue
+        tasks.append(
+            (
+                maps_path[-1],
+                {
+                    "plot_type": "forecast",
+                    "model": model,
+                    "init_date": data_date,
+                    "init_time": init_time,
+                    "mask_area": mask_area,
+                    "style": color_style,
+                    "plot_units": plot_unit,
+                    "accumulation_time": acc_time.value,
+                    "valid_time_start_hour": valid_time,
+                    "file_name": str(maps_path[-1]),
+                },
+            )
+        )
+    return tasks
+
+
+def _check_prerender_result(future: concurrent.futures.Future, file_path: Path) -> int:
+    try:
+        if future.result():
+            return 1
+        logger.warning(f"failed to pre-render {file_path.name}")
+    except Exception as err:
+        logger.error(f"failed to pre-render {file_path.name} with error {err}")
+    return 0
+
+
+def prerender_forecast_maps(
+    model: cgan_model_literal,
+    data_date: datetime,
+    init_time: str,
+    max_workers: int | None = None,
+    max_maps: int | None = None,
+    time_budget: int | None = None,
+) -> int:
+    if getenv("PRERENDER_MAPS", "true").lower() not in ["yes", "y", "true", "t", "1"]:
+        logger.debug(f"pre-rendering of {model} forecast maps is disabled")
+        return 0
+    date_key = f"{data_date.strftime('%Y%m%d')}_{init_time}"
+    if date_key not in get_gan_forecast_dates(source=model, mask_region=None):
+        logger.warning(f"{model} forecast for {date_key} is not available. pre-rendering task skipped!")
+        return 0
+    max_workers = max_workers if max_workers is not None else int(getenv("PRERENDER_WORKERS", 2))
+    max_maps = max_maps if max_maps is not None else int(getenv("PRERENDER_MAX_MAPS", 60))
+    time_budget = time_budget if time_budget is not None else int(getenv("PRERENDER_TIME_BUDGET", 900))
+    tasks = get_prerender_tasks(model=model, data_date=data_date, init_time=init_time)[:max_maps]
+    logger.info(f"pre-rendering {len(tasks)} {model} forecast maps for {date_key} with {max_workers} workers and a {time_budget}s budget")
+    rendered, start = 0, monotonic()
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=get_context("spawn"),
+        initializer=warm_render_worker,
+    ) as executor:
+        results = {}
+        # keep at most max_workers renders in flight so that the time budget is checked between renders
+        for file_path, kwargs in tasks:
+            results[executor.submit(render_cgan_map, **kwargs)] = file_path
+            if len(results) < max_workers:
+                continue
+            done, _ = concurrent.futures.wait(results, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                rendered += _check_prerender_result(future=future, file_path=results.pop(future))
+            if monotonic() - start > time_budget:
+                logger.warning(f"pre-rendering time budget of {time_budget}s exhausted. remaining {model} maps are rendered on request")
+                break
+        for future in concurrent.futures.as_completed(results):
+            rendered += _check_prerender_result(future=future, file_path=results[future])
+    logger.info(f"pre-rendered {rendered} {model} forecast maps for {date_key} in {round(monotonic() - start, 2)}s")
+    return rendered
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="prerender",
+        description="a program for pre-rendering the default cGAN forecast maps for a forecast date",
+        usage="python prerender.py -m <model> -d <YYYY-MM-DD> -t <init-time>",
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        dest="model",
+        type=str,
+        default="jurre-brishti-ens",
+        help="forecast model. options are: jurre-brishti-ens,mvua-kubwa-ens,jurre-brishti-count,mvua-kubwa-count",
+    )
+    parser.add_argument("-d", "--date", dest="date_str", type=str, required=True, help="forecast date in the format YYYY-MM-DD")
+    parser.add_argument("-t", "--init-time", dest="init_time", type=str, default="00", help="forecast initialization hour")
+    args = parser.parse_args()
+    prerender_forecast_maps(
+        model=args.model,
+        data_date=datetime.strptime(args.date_str, "%Y-%m-%d"),
+        init_time=args.init_time,
+    )
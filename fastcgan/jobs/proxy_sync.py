@@ -5,6 +5,9 @@ import requests
 from bs4 import BeautifulSoup
 from loguru import logger
 
+from fastcgan.jobs.catalog import register_forecast_file
+from fastcgan.jobs.crawler import crawl_dataset_links
+from fastcgan.jobs.downloads import is_valid_netcdf, stream_download
 from fastcgan.jobs.utils import get_data_store_path
 
 
@@ -20,20 +23,12 @@ def crawl_http_dataset_links(data_page: str) -> list[str]:
     return data_files
 
 
-def deep_crawl_http_dataset_links(data_page: str, data_ext: str | None = "nc", links: set[str] | None = set()) -> list[str]:
-    r = requests.get(data_page, allow_redirects=True)
-    if r.status_code == 200:
-        soup = BeautifulSoup(r.text, features="html.parser")
-        for a in soup.find_all("a"):
-            href = f"{data_page}/{a['href']}"
-            if href.endswith(data_ext):
-                links.add(href)
-            elif "../" not in href and "//ICPAC" not in href and href.endswith("/"):
-                links = deep_crawl_http_dataset_links(data_page=href[:-1], links=links)
-        logger.info(f"crawled a total of {len(links)} data files from {data_page}")
-    else:
-        logger.warning(f"failed to crawl links from {data_page} with status code {r.status_code} and response text {r.text}")
-    return links
+def get_proxy_child_pages(data_page: str, href: str) -> list[str]:
+    return [href[:-1]] if "../" not in href and "//ICPAC" not in href and href.endswith("/") else []
+
+
+def deep_crawl_http_dataset_links(data_page: str, data_ext: str | None = "nc") -> set[str]:
+    return crawl_dataset_links(data_pages=[data_page], data_ext=data_ext, get_child_pages=get_proxy_child_pages)
 
 
 def make_dataset_path(dataset_url: str, data_source: str, trim_part: str | None = "") -> None:
@@ -76,19 +71,8 @@ def download_ens_dataset(source: str, link: str):
     file_path = destination / file_name
     if not file_path.exists():
         logger.debug(f"trying download of {link}")
-        try:
-            with requests.get(link, stream=True) as r:
-                logger.debug(f"downloading {link} into {file_path}")
-
-                if r.status_code == 200:
-                    with file_path.open(mode="wb") as f:
-                        f.write(r.content)
-                    logger.info(f"Finished downloading {link}.\t" + f"Data stream was saved into {file_path.name}")
-                else:
-                    logger.error(f"failed to download dataset file {link} " + f"with http response {r.text}")
-
-        except Exception as err:
-            logger.error(f"failed to download {link} with error {err}")
+        if stream_download(url=link, file_path=file_path, validate=is_valid_netcdf):
+            register_forecast_file(file_path=file_path, source=f"{source}-count")
 
 
 def sync_data_source(
@@ -116,23 +100,14 @@ def sync_data_source(
             )
             for datafile_url in data_urls:
                 logger.debug(f"trying download of {datafile_url}")
-                try:
-                    relative_path = datafile_url.replace(provider_url, "").replace(f"/{source}", "")
-                    destination = get_data_store_path(source=source) / f"{relative_path}".replace("%20", " ")
-                    with requests.get(datafile_url, stream=True) as r:
-                        logger.debug(f"downloading {datafile_url} into {destination}")
-
-                        if r.status_code == 200:
-                            with destination.open(mode="wb") as f:
-                                f.write(r.content)
-                        else:
-                            logger.error(f"failed to download dataset file {datafile_url} with error {r.text}")
-                            return None
-
-                        logger.debug(f"Finished downloading {datafile_url}.\nData stream was saved in {f.name}")
-
-                except Exception as e:
-                    logger.error(f"Error *{e}*")
+                relative_path = datafile_url.replace(provider_url, "").replace(f"/{source}", "")
+                destination = get_data_store_path(source=source) / f"{relative_path}".replace("%20", " ")
+                if stream_download(
+                    url=datafile_url,
+                    file_path=destination,
+                    validate=is_valid_netcdf if destination.suffix == ".nc" else None,
+                ):
+                    register_forecast_file(file_path=destination, source=source)
 
 
 data_source_options = "cgan-forecast,mvua-kubwa,jurre-brishti,cgan-ifs,open-ifs"
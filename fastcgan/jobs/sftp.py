@@ -1,8 +1,12 @@
 import concurrent
+import os
+import queue
+import threading
 from argparse import ArgumentParser
-from multiprocessing import cpu_count
+from contextlib import contextmanager
 from os import getenv
 from pathlib import Path
+from time import sleep
 
 from loguru import logger
 from paramiko import AutoAddPolicy, SFTPClient
@@ -19,11 +23,9 @@ def get_sftp_session(
     key_file: str | None = None,
     allow_agent: bool | None = False,
     look_for_keys: bool | None = False,
-    max_retry: int | None = 50,
-) -> SFTPClient | str:
-    client = SSHClient()
-    client.set_missing_host_key_policy(AutoAddPolicy())
-    retry_count, trial_error = (0, None)
+    max_retry: int | None = 8,
+    keepalive: int | None = 30,
+) -> SFTPClient:
     hostname = host if host is not None else getenv("IFS_SERVER_HOST", "domain.example")
     username = user if user is not None else getenv("IFS_SERVER_USER", "username")
     private_key = (
@@ -34,7 +36,10 @@ def get_sftp_session(
     assert (
         f"{username}@{hostname}" != "username@domain.example"
     ), "you must specify IFS data source server address"
-    while retry_count != max_retry:
+    trial_error = None
+    for retry_count in range(max_retry):
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
         try:
             client.connect(
                 hostname=hostname,
@@ -44,42 +49,135 @@ def get_sftp_session(
                 allow_agent=allow_agent,
                 look_for_keys=look_for_keys,
             )
+            # keep idle pooled sessions from being dropped by the server or firewalls
+            client.get_transport().set_keepalive(keepalive)
             return client.open_sftp()
         except Exception as err:
+            client.close()
             trial_error = err
-            retry_count += 1
-    return trial_error
+            delay = min(2**retry_count, 60)
+            logger.warning(f"failed to open sftp session to {hostname} with error {err}. retrying in {delay} seconds")
+            sleep(delay)
+    raise ConnectionError(f"failed to open sftp session to {hostname} after {max_retry} trials with error {trial_error}")
+
+
+class SFTPSessionPool:
+    # a bounded pool of sftp sessions shared by the transfer workers, so that each ssh handshake is reused across files
+    def __init__(self, size: int, **session_kwargs):
+        self.session_kwargs = session_kwargs
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle: queue.LifoQueue[SFTPClient] = queue.LifoQueue()
+        self.sessions: list[SFTPClient] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def session(self):
+        self.slots.acquire()
+        sftp = None
+        try:
+            try:
+                sftp = self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            if sftp is None or not sftp.get_channel().get_transport().is_active():
+                self.discard(sftp)
+                sftp = get_sftp_session(**self.session_kwargs)
+                with self.lock:
+                    self.sessions.append(sftp)
+            yield sftp
+        except Exception:
+            # the session state is unknown after a failed transfer. open a fresh one for the next file
+            self.discard(sftp)
+            sftp = None
+            raise
+        finally:
+            if sftp is not None:
+                self.idle.put(sftp)
+            self.slots.release()
+
+    def discard(self, sftp: SFTPClient | None) -> None:
+        if sftp is None:
+            return None
+        with self.lock:
+            if sftp in self.sessions:
+                self.sessions.remove(sftp)
+        try:
+            sftp.get_channel().get_transport().close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for sftp in sessions:
+            try:
+                sftp.get_channel().get_transport().close()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def fetch_remote_file(
+    pool: SFTPSessionPool,
     remote_path: str,
     local_path: str,
-    host: str | None = None,
-    user: str | None = None,
-    key_file: str | None = None,
+    chunk_size: int | None = 1024 * 1024,
 ) -> str | None:
     file_name = remote_path.split("/")[-1]
     logger.debug(f"received sftp data download for {file_name}")
-    sftp = get_sftp_session(host=host, user=user, key_file=key_file)
-    if isinstance(sftp, str):
-        logger.error(f"failed to open sftp transfer tunnel with error {sftp}")
-        return None
-    logger.debug(f"successfully opened sftp transfer tunnel for {file_name}")
     if not Path(local_path).exists():
-        Path(local_path).mkdir(parents=True)
+        Path(local_path).mkdir(parents=True, exist_ok=True)
+    target_file = Path(f"{local_path}/{file_name}")
+    # data is streamed into a partial file which is only renamed into place once complete.
+    # post-processing only picks up .nc files, so it never opens a partial transfer
+    partial_file = target_file.with_name(f"{file_name}.part")
     try:
-        logger.debug(
-            f"fetching data contents for {remote_path} and saving into {local_path}/{file_name}"
-        )
-        # stream data and save on disk for ingestion
-        sftp.get(remotepath=remote_path, localpath=Path(f"{local_path}/{file_name}"))
+        with pool.session() as sftp:
+            remote_stat = sftp.stat(remote_path)
+            if target_file.exists() and target_file.stat().st_size == remote_stat.st_size:
+                logger.debug(f"{file_name} is already downloaded and awaiting post-processing")
+                return file_name
+            offset = 0
+            if partial_file.exists():
+                # partial files carry the remote mtime, so a file replaced on the server is fetched afresh
+                if int(partial_file.stat().st_mtime) == int(remote_stat.st_mtime) and partial_file.stat().st_size <= remote_stat.st_size:
+                    offset = partial_file.stat().st_size
+                else:
+                    partial_file.unlink()
+            logger.debug(
+                f"fetching data contents for {remote_path} and saving into {target_file}"
+                + ("" if not offset else f" resuming from byte {offset}")
+            )
+            try:
+                # stream data and save on disk for ingestion. prefetch pipelines the read requests
+                with sftp.open(remote_path, "rb") as remote_file, partial_file.open("ab" if offset else "wb") as local_file:
+                    remote_file.seek(offset)
+                    remote_file.prefetch(remote_stat.st_size)
+                    while data := remote_file.read(chunk_size):
+                        local_file.write(data)
+            finally:
+                if partial_file.exists():
+                    os.utime(partial_file, (remote_stat.st_atime, remote_stat.st_mtime))
     except Exception as err:
         logger.error(
             f"failed to fetch sftp file from path {remote_path} with error {err}"
         )
         return None
+    if partial_file.stat().st_size != remote_stat.st_size:
+        logger.error(
+            f"incomplete sftp download of {remote_path}. received {partial_file.stat().st_size} of {remote_stat.st_size} bytes"
+        )
+        if partial_file.stat().st_size > remote_stat.st_size:
+            partial_file.unlink()
+        return None
+    partial_file.replace(target_file)
     logger.info(
-        f"successfully downloaded data file {remote_path} and saved into {local_path}/{file_name}"
+        f"successfully downloaded data file {remote_path} and saved into {target_file}"
     )
     return file_name
 
@@ -89,47 +187,53 @@ def sync_sftp_data_files(
     host: str | None = None,
     user: str | None = None,
     key_file: str | None = None,
+    date_str: str | None = None,
 ):
+    # date_str (YYYYMMDD) restricts the sync to the forecasts initialized on that date
     logger.debug(f"received sftp data syncronization request for {model}")
-    # open sftp connection session
-    sftp = get_sftp_session(host=host, user=user, key_file=key_file)
-    if isinstance(sftp, str):
-        logger.error(f"failed to open sftp transfer tunnel with error {sftp}")
-        return None
-    src_dir = getenv(
-        "IFS_DATA_DIR",
-        f"/data/{'Operational' if model == 'cgan-ifs-6h-ens' else 'Operational_7d'}",
-    )
-    dest_dir = get_data_store_path(source="jobs") / model
-    # list files in the target remote directory
-    remote_files = sftp.listdir(path=src_dir)
-    # compare with local filesystem to determine files to be synced
-    data_dates = [
-        remote_file.replace("IFS_", "").replace(".nc", "")
-        for remote_file in remote_files
-        if "degraded" not in remote_file #TODO: confirm handler for degraded data is properly implemented before removing the check
-    ]
-    ifs_dates = get_gan_forecast_dates(source=model)
-    to_sync = [
-        f"IFS_{data_date}.nc"
-        for data_date in sorted(data_dates, reverse=True)
-        if data_date.replace("Z","") not in ifs_dates
-    ]
-    logger.debug(
-        f"processing sftp data syncronization of {model} model source files {' -> '.join(to_sync)}"
-    )
-    with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_count() * 4) as executor:
-        results = [
-            executor.submit(
-                fetch_remote_file,
-                remote_path=f"{src_dir}/{ifs_file}",
-                local_path=dest_dir,
-            )
-            for ifs_file in to_sync
+    max_workers = int(getenv("SFTP_SESSIONS", 4))
+    with SFTPSessionPool(size=max_workers, host=host, user=user, key_file=key_file) as pool:
+        src_dir = getenv(
+            "IFS_DATA_DIR",
+            f"/data/{'Operational' if model == 'cgan-ifs-6h-ens' else 'Operational_7d'}",
+        )
+        dest_dir = get_data_store_path(source="jobs") / model
+        # list files in the target remote directory
+        try:
+            with pool.session() as sftp:
+                remote_files = sftp.listdir(path=src_dir)
+        except Exception as err:
+            logger.error(f"failed to list sftp data files in {src_dir} with error {err}")
+            return None
+        # compare with local filesystem to determine files to be synced
+        data_dates = [
+            remote_file.replace("IFS_", "").replace(".nc", "")
+            for remote_file in remote_files
+            if "degraded" not in remote_file #TODO: confirm handler for degraded data is properly implemented before removing the check
+            and (date_str is None or remote_file.startswith(f"IFS_{date_str}"))
         ]
-        for future in concurrent.futures.as_completed(results):
-            if future.result() is not None:
-                logger.debug(f"completed sftp sync of {future.result()}")
+        ifs_dates = get_gan_forecast_dates(source=model)
+        to_sync = [
+            f"IFS_{data_date}.nc"
+            for data_date in sorted(data_dates, reverse=True)
+            if data_date.replace("Z","") not in ifs_dates
+        ]
+        logger.debug(
+            f"processing sftp data syncronization of {model} model source files {' -> '.join(to_sync)}"
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = [
+                executor.submit(
+                    fetch_remote_file,
+                    pool=pool,
+                    remote_path=f"{src_dir}/{ifs_file}",
+                    local_path=dest_dir,
+                )
+                for ifs_file in to_sync
+            ]
+            for future in concurrent.futures.as_completed(results):
+                if future.result() is not None:
+                    logger.debug(f"completed sftp sync of {future.result()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+import fcntl
+import json
+import os
+import socket
+import sqlite3
+import threading
+from collections.abc import Callable
+from contextlib import closing
+from pathlib import Path
+from time import time
+from typing import Any, Literal
+
+from loguru import logger
+
+STATUS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_leases (
+    sync_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    cpus REAL NOT NULL DEFAULT 0,
+    memory REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (sync_type, source)
+);
+"""
+
+# default (cpus, memory in GB) reserved by the processing jobs of each source while they hold their lease.
+# cGAN inference dominates, IFS post-processing is light and open-ifs GRIB2 conversion is in between
+JOB_RESOURCE_COSTS = {
+    "jurre-brishti-ens": (16, 24),
+    "jurre-brishti-count": (16, 24),
+    "mvua-kubwa-ens": (16, 32),
+    "mvua-kubwa-count": (16, 32),
+    "cgan-ifs-6h-ens": (2, 4),
+    "cgan-ifs-7d-ens": (2, 4),
+    "open-ifs": (4, 8),
+}
+
+# identifies the processes holding leases. leases of crashed processes expire after their ttl
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+heartbeat: threading.Thread | None = None
+heartbeat_lock = threading.Lock()
+
+
+def get_lease_owner() -> str:
+    # job queue workers run their tasks in threads of the same process, so leases are held per thread
+    return f"{PROCESS_ID}:{threading.get_ident()}"
+
+
+def get_resource_limits() -> tuple[float, float]:
+    # (cpus, memory in GB) of the machine shared by the job containers
+    total_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+    # unset or empty limits default to the whole machine
+    return float(os.getenv("JOBS_CPU_LIMIT") or os.cpu_count()), float(os.getenv("JOBS_MEMORY_LIMIT") or total_memory)
+
+
+def get_job_cost(source: str) -> tuple[float, float]:
+    # costs are overridden with JOBS_RESOURCE_COSTS=<source>=<cpus>:<memory>,<source>=<cpus>:<memory>
+    costs = dict(JOB_RESOURCE_COSTS)
+    for entry in [value for value in os.getenv("JOBS_RESOURCE_COSTS", "").split(",") if value]:
+        name, cost = entry.split("=")
+        cpus, memory = cost.split(":")
+        costs[name.strip()] = (float(cpus), float(memory))
+    return costs.get(source, (1, 2))
+
+
+def get_lease_ttl() -> float:
+    return float(os.getenv("STATUS_LEASE_TTL", 15 * 60))
+
+
+def get_status_file(suffix: str) -> Path:
+    return Path(os.getenv("LOGS_DIR", "./")) / f"data-sync-tasks-status.{suffix}"
+
+
+initialized_status_stores: set[Path] = set()
+initialized_status_stores_lock = threading.Lock()
+
+LEASE_COLUMNS = ["owner", "depth", "expires_at", "cpus", "memory"]
+
+
+def init_status_store(conn: sqlite3.Connection, status_file: Path) -> None:
+    # the journal mode and the schema persist in the store file, so they are set once per process
+    with initialized_status_stores_lock:
+        if status_file in initialized_status_stores:
+            return None
+        # WAL lets containers sharing the logs volume read while a lease is being updated
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(STATUS_SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(task_leases)")]
+        for column in [column for column in ["cpus", "memory"] if column not in columns]:
+            conn.execute(f"ALTER TABLE task_leases ADD COLUMN {column} REAL NOT NULL DEFAULT 0")
+        initialized_status_stores.add(status_file)
+
+
+def _read_sqlite_leases(conn: sqlite3.Connection) -> dict:
+    return {
+        (sync_type, source): dict(zip(LEASE_COLUMNS, values))
+        for sync_type, source, *values in conn.execute(f"SELECT sync_type, source, {', '.join(LEASE_COLUMNS)} FROM task_leases")
+    }
+
+
+def _sqlite_transaction(update: Callable[[dict], Any], readonly: bool = False) -> Any:
+    status_file = get_status_file("sqlite")
+    with closing(sqlite3.connect(status_file, timeout=30, isolation_level=None)) as conn:
+        init_status_store(conn, status_file)
+        if readonly:
+            # a single select reads a consistent snapshot without the write lock
+            return update(_read_sqlite_leases(conn))
+        # take the write lock before reading, so that the read-modify-write below is atomic
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            leases = _read_sqlite_leases(conn)
+            original = {key: dict(lease) for key, lease in leases.items()}
+            result = update(leases)
+            # only the leases changed by `update` are written
+            conn.executemany(
+                "DELETE FROM task_leases WHERE sync_type = ? AND source = ?",
+                [key for key in original if key not in leases],
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO task_leases (sync_type, source, {', '.join(LEASE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*key, *[lease.get(column, 0) for column in LEASE_COLUMNS]) for key, lease in leases.items() if original.get(key) != lease],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return result
+
+
+def _file_transaction(update: Callable[[dict], Any], readonly: bool = False) -> Any:
+    status_file = get_status_file("json")
+    with get_status_file("lock").open("a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if readonly else fcntl.LOCK_EX)
+        try:
+            data = json.loads(status_file.read_text()) if status_file.exists() else []
+        except Exception as err:
+            logger.warning(f"failed to read contents of tasks status file {status_file} with error {err}")
+            data = []
+        leases = {(lease.pop("sync_type"), lease.pop("source")): lease for lease in data if isinstance(lease, dict)}
+        original = {key: dict(lease) for key, lease in leases.items()}
+        result = update(leases)
+        if readonly or original == leases:
+            return result
+        tmp_file = status_file.with_name(f".{status_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps([{**lease, "sync_type": key[0], "source": key[1]} for key, lease in leases.items()]))
+        tmp_file.replace(status_file)
+    return result
+
+
+def run_status_transaction(update: Callable[[dict], Any], readonly: bool = False) -> Any:
+    """Apply `update` to the task leases, keyed by (sync_type, source), as one atomic transaction.
+
+    Expired leases are dropped before `update` is called. A `readonly` transaction does not take the
+    write lock and must not change the leases. Falls back to a lock-protected JSON file when the SQLite
+    status store cannot be used.
+    """
+
+    def update_leases(leases: dict) -> Any:
+        now = time()
+        for key in [key for key, lease in leases.items() if lease["expires_at"] <= now]:
+            if not readonly:
+                logger.warning(f"{key[0]} lease of {key[1]} held by {leases[key]['owner']} expired")
+            leases.pop(key)
+        return update(leases)
+
+    if os.getenv("STATUS_BACKEND", "sqlite") == "sqlite":
+        try:
+            return _sqlite_transaction(update_leases, readonly=readonly)
+        except sqlite3.Error as err:
+            logger.warning(f"sqlite tasks status store is not available with error {err}. using file store")
+    return _file_transaction(update_leases, readonly=readonly)
+
+
+def renew_task_leases() -> int:
+    def renew(leases: dict) -> int:
+        owned = [lease for lease in leases.values() if lease["owner"].startswith(f"{PROCESS_ID}:")]
+        for lease in owned:
+            lease["expires_at"] = time() + get_lease_ttl()
+        return len(owned)
+
+    return run_status_transaction(renew)
+
+
+def _run_heartbeat() -> None:
+    global heartbeat
+    while True:
+        threading.Event().wait(get_lease_ttl() / 3)
+        try:
+            held = renew_task_leases()
+        except Exception as err:
+            logger.error(f"failed to renew task leases with error {err}")
+            continue
+        if not held:
+            with heartbeat_lock:
+                heartbeat = None
+            return None
+
+
+def _start_heartbeat() -> None:
+    # renew the leases of this process while it is alive, so that long running tasks keep them
+    global heartbeat
+    with heartbeat_lock:
+        if heartbeat is None:
+            heartbeat = threading.Thread(target=_run_heartbeat, name="task-leases-heartbeat", daemon=True)
+            heartbeat.start()
+
+
+def is_nested_scope(source: str, other: str) -> bool:
+    return source.startswith(f"{other}:") or other.startswith(f"{source}:")
+
+
+def acquire_task_lease(
+    sync_type: Literal["download", "processing"],
+    source: str,
+    cost: tuple[float, float] | None = None,
+) -> bool:
+    """Atomically take the `sync_type` lease of `source` and return whether it is held by this thread.
+
+    Leases are re-entrant within a thread. A `<source>:<scope>` lease excludes the `source` lease held by
+    other jobs, and the other way round, but not the other scopes of `source`. A lease with a (cpus, memory) `cost` is only granted while the
+    costs of the leases held by other jobs leave room for it within the machine limits. A job that does
+    not fit on its own is granted when no other job holds resources, so that it cannot starve.
+    """
+    cpus_limit, memory_limit = get_resource_limits()
+
+    owner = get_lease_owner()
+
+    def acquire(leases: dict) -> bool:
+        lease = leases.get((sync_type, source))
+        if lease is not None and lease["owner"] != owner:
+            return False
+        # a lease of a source and the leases of its scopes, such as `<source>:<YYYYMMDD>` for one forecast date,
+        # exclude each other. leases of different scopes of a source do not
+        if any(other["owner"] != owner and key[0] == sync_type and is_nested_scope(key[1], source) for key, other in leases.items()):
+            return False
+        if lease is None and cost is not None:
+            others = [other for other in leases.values() if other["owner"] != owner and (other.get("cpus", 0) or other.get("memory", 0))]
+            cpus_used = sum(other.get("cpus", 0) for other in others)
+            memory_used = sum(other.get("memory", 0) for other in others)
+            if len(others) and (cpus_used + cost[0] > cpus_limit or memory_used + cost[1] > memory_limit):
+                logger.debug(
+                    f"{sync_type} of {source} needs {cost[0]} cpus and {cost[1]}GB while {cpus_used} of {cpus_limit} cpus "
+                    + f"and {memory_used:.1f} of {memory_limit:.1f}GB are in use. waiting for resources"
+                )
+                return False
+        cpus, memory = (0, 0) if cost is None else cost
+        leases[(sync_type, source)] = {
+            "owner": owner,
+            "depth": 1 if lease is None else lease["depth"] + 1,
+            "expires_at": time() + get_lease_ttl(),
+            "cpus": cpus if lease is None else lease.get("cpus", 0),
+            "memory": memory if lease is None else lease.get("memory", 0),
+        }
+        return True
+
+    acquired = run_status_transaction(acquire)
+    if acquired:
+        _start_heartbeat()
+    return acquired
+
+
+def release_task_lease(
+    sync_type: Literal["download", "processing"],
+    source: str,
+    force: bool | None = False,
+) -> None:
+    owner = get_lease_owner()
+
+    def release(leases: dict) -> None:
+        lease = leases.get((sync_type, source))
+        if lease is None or (lease["owner"] != owner and not force):
+            return None
+        lease["depth"] -= 1
+        if force or lease["depth"] < 1:
+            leases.pop((sync_type, source))
+
+    run_status_transaction(release)
+
+
+def is_task_active(sync_type: Literal["download", "processing"], source: str | None = None) -> bool:
+    # whether `source`, or any source when not given, holds a live lease of `sync_type`
+    return run_status_transaction(lambda leases: any(key[0] == sync_type and source in [None, key[1]] for key in leases), readonly=True)
@@ -1,16 +1,27 @@
-import json
+import concurrent
 import os
-import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, datetime, timedelta
+from functools import lru_cache
+from multiprocessing import get_context
 from pathlib import Path
 from typing import Literal
 
-import pandas as pd
+import numpy as np
 import xarray as xr
 from loguru import logger
 from show_forecasts.constants import COUNTRY_NAMES
 from show_forecasts.data_utils import get_region_extent
 
+from fastcgan.jobs.catalog import (
+    get_catalog_complete_init_dates,
+    get_catalog_file_names,
+    get_catalog_forecasts,
+    get_catalog_init_dates,
+    get_catalog_init_times,
+    register_forecast_file,
+)
+from fastcgan.jobs.status import acquire_task_lease, is_task_active, release_task_lease
 from fastcgan.jobs.stubs import cgan_ifs_literal, cgan_model_literal, open_ifs_literal
 from fastcgan.models.settings import GanOutputDate
 from fastcgan.tools.config import settings
@@ -90,15 +101,28 @@ def get_directory_files(
     return files
 
 
+def get_catalog_mask_region(
+    source: str,
+    mask_region: str | None = None,
+    ens_ifs_models: list[str] = ["cgan-ifs-6h-ens", "cgan-ifs-7d-ens"],
+) -> str | None:
+    # mirror get_data_store_path: ens IFS sources are not split by mask region
+    if source in ens_ifs_models:
+        return None
+    # country views of the chunked store are derived from the parent region files
+    if use_chunked_store() and mask_region is not None:
+        return COUNTRY_NAMES[0]
+    return mask_region
+
+
 def get_forecast_data_files(
     source: str,
     mask_region: str | None = None,
 ) -> list[str]:
-    store_path = get_data_store_path(source=source, mask_region=mask_region)
-    if store_path is not None:
-        data_files = get_directory_files(data_path=store_path, files=set())
-        return [dfile.name for dfile in data_files]
-    return []
+    return get_catalog_file_names(
+        source=source,
+        mask_region=get_catalog_mask_region(source=source, mask_region=mask_region),
+    )
 
 
 def get_ecmwf_files_for_date(
@@ -116,91 +140,55 @@ def get_forecast_data_dates(
     mask_region: str | None = None,
     strict: bool | None = True,
 ) -> list[str]:
-    data_files = get_forecast_data_files(source=source, mask_region=mask_region)
-    if "-count" in source:
-        data_dates = sorted(
-            {dfile.replace(".nc", "").split("_")[1] for dfile in data_files}
-        )
-        return list(
-            reversed(
-                [
-                    datetime.strptime(data_date, "%Y%m%d").strftime("%b %d, %Y")
-                    for data_date in data_dates
-                ]
-            )
-        )
-
-    data_dates = sorted(
-        {dfile.replace(".nc", "").split("-")[2].split("_")[0] for dfile in data_files}
-    )
+    catalog_mask = get_catalog_mask_region(source=source, mask_region=mask_region)
     if not strict or source != "open-ifs":
-        return list(
-            reversed(
-                [
-                    datetime.strptime(
-                        data_date.replace("000000", ""), "%Y%m%d"
-                    ).strftime("%b %d, %Y")
-                    for data_date in data_dates
-                ]
-            )
+        data_dates = get_catalog_init_dates(source=source, mask_region=catalog_mask)
+    else:
+        # only include dates for which all forecast steps are available
+        data_dates = get_catalog_complete_init_dates(
+            source=source,
+            valid_times=get_relevant_forecast_steps(),
+            mask_region=COUNTRY_NAMES[0] if catalog_mask is None else catalog_mask,
         )
-    tmp_dates = []
-    for date_str in data_dates:
-        data_date = datetime.strptime(date_str.replace("000000", ""), "%Y%m%d")
-        files_for_date = get_ecmwf_files_for_date(data_date)
-        in_files = [True if dfile in data_files else False for dfile in files_for_date]
-        if False not in in_files:
-            tmp_dates.append(data_date)
-    return [data_date.strftime("%b %d, %Y") for data_date in reversed(tmp_dates)]
+    return [
+        datetime.strptime(data_date, "%Y%m%d").strftime("%b %d, %Y")
+        for data_date in data_dates
+    ]
 
 
 def get_cgan_forecast_dates(
     source: cgan_model_literal,
     mask_region: str | None = None,
 ) -> list[GanOutputDate]:
-    data_files = get_forecast_data_files(source=source, mask_region=mask_region)
     if "-count" in source:
-        ptn = re.compile(r"^counts_([0-9]{8})_([0-9]{2})_([0-9]{1,3})h.nc$")
-        fmeta = [ptn.split(dfile)[1:-1] for dfile in data_files if bool(ptn.match(dfile))]
-        df = (
-            pd.DataFrame(data=fmeta, columns=["init_date", "init_time", "valid_time"])
-            .assign(
-                valid_time=lambda x: x["valid_time"].apply(lambda value: int(value)),
-                init_date=lambda x: x["init_date"].apply(
-                    lambda value: datetime.strptime(value, "%Y%m%d")
+        return [
+            {
+                "init_date": datetime.strptime(init_date, "%Y%m%d").strftime(
+                    "%b %d, %Y"
                 ),
+                "init_time": init_time,
+                "valid_time": valid_time,
+            }
+            for init_date, init_time, valid_time in get_catalog_forecasts(
+                source=source
             )
-            .sort_values(by=["init_date", "valid_time"], ascending=False)
-            .assign(
-                init_date=lambda x: x["init_date"].apply(
-                    lambda value: value.strftime("%b %d, %Y")
-                )
-            )
-        )
-        return json.loads(df.to_json(orient="records"))
+        ]
     elif "-ens" in source:
         mask_region = COUNTRY_NAMES[0] if mask_region is None else mask_region
-        ptn = re.compile(
-            f"^{mask_region.lower().replace(' ','_')}-{source.replace('-','_')}"
-            + "-([0-9]{8})_([0-9]{2})Z.nc"
-        )
-        fmeta = [ptn.split(dfile)[1:-1] for dfile in data_files if bool(ptn.match(dfile))]
-        df = (
-            pd.DataFrame(data=fmeta, columns=["init_date", "init_time"])
-            .assign(
-                init_time=lambda x: x["init_time"].apply(lambda value: int(value)),
-                init_date=lambda x: x["init_date"].apply(
-                    lambda value: datetime.strptime(value, "%Y%m%d")
+        return [
+            {
+                "init_date": datetime.strptime(init_date, "%Y%m%d").strftime(
+                    "%b %d, %Y"
+                ),
+                "init_time": init_time,
+            }
+            for init_date, init_time, _ in get_catalog_forecasts(
+                source=source,
+                mask_region=get_catalog_mask_region(
+                    source=source, mask_region=mask_region
                 ),
             )
-            .sort_values(by=["init_date", "init_time"], ascending=False)
-            .assign(
-                init_date=lambda x: x["init_date"].apply(
-                    lambda value: value.strftime("%b %d, %Y")
-                )
-            )
-        )
-        return json.loads(df.to_json(orient="records"))
+        ]
     else:
         return []
 
@@ -215,39 +203,27 @@ def get_forecast_initialization_times(
             return []
         data_date = fcst_dates[0]
     fcst_date = datetime.strptime(data_date, "%b %d, %Y").strftime("%Y%m%d")
-    data_files = get_forecast_data_files(source=model)
-    if "-count" in model:
-        return list(
-            {
-                data_file.split("_")[2]
-                for data_file in data_files
-                if fcst_date in data_file
-            }
-        )
-    return list(
-        {
-            data_file.split("_")[-1].replace("Z.nc", "")
-            for data_file in data_files
-            if fcst_date in data_file
-        }
-    )
+    return [
+        str(init_time).rjust(2, "0")
+        for init_time in get_catalog_init_times(source=model, init_date=fcst_date)
+    ]
 
 
 def get_gan_forecast_dates(
     source: str,
     mask_region: str | None = None,
 ) -> list[str]:
-    store_path = get_data_store_path(source=source, mask_region=mask_region)
-    if store_path is None:
-        return []
-    data_files = get_directory_files(data_path=store_path, files=set())
-    if "count" in source:
-        data_dates = set()
-        for data_file in data_files:
-            file_parts = data_file.name.split("_")
-            data_dates.add(f"{file_parts[1]}_{file_parts[2]}")
-        return list(data_dates)
-    return list({dfile.name.replace("Z.nc", "").split("-")[2] for dfile in data_files})
+    forecasts = get_catalog_forecasts(
+        source=source,
+        mask_region=get_catalog_mask_region(source=source, mask_region=mask_region),
+    )
+    return list(
+        dict.fromkeys(
+            f"{init_date}_{str(init_time).rjust(2, '0')}"
+            for init_date, init_time, _ in forecasts
+            if init_time is not None
+        )
+    )
 
 
 def get_gan_forecast_initializations(
@@ -291,6 +267,98 @@ def slice_dataset_by_bbox(ds: xr.Dataset, bbox: list[float]):
         return ds
 
 
+def use_chunked_store() -> bool:
+    return settings.FORECASTS_STORE_FORMAT == "chunked"
+
+
+def get_store_encoding(ds: xr.Dataset) -> dict[str, dict]:
+    # compressed latitude/longitude tiles, so that country views only read the chunks they overlap
+    chunk_size = int(settings.FORECASTS_STORE_CHUNK_SIZE)
+    encoding = {}
+    for name, data_var in ds.data_vars.items():
+        if "latitude" not in data_var.dims or "longitude" not in data_var.dims:
+            continue
+        encoding[name] = {
+            "zlib": True,
+            "complevel": 4,
+            "shuffle": True,
+            "chunksizes": tuple(min(size, chunk_size) if dim in ["latitude", "longitude"] else 1 for dim, size in zip(data_var.dims, data_var.shape)),
+        }
+    return encoding
+
+
+@lru_cache
+def get_country_bbox(country_name: str) -> list[float]:
+    return get_region_extent(shape_name=country_name)  # type: ignore
+
+
+def get_bbox_index_window(ds: xr.Dataset, bbox: list[float]) -> dict[str, slice]:
+    # integer index window equivalent to slice_dataset_by_bbox, for either coordinate ordering
+    window = {}
+    for dim, (lower, upper) in [("longitude", bbox[:2]), ("latitude", bbox[2:4])]:
+        values = ds[dim].values
+        indices = np.flatnonzero((values >= lower) & (values <= upper))
+        window[dim] = slice(0, 0) if not len(indices) else slice(int(indices[0]), int(indices[-1]) + 1)
+    return window
+
+
+def get_country_index_windows(ds: xr.Dataset, country_names: list[str]) -> dict[str, dict[str, slice]]:
+    return {country_name: get_bbox_index_window(ds=ds, bbox=get_country_bbox(country_name)) for country_name in country_names}
+
+
+def write_dataset_file(ds: xr.Dataset, file_path: Path, engine: str | None = None) -> Path:
+    ds.to_netcdf(file_path, mode="w", format="NETCDF4", engine=engine)
+    return file_path
+
+
+def save_country_slices(
+    ds: xr.Dataset,
+    source: str,
+    data_date: datetime,
+    file_name: str,
+    country_names: list[str] = COUNTRY_NAMES[1:],
+    engine: str | None = None,
+    max_workers: int | None = None,
+) -> list[str]:
+    # load the parent dataset once and write all country subsets through a pool of writers
+    max_workers = max_workers if max_workers is not None else int(os.getenv("SLICE_WRITERS", 4))
+    try:
+        ds = ds.load()
+        windows = get_country_index_windows(ds=ds, country_names=country_names)
+    except Exception as err:
+        logger.error(f"failed to compute country slices of {source} dataset {file_name} with error {err}")
+        return [f"error slicing {file_name} for bbox {country_name}" for country_name in country_names]
+    errors = []
+    slice_targets = {
+        country_name: get_dataset_file_path(source=source, data_date=data_date, file_name=file_name, mask_region=country_name)
+        for country_name in windows
+    }
+    max_workers = max(min(max_workers, len(windows)), 1)
+    # a single writer saves the slices in this process. callers that already run in a process pool use it, so that
+    # the pool workers do not spawn writers of their own
+    executor = (
+        ThreadPoolExecutor(max_workers=1)
+        if max_workers == 1
+        else ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+    )
+    with executor:
+        results = {}
+        for country_name, window in windows.items():
+            logger.debug(f"saving {source} dataset slice for {country_name} into {slice_targets[country_name]}")
+            future = executor.submit(write_dataset_file, ds=ds.isel(window), file_path=slice_targets[country_name], engine=engine)
+            results[future] = (country_name, slice_targets[country_name])
+        for future in concurrent.futures.as_completed(results):
+            country_name, slice_target = results[future]
+            try:
+                future.result()
+            except Exception as error:
+                errors.append(f"failed to save {slice_target} with error {error}")
+            else:
+                logger.debug(f"succeefully saved {source} dataset slice for {country_name}")
+                register_forecast_file(file_path=slice_target, source=source)
+    return errors
+
+
 def save_to_new_filesystem_structure(
     file_path: Path,
     source: cgan_model_literal | cgan_ifs_literal,
@@ -298,6 +366,7 @@ def save_to_new_filesystem_structure(
     min_gbmc_size: int = 42 * 1024,
     part_to_replace: str | None = None,
     ens_ifs_models: list[str] = ["cgan-ifs-6h-ens", "cgan-ifs-7d-ens"],
+    country_names: list[str] = COUNTRY_NAMES[1:],
 ) -> None:
     logger.debug(f"received filesystem migration task for - {source} - {file_path}")
     if source in ens_ifs_models and file_path.stat().st_size / 1024 < float(
@@ -308,10 +377,10 @@ def save_to_new_filesystem_structure(
         )
         file_path.unlink()
     else:
+        # callers hold the processing lease of the source
         logger.debug(
             f"processing {file_path.name} migration into revised filesystem structure"
         )
-        set_data_sycn_status(source=source, sync_type="processing", status=True)
         try:
             ds = standardize_dataset(xr.open_dataset(file_path, decode_times=False))
         except Exception as err:
@@ -335,52 +404,46 @@ def save_to_new_filesystem_structure(
             logger.debug(f"migrating dataset file {file_path} to {target_file}")
             errors = []
             try:
-                ds.to_netcdf(target_file, mode="w", format="NETCDF4")
+                ds.to_netcdf(
+                    target_file,
+                    mode="w",
+                    format="NETCDF4",
+                    encoding=get_store_encoding(ds) if use_chunked_store() else None,
+                )
             except Exception as error:
                 errors.append(f"failed to save {target_file} with error {error}")
             else:
                 logger.debug(
                     f"succeefully saved dataset file {file_path} to {target_file}"
                 )
-                if source not in ens_ifs_models:  # split cGAN forecasts by country
-                    for country_name in COUNTRY_NAMES[1:]:
-                        # create country slices
-                        sliced = slice_dataset_by_bbox(
+                register_forecast_file(file_path=target_file, source=source)
+                # split cGAN forecasts by country. The chunked store serves country views on read
+                if source not in ens_ifs_models and not use_chunked_store():
+                    errors.extend(
+                        save_country_slices(
                             ds=ds,
-                            bbox=get_region_extent(shape_name=country_name),  # type: ignore
+                            source=source,
+                            data_date=data_date,
+                            file_name=fname,
+                            country_names=country_names,
                         )
-                        if sliced is None:
-                            errors.append(
-                                f"error slicing {file_path.name} for bbox {country_name}"
-                            )
-                        else:
-                            slice_target = get_dataset_file_path(
-                                source=source,
-                                data_date=data_date,
-                                file_name=fname,
-                                mask_region=country_name,
-                            )
-                            logger.debug(
-                                f"migrating dataset slice for {country_name} to {slice_target}"
-                            )
-                            try:
-                                sliced.to_netcdf(
-                                    slice_target, mode="w", format="NETCDF4"
-                                )
-                            except Exception as error:
-                                errors.append(
-                                    f"failed to save {slice_target} with error {error}"
-                                )
-                            else:
-                                logger.debug(
-                                    f"succeefully migrated dataset slice for {country_name}"
-                                )
+                    )
             if not len(errors):
                 logger.debug(
                     f"removing forecast file {file_path.name} after a successful migration"
                 )
                 file_path.unlink(missing_ok=True)
-        set_data_sycn_status(source=source, sync_type="processing", status=False)
+
+
+def get_forecast_view(data: xr.Dataset, source: str, mask_region: str | None = None) -> xr.Dataset:
+    """Country `mask_region` view of forecast `data` loaded from the data store of `source`.
+
+    The chunked store keeps a single parent region copy of each forecast, which is loaded lazily for
+    country masks. Only the chunks overlapping the country bbox window are read from it.
+    """
+    if get_catalog_mask_region(source=source, mask_region=mask_region) in [None, mask_region]:
+        return data
+    return data.isel(get_bbox_index_window(ds=data, bbox=get_country_bbox(mask_region)))
 
 
 # migrate dataset files from initial filesystem structure to revised.
@@ -406,65 +469,43 @@ def migrate_files(source: cgan_model_literal | cgan_ifs_literal):
             f"processing file-structure migration for {len(data_files)} {source} data files"
         )
         # copy data_files to new files path
-        for dfile in data_files:
-            save_to_new_filesystem_structure(
-                file_path=dfile, source=source, part_to_replace=part_to_replace
-            )
+        set_data_sycn_status(source=source, sync_type="processing", status=True)
+        try:
+            for dfile in data_files:
+                save_to_new_filesystem_structure(
+                    file_path=dfile, source=source, part_to_replace=part_to_replace
+                )
+        finally:
+            set_data_sycn_status(source=source, sync_type="processing", status=False)
 
 
 def set_data_sycn_status(
     sync_type: Literal["download", "processing"],
     source: cgan_model_literal | cgan_ifs_literal | open_ifs_literal,
     status: bool | None = True,
-):
-    status_file = Path(os.getenv("LOGS_DIR", "./")) / "data-sync-tasks-status.json"
-    if not status_file.exists():
-        with open(status_file, "w") as sf:
-            sf.write(json.dumps({sync_type: {source: status}}))
-    else:
-        try:
-            with open(status_file) as sf:
-                data = json.loads(sf.read())
-        except Exception as err:
-            logger.warning(
-                f"failed to read contents of tasks status log file with error {err}"
-            )
-            logger.debug(f"recreating tasks status log file {status_file}")
-            with open(status_file, "w") as sf:
-                sf.write(json.dumps({sync_type: {source: status}}))
-        else:
-            if sync_type not in data.keys():
-                data.update({sync_type: {source: status}})
-            else:
-                data[sync_type][source] = status
-            with open(status_file, "w") as sf:
-                sf.write(json.dumps(data))
+) -> bool:
+    # take or release the `sync_type` lease of `source`. returns whether the lease was taken
+    if status:
+        return acquire_task_lease(sync_type=sync_type, source=source)
+    release_task_lease(sync_type=sync_type, source=source)
+    return False
+
+
+def reset_data_sycn_status(
+    source: cgan_model_literal | cgan_ifs_literal | open_ifs_literal,
+) -> None:
+    # drop the leases left behind by a previous run of the `source` job
+    for sync_type in ["download", "processing"]:
+        release_task_lease(sync_type=sync_type, source=source, force=True)
 
 
 def get_data_sycn_status(
     sync_type: Literal["download", "processing"],
     source: cgan_model_literal | cgan_ifs_literal | open_ifs_literal,
 ) -> bool:
-    status_file = Path(os.getenv("LOGS_DIR", "./")) / "data-sync-tasks-status.json"
-
-    if not status_file.exists():
-        return False
-
     # check if there is an active data syncronization job
-    with open(status_file) as sf:
-        data = json.loads(sf.read())
-        if source in data[sync_type].keys():
-            return data[sync_type][source]
-        return False
+    return is_task_active(sync_type=sync_type, source=source)
 
 
 def get_processing_task_status(sync_type: str | None = "processing") -> bool:
-    status_file = Path(os.getenv("LOGS_DIR", "./")) / "data-sync-tasks-status.json"
-    if not status_file.exists():
-        return False
-
-    with open(status_file) as sf:
-        data = json.loads(sf.read())
-        if sync_type not in data.keys():
-            return False
-        return not all(value is False for value in data[sync_type].values())
+    return is_task_active(sync_type=sync_type)
@@ -39,7 +39,14 @@ class OpenapiSettings(BaseSettings):
 class AssetPathSettings(BaseSettings):
     CACHE_FILES_DIR: str | None = os.path.expandvars(config("CACHE_DIR", default=os.path.join(base_dir, "cache")))
     FORECASTS_DATA_DIR: str | None = os.path.expandvars(config("FORECASTS_DATA_DIR", default=os.path.join(base_dir, "./data")))
+    FORECASTS_CATALOG_FILE: str | None = os.path.expandvars(
+        config("FORECASTS_CATALOG_FILE", default=os.path.join(FORECASTS_DATA_DIR, "forecasts-catalog.sqlite"))
+    )
     JOBS_DATA_DIR: str | None = os.path.expandvars(config("JOBS_DATA_DIR", default=os.path.join(base_dir, "./jobs")))
+    # netcdf saves a copy of every forecast per country. chunked saves each forecast once with lat/lon
+    # chunking and serves country views through windowed reads of the parent region files
+    FORECASTS_STORE_FORMAT: Literal["netcdf", "chunked"] = config("FORECASTS_STORE_FORMAT", default="netcdf")
+    FORECASTS_STORE_CHUNK_SIZE: int = config("FORECASTS_STORE_CHUNK_SIZE", default=128)
     ASSETS_DIR_MAP: dict[str, str] = {
         "cache": CACHE_FILES_DIR,
         "jobs": JOBS_DATA_DIR,
@@ -75,6 +82,14 @@ class DefaultRateLimitSettings(BaseSettings):
     DEFAULT_RATE_LIMIT_PERIOD: int = config("DEFAULT_RATE_LIMIT_PERIOD", default=3600)
 
 
+class RenderSettings(BaseSettings):
+    RENDER_LOCK_TTL: int = config("RENDER_LOCK_TTL", default=300)
+    RENDER_WAIT_TIMEOUT: int = config("RENDER_WAIT_TIMEOUT", default=240)
+    RENDER_WORKERS: int = config("RENDER_WORKERS", default=2)
+    RENDER_QUEUE_LIMIT: int = config("RENDER_QUEUE_LIMIT", default=8)
+    RENDER_RETRY_AFTER: int = config("RENDER_RETRY_AFTER", default=30)
+
+
 class EnvironmentOption(Enum):
     LOCAL = "local"
     STAGING = "staging"
@@ -94,6 +109,7 @@ class Settings(
     RedisQueueSettings,
     RedisRateLimiterSettings,
     DefaultRateLimitSettings,
+    RenderSettings,
     EnvironmentSettings,
 ):
     pass
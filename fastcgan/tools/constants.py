@@ -6,3 +6,17 @@ GAN_MODELS = [
     {"name": "jurre-brishti", "label": "Jurre Brishti (6h)", "value": "Jurre brishti"},
     {"name": "mvua-kubwa", "label": "Mvua Kubwa (1d)", "value": "Mvua kubwa"},
 ]
+
+# default cGAN forecast map matrix pre-rendered when new forecasts land. Entries are listed in order of priority
+PRERENDER_MATRIX = {
+    "jurre-brishti": {
+        "acc_time": "06h",
+        "plot_units": ["mm/6h", "mm/h"],
+        "valid_times": ["30h", "36h", "42h", "48h", "54h"],
+    },
+    "mvua-kubwa": {
+        "acc_time": "24h",
+        "plot_units": ["mm/day", "mm/h"],
+        "valid_times": ["06h", "30h", "54h", "78h", "102h", "126h", "150h"],
+    },
+}
@@ -1,17 +1,21 @@
 from collections.abc import AsyncGenerator, Callable
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import _AsyncGeneratorContextManager, asynccontextmanager
+from multiprocessing import get_context
 from typing import Any
 
 import anyio
 import redis.asyncio as redis
 from arq import create_pool
 from arq.connections import RedisSettings
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
+from fastcgan.exceptions.render_exceptions import RenderQueueFullError
 from fastcgan.middleware.client_cache_middleware import ClientCacheMiddleware
 from fastcgan.routes import limiter
 from fastcgan.tools.config import (
@@ -24,10 +28,11 @@ from fastcgan.tools.config import (
     RedisCacheSettings,
     RedisQueueSettings,
     RedisRateLimiterSettings,
+    RenderSettings,
     get_cached_file_base_path,
     settings,
 )
-from fastcgan.utils import cache, queue, rate_limit
+from fastcgan.utils import cache, queue, rate_limit, render
 
 # -------------- database --------------
 # async def create_tables() -> None:
@@ -64,6 +69,27 @@ async def close_redis_rate_limit_pool() -> None:
     await rate_limit.client.aclose()  # type: ignore
 
 
+# -------------- render --------------
+async def create_render_pool() -> None:
+    render.executor = ProcessPoolExecutor(
+        max_workers=settings.RENDER_WORKERS,
+        mp_context=get_context("spawn"),
+        initializer=render.warm_render_worker,
+    )
+
+
+async def close_render_pool() -> None:
+    render.executor.shutdown(wait=True, cancel_futures=True)  # type: ignore
+
+
+async def render_queue_full_handler(request: Request, exc: RenderQueueFullError) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": exc.message},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 # -------------- application --------------
 async def set_threadpool_tokens(number_of_tokens: int = 100) -> None:
     limiter = anyio.to_thread.current_default_thread_limiter()
@@ -71,7 +97,15 @@ async def set_threadpool_tokens(number_of_tokens: int = 100) -> None:
 
 
 def lifespan_factory(
-    settings: (RedisCacheSettings | AppSettings | ClientSideCacheSettings | RedisQueueSettings | RedisRateLimiterSettings | EnvironmentSettings),
+    settings: (
+        RedisCacheSettings
+        | AppSettings
+        | ClientSideCacheSettings
+        | RedisQueueSettings
+        | RedisRateLimiterSettings
+        | RenderSettings
+        | EnvironmentSettings
+    ),
 ) -> Callable[[FastAPI], _AsyncGeneratorContextManager[Any]]:
     """Factory to create a lifespan async context manager for a FastAPI app."""
 
@@ -88,6 +122,9 @@ def lifespan_factory(
         if isinstance(settings, RedisRateLimiterSettings):
             await create_redis_rate_limit_pool()
 
+        if isinstance(settings, RenderSettings):
+            await create_render_pool()
+
         yield
 
         if isinstance(settings, RedisCacheSettings):
@@ -99,6 +136,9 @@ def lifespan_factory(
         if isinstance(settings, RedisRateLimiterSettings):
             await close_redis_rate_limit_pool()
 
+        if isinstance(settings, RenderSettings):
+            await close_render_pool()
+
     return lifespan
 
 
@@ -111,6 +151,7 @@ def create_application(
         | RedisQueueSettings
         | RedisRateLimiterSettings
         | ClientSideCacheSettings
+        | RenderSettings
         | EnvironmentSettings
     ),
     **kwargs: Any,
@@ -135,6 +176,8 @@ def create_application(
         - ClientSideCacheSettings: Integrates middleware for client-side caching.
         - RedisQueueSettings: Sets up event handlers for creating and closing a Redis queue pool.
         - RedisRateLimiterSettings: Sets up event handlers for creating and closing a Redis rate limiter pool.
+        - RenderSettings: Sets up event handlers for creating and closing the map rendering process pool
+          and returns 503 responses with a Retry-After header when the rendering queue is full.
         - EnvironmentSettings: Conditionally sets documentation URLs and integrates custom routes for API documentation
           based on the environment type.
 
@@ -179,6 +222,8 @@ def create_application(
     application = FastAPI(lifespan=lifespan, **kwargs)
     application.state.limiter = limiter
     application.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+    if isinstance(settings, RenderSettings):
+        application.add_exception_handler(RenderQueueFullError, render_queue_full_handler)
     application.add_middleware(SlowAPIMiddleware)
 
     if isinstance(settings, ClientSideCacheSettings):
@@ -0,0 +1,103 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import getpid
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+from fastcgan.exceptions.render_exceptions import RenderQueueFullError
+from fastcgan.tools.config import settings
+
+executor: ProcessPoolExecutor | None = None
+pending: int = 0
+
+
+def warm_render_worker() -> None:
+    """Initialize a render worker process.
+
+    Imports the plotting stack and draws a throwaway figure so that matplotlib backend selection,
+    font cache loading and cartopy imports are paid once per worker instead of once per map.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import cartopy.crs as ccrs
+    import matplotlib.pyplot as plt
+    import show_forecasts.show_cGAN  # noqa: F401
+    import show_forecasts.show_IFS_open_data  # noqa: F401
+
+    fig = plt.figure()
+    fig.add_subplot(projection=ccrs.PlateCarree())
+    plt.close(fig)
+
+
+def plot_to_file(plot: Callable[..., Any], file_name: str, **kwargs: Any) -> bool:
+    """Draw a map with `plot` into `file_name` through a temporary file that is renamed into place.
+
+    Parameters
+    ----------
+    plot: Callable[..., Any]
+        A show_forecasts plotting function that saves the map into its `file_name` argument.
+    file_name: str
+        The map file, as computed by `get_forecast_maps_path`.
+    **kwargs: Any
+        Keyword arguments passed to `plot`.
+
+    Returns
+    -------
+    bool
+        Whether `file_name` was written.
+
+    Note
+    ----
+        - Renders of the same map by the pre-rendering jobs and the API workers may run at the same
+          time. Each writes its own temporary file, so neither writes into or serves a partial map.
+    """
+    target = Path(file_name)
+    # the extension is kept, as matplotlib infers the image format from it
+    tmp_file = target.with_name(f".{target.stem}.{getpid()}.{uuid4().hex}{target.suffix}")
+    try:
+        plot(file_name=str(tmp_file), **kwargs)
+        if not tmp_file.exists():
+            return False
+        tmp_file.replace(target)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    return True
+
+
+async def run_render(render: Callable[..., bool], **kwargs: Any) -> bool:
+    """Run a map rendering function without blocking the event loop.
+
+    Parameters
+    ----------
+    render: Callable[..., bool]
+        A module-level (picklable) function that renders a map and returns whether it succeeded.
+    **kwargs: Any
+        Keyword arguments passed to `render`.
+
+    Returns
+    -------
+    bool
+        The value returned by `render`.
+
+    Raises
+    ------
+    RenderQueueFullError
+        If the number of queued and running renders in this API worker has reached `RENDER_QUEUE_LIMIT`.
+
+    Note
+    ----
+        - Renders run in the process pool created on application start-up, or in the default
+          thread pool when the process pool is not initialized.
+    """
+    global pending
+    if pending >= settings.RENDER_QUEUE_LIMIT:
+        raise RenderQueueFullError(retry_after=settings.RENDER_RETRY_AFTER)
+    pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(render, **kwargs))
+    finally:
+        pending -= 1
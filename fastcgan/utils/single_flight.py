@@ -0,0 +1,103 @@
+import asyncio
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+from loguru import logger
+
+from fastcgan.tools.config import settings
+from fastcgan.utils import cache
+from fastcgan.utils.render import run_render
+
+# only release the lock when it is still held by the worker that acquired it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def _wait_for_render(file_path: Path, lock_key: str, channel: str, timeout: float) -> bool | None:
+    """Wait for another worker to finish rendering `file_path`.
+
+    Returns True when the file was rendered, False when the rendering worker reported a failure
+    and None when the lock was released without a notification or the wait timed out.
+    """
+    pubsub = cache.client.pubsub()
+    await pubsub.subscribe(channel)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while loop.time() < deadline:
+            if file_path.exists():
+                return True
+            if not await cache.client.exists(lock_key):
+                return None
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None:
+                return message["data"] == b"1" or file_path.exists()
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.aclose()
+    return None
+
+
+async def single_flight_render(file_path: Path, render: Callable[..., bool], **kwargs: Any) -> bool:
+    """Render `file_path` once across all API workers.
+
+    The worker that acquires the redis lock keyed on the file name calls `render(**kwargs)`, while
+    workers receiving identical requests wait for its completion notification instead of rendering
+    the same map concurrently.
+
+    Parameters
+    ----------
+    file_path: Path
+        The map file to be rendered, as computed by `get_forecast_maps_path`.
+    render: Callable[..., bool]
+        The function that renders the map into `file_path` and returns whether it succeeded.
+    **kwargs: Any
+        Keyword arguments passed to `render`.
+
+    Returns
+    -------
+    bool
+        Whether `file_path` is available after rendering or waiting.
+
+    Note
+    ----
+        - Rendering is offloaded through `run_render`, so the event loop keeps serving other requests.
+        - Falls back to rendering without coordination when the redis cache client is not initialized.
+    """
+    if file_path.exists():
+        return True
+    if cache.client is None:
+        return await run_render(render, **kwargs)
+
+    lock_key = f"render-lock:{file_path.name}"
+    channel = f"render-done:{file_path.name}"
+    token = uuid4().hex
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.RENDER_WAIT_TIMEOUT
+    while loop.time() < deadline:
+        if await cache.client.set(lock_key, token, nx=True, ex=settings.RENDER_LOCK_TTL):
+            try:
+                # the map may have been rendered between the existence check and acquiring the lock
+                rendered = file_path.exists() or await run_render(render, **kwargs)
+            finally:
+                await cache.client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            # waiters retry on their own when the render raised before a notification was published
+            await cache.client.publish(channel, "1" if rendered else "0")
+            return rendered
+        logger.debug(f"waiting for {file_path.name} to be rendered by another worker")
+        rendered = await _wait_for_render(
+            file_path=file_path,
+            lock_key=lock_key,
+            channel=channel,
+            timeout=deadline - loop.time(),
+        )
+        if rendered is not None:
+            return rendered
+    logger.warning(f"timed out waiting for {file_path.name} to be rendered")
+    return file_path.exists()
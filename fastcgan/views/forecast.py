@@ -12,7 +12,7 @@ from show_forecasts.show_cGAN import (
 )
 
 from fastcgan.jobs.stubs import cgan_model_literal
-from fastcgan.jobs.utils import get_data_store_path, get_forecast_data_dates
+from fastcgan.jobs.utils import get_catalog_mask_region, get_data_store_path, get_forecast_data_dates, get_forecast_view
 from fastcgan.tools.constants import GAN_MODELS
 from fastcgan.tools.enums import (
     AccumulationTime,
@@ -22,8 +22,52 @@ from fastcgan.tools.enums import (
     PrecipitationUnit,
     ValidityTime,
 )
+from fastcgan.utils.render import plot_to_file
+from fastcgan.utils.single_flight import single_flight_render
 from fastcgan.views.tools import get_forecast_maps_path
 
+GAN_PLOTTERS = {
+    "forecast": plot_GAN_forecast,
+    "ensemble": plot_GAN_ensemble,
+    "threshold_chance": plot_GAN_threshold_chance,
+}
+
+
+def render_cgan_map(
+    plot_type: str,
+    model: cgan_model_literal,
+    init_date: datetime,
+    init_time: str,
+    mask_area: str,
+    **plot_kwargs,
+) -> bool:
+    data_store = get_data_store_path(source=model)
+    try:
+        # country forecasts of the chunked store are windowed reads of the parent region forecast
+        data = get_forecast_view(
+            data=load_GAN_forecast(
+                model=model,
+                init_date=init_date,
+                init_time=init_time,
+                data_dir=str(data_store).replace(f"/{model}", ""),
+                mask_region=get_catalog_mask_region(source=model, mask_region=mask_area),
+                cgan_ui_fs=True,
+            ),
+            source=model,
+            mask_region=mask_area,
+        )
+    except Exception as err:
+        logger.error(f"failed to plot cGAN {plot_type.replace('_', ' ')} forecast with error: {err}")
+        return False
+    return plot_to_file(
+        GAN_PLOTTERS[plot_type],
+        data=data,
+        model=model,
+        region=mask_area,
+        show_plot=False,
+        **plot_kwargs,
+    )
+
 
 async def cgan_forecast(
     model: cgan_model_literal | None = f'{GAN_MODELS[0]["name"]}-ens',
@@ -60,30 +104,22 @@ async def cgan_forecast(
     )
     maps_exist = [file_path.exists() for file_path in maps_path]
     if not all(maps_exist if len(maps_path) == 1 else maps_exist[:-1]):
-        data_store = get_data_store_path(source=model)
-        try:
-            data = load_GAN_forecast(
-                model=model,
-                init_date=data_date_obj,
-                init_time=init_time.value.replace("h", ""),
-                data_dir=str(data_store).replace(f"/{model}", ""),
-                mask_region=mask_area,
-                cgan_ui_fs=True,
-            )
-        except Exception as err:
-            logger.error(f"failed to plot cGAN forecast with error: {err}")
-            return []
-        plot_GAN_forecast(
-            data=data,
+        rendered = await single_flight_render(
+            file_path=maps_path[-1],
+            render=render_cgan_map,
+            plot_type="forecast",
             model=model,
+            init_date=data_date_obj,
+            init_time=init_time.value.replace("h", ""),
+            mask_area=mask_area,
             style=color_style.value,
             plot_units=plot_units.value,
             accumulation_time=acc_time.value,
             valid_time_start_hour=valid_time.value,
-            region=mask_area,
-            show_plot=False,
             file_name=str(maps_path[-1]),
         )
+        if not rendered:
+            return []
     return maps_path if len(maps_path) == 1 else maps_path[:-1]
 
 
@@ -123,30 +159,22 @@ async def cgan_forecast_ensemble(
         max_ensemble_plots=max_ens_plots,
     )
     if not maps_path[0].exists():
-        data_store = get_data_store_path(source=model)
-        try:
-            data = load_GAN_forecast(
-                model=model,
-                init_date=data_date_obj,
-                init_time=init_time.value.replace("h", ""),
-                data_dir=str(data_store).replace(f"/{model}", ""),
-                mask_region=mask_area,
-                cgan_ui_fs=True,
-            )
-        except Exception as err:
-            logger.error(f"failed to plot cGAN ensemble forecast with error: {err}")
-            return []
-        plot_GAN_ensemble(
-            data=data,
+        rendered = await single_flight_render(
+            file_path=maps_path[-1],
+            render=render_cgan_map,
+            plot_type="ensemble",
             model=model,
+            init_date=data_date_obj,
+            init_time=init_time.value.replace("h", ""),
+            mask_area=mask_area,
             valid_time_start_hour=valid_time.value,
             style=color_style.value,
             plot_units=plot_units.value,
-            region=mask_area,
             file_name=str(maps_path[-1]),
-            show_plot=False,
             max_num_plots=max_ens_plots,
         )
+        if not rendered:
+            return []
     return maps_path
 
 
@@ -187,29 +215,21 @@ async def cgan_threshold_chance(
         valid_time=valid_time,
     )
     if not maps_path[0].exists():
-        data_store = get_data_store_path(source=model)
-        try:
-            data = load_GAN_forecast(
-                model=model,
-                init_date=data_date_obj,
-                init_time=init_time.value.replace("h", ""),
-                data_dir=str(data_store).replace(f"/{model}", ""),
-                mask_region=mask_area,
-                cgan_ui_fs=True,
-            )
-        except Exception as err:
-            logger.error(f"failed to plot cGAN threshold exceedence forecast with error: {err}")
-            return []
-        plot_GAN_threshold_chance(
-            data=data,
+        rendered = await single_flight_render(
+            file_path=maps_path[-1],
+            render=render_cgan_map,
+            plot_type="threshold_chance",
             model=model,
+            init_date=data_date_obj,
+            init_time=init_time.value.replace("h", ""),
+            mask_area=mask_area,
             style=color_style.value,
             threshold=threshold,
             plot_units=plot_units.value,
             valid_time_start_hour=valid_time.value,
             show_percentages=show_percentages,
-            region=mask_area,
             file_name=str(maps_path[-1]),
-            show_plot=False,
         )
+        if not rendered:
+            return []
     return maps_path
@@ -9,10 +9,50 @@ from show_forecasts.show_IFS_open_data import (
     plot_forecast_ensemble as plot_ifs_forecast_ensemble,
 )
 
-from fastcgan.jobs.utils import get_data_store_path, get_forecast_data_dates
+from fastcgan.jobs.utils import get_catalog_mask_region, get_data_store_path, get_forecast_data_dates, get_forecast_view
 from fastcgan.tools.enums import IfsDataParameter, MapColorScheme, PrecipitationUnit
+from fastcgan.utils.render import plot_to_file
+from fastcgan.utils.single_flight import single_flight_render
 from fastcgan.views.tools import get_forecast_maps_path
 
+IFS_PLOTTERS = {
+    "forecast": plot_open_ifs_forecast,
+    "ensemble": plot_ifs_forecast_ensemble,
+}
+
+
+def render_open_ifs_map(
+    plot_type: str,
+    vis_param: IfsDataParameter,
+    init_date: datetime,
+    mask_area: str,
+    **plot_kwargs,
+) -> bool:
+    data_store = get_data_store_path(source="open-ifs")
+    try:
+        # country forecasts of the chunked store are windowed reads of the parent region forecast
+        data = get_forecast_view(
+            data=load_open_ifs_data(
+                key=vis_param.name,
+                forecast_init_date=init_date,
+                data_dir=str(data_store),
+                mask_region=get_catalog_mask_region(source="open-ifs", mask_region=mask_area),
+                status_updates=False,
+                cgan_ui_fs=True,
+            ),
+            source="open-ifs",
+            mask_region=mask_area,
+        )
+    except Exception:
+        return False
+    return plot_to_file(
+        IFS_PLOTTERS[plot_type],
+        data=data,
+        region=mask_area,
+        show_plot=False,
+        **plot_kwargs,
+    )
+
 
 async def open_ifs_forecast(
     vis_param: IfsDataParameter | None = IfsDataParameter.tp,
@@ -41,26 +81,19 @@ async def open_ifs_forecast(
     )
     maps_exist = [file_path.exists() for file_path in maps_path]
     if not all(maps_exist if len(maps_path) == 1 else maps_exist[:-1]):
-        data_store = get_data_store_path(source=source)
-        try:
-            data = load_open_ifs_data(
-                key=vis_param.name,
-                forecast_init_date=data_date_obj,
-                data_dir=str(data_store),
-                mask_region=mask_area,
-                status_updates=False,
-                cgan_ui_fs=True,
-            )
-        except Exception:
-            return []
-        plot_open_ifs_forecast(
-            data=data,
+        rendered = await single_flight_render(
+            file_path=maps_path[-1],
+            render=render_open_ifs_map,
+            plot_type="forecast",
+            vis_param=vis_param,
+            init_date=data_date_obj,
+            mask_area=mask_area,
             style=MapColorScheme.icpac if color_style is None else color_style.value,
             plot_units=plot_units.value,
-            region=mask_area,
             file_name=str(maps_path[-1]),
-            show_plot=False,
         )
+        if not rendered:
+            return []
     return maps_path
 
 
@@ -92,24 +125,17 @@ async def open_ifs_forecast_ensemble(
         ensemble=True,
     )
     if not maps_path[0].exists():
-        data_store = get_data_store_path(source=source)
-        try:
-            data = load_open_ifs_data(
-                key=vis_param.name,
-                forecast_init_date=data_date_obj,
-                data_dir=str(data_store),
-                mask_region=mask_area,
-                status_updates=False,
-                cgan_ui_fs=True,
-            )
-        except Exception:
-            return []
-        plot_ifs_forecast_ensemble(
-            data=data,
+        rendered = await single_flight_render(
+            file_path=maps_path[-1],
+            render=render_open_ifs_map,
+            plot_type="ensemble",
+            vis_param=vis_param,
+            init_date=data_date_obj,
+            mask_area=mask_area,
             style=MapColorScheme.icpac if color_style is None else color_style.value,
             plot_units=plot_units.value,
-            region=mask_area,
             file_name=str(maps_path[-1]),
-            show_plot=False,
         )
+        if not rendered:
+            return []
     return maps_path
@@ -0,0 +1,15 @@
+from pathlib import Path
+
+import pytest
+
+from fastcgan.tools.config import settings
+
+
+@pytest.fixture
+def data_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    # forecasts, jobs data and the catalog of a test live in its temporary directory
+    monkeypatch.setitem(settings.ASSETS_DIR_MAP, "forecasts", str(tmp_path / "forecasts"))
+    monkeypatch.setitem(settings.ASSETS_DIR_MAP, "jobs", str(tmp_path / "jobs"))
+    monkeypatch.setattr(settings, "FORECASTS_CATALOG_FILE", str(tmp_path / "forecasts" / "forecasts-catalog.sqlite"))
+    monkeypatch.setenv("LOGS_DIR", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,78 @@
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from fastcgan.jobs import backfill
+from fastcgan.jobs.catalog import register_forecast_file
+from fastcgan.jobs.status import acquire_task_lease
+
+
+def register_open_ifs_forecast(data_store: Path, date_str: str) -> None:
+    file_path = data_store / "forecasts" / "open-ifs" / "East Africa" / date_str[:4] / date_str[4:6]
+    file_path.mkdir(parents=True, exist_ok=True)
+    file_path = file_path / f"east_africa-open_ifs-{date_str}000000-30h-enfo-ef.nc"
+    file_path.touch()
+    register_forecast_file(file_path=file_path, source="open-ifs")
+
+
+def test_backfill_task_without_outputs_fails(data_store: Path, monkeypatch: pytest.MonkeyPatch):
+    # the scheduled post-processing consumed the downloads before the convert task ran
+    monkeypatch.setattr(backfill, "convert_forecast_inputs", lambda **kwargs: None)
+    with pytest.raises(RuntimeError, match="produced no forecasts"):
+        backfill.run_backfill_task("convert:open-ifs:20240105", country_names=[], force=False)
+
+
+def run_in_thread(target: Callable[[], bool]) -> bool:
+    # another job, which owns its leases, runs in another thread
+    admitted = []
+    job = threading.Thread(target=lambda: admitted.append(target()))
+    job.start()
+    job.join()
+    return admitted[0]
+
+
+def test_backfill_task_excludes_scheduled_jobs_but_not_other_dates(data_store: Path, monkeypatch: pytest.MonkeyPatch):
+    admitted = {}
+
+    def convert_forecast_inputs(source: str, date_str: str, country_names: list[str]) -> None:
+        admitted["scheduled"] = run_in_thread(lambda: acquire_task_lease(sync_type="processing", source=source))
+        admitted["other date"] = run_in_thread(lambda: acquire_task_lease(sync_type="processing", source=f"{source}:20240106"))
+        register_open_ifs_forecast(data_store, date_str)
+
+    monkeypatch.setattr(backfill, "convert_forecast_inputs", convert_forecast_inputs)
+    backfill.run_backfill_task("convert:open-ifs:20240105", country_names=[], force=False)
+    assert admitted == {"scheduled": False, "other date": True}
+
+
+def test_backfill_download_excludes_the_scheduled_sync(data_store: Path, monkeypatch: pytest.MonkeyPatch):
+    admitted = {}
+
+    def download_forecast_inputs(source: str, date_str: str) -> None:
+        # the scheduled jurre-brishti-ens sync writes the same cgan-ifs-6h-ens downloads
+        admitted["download"] = run_in_thread(lambda: acquire_task_lease(sync_type="download", source="jurre-brishti-ens"))
+        admitted["processing"] = run_in_thread(lambda: acquire_task_lease(sync_type="processing", source=source))
+        file_path = data_store / "jobs" / source / f"IFS_{date_str}_00Z.nc"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.touch()
+
+    monkeypatch.setattr(backfill, "download_forecast_inputs", download_forecast_inputs)
+    backfill.run_backfill_task("download:cgan-ifs-6h-ens:20240105", country_names=[], force=False)
+    assert admitted == {"download": False, "processing": True}
+
+
+def test_backfill_graph_does_not_checkpoint_tasks_without_outputs(data_store: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(backfill, "download_forecast_inputs", lambda **kwargs: register_open_ifs_forecast(data_store, "20240105"))
+    monkeypatch.setattr(backfill, "convert_forecast_inputs", lambda **kwargs: None)
+    graph = backfill.build_backfill_graph(["open-ifs"], backfill.date(2024, 1, 5), backfill.date(2024, 1, 6))
+    checkpoint_file = data_store / "checkpoint.json"
+    completed, failed = backfill.run_backfill_graph(
+        graph,
+        lambda key: backfill.run_backfill_task(key, country_names=[], force=False),
+        checkpoint_file,
+        max_workers=2,
+    )
+    # the forecasts of 2024-01-05 exist. nothing was produced for 2024-01-06
+    assert (completed, failed) == (1, 1)
+    assert backfill.load_checkpoint(checkpoint_file) == {"download:open-ifs:20240105", "convert:open-ifs:20240105"}
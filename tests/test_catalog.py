@@ -0,0 +1,52 @@
+import threading
+from pathlib import Path
+
+from fastcgan.jobs.catalog import get_catalog_forecasts, index_source_files
+
+SOURCE = "jurre-brishti-count"
+
+
+def make_counts_files(data_store: Path, valid_times: list[int]) -> list[Path]:
+    month_dir = data_store / "forecasts" / SOURCE / "2024" / "01"
+    month_dir.mkdir(parents=True, exist_ok=True)
+    file_paths = [month_dir / f"counts_20240105_00_{valid_time}h.nc" for valid_time in valid_times]
+    for file_path in file_paths:
+        file_path.touch()
+    return file_paths
+
+
+def test_index_source_files_replaces_the_source_entries(data_store: Path):
+    file_paths = make_counts_files(data_store, [30, 36, 42])
+    assert index_source_files(source=SOURCE) == 3
+    file_paths[0].unlink()
+    assert index_source_files(source=SOURCE) == 2
+    assert sorted(get_catalog_forecasts(source=SOURCE)) == [("20240105", 0, 36), ("20240105", 0, 42)]
+
+
+def test_index_source_files_without_force_keeps_indexed_sources(data_store: Path):
+    file_paths = make_counts_files(data_store, [30, 36])
+    assert index_source_files(source=SOURCE, force=False) == 2
+    file_paths[0].unlink()
+    assert index_source_files(source=SOURCE, force=False) == 0
+    assert len(get_catalog_forecasts(source=SOURCE)) == 2
+
+
+def test_readers_never_see_a_partial_reindex(data_store: Path):
+    make_counts_files(data_store, list(range(6, 300, 6)))
+    index_source_files(source=SOURCE)
+    done = threading.Event()
+    sizes = []
+
+    def read_catalog() -> None:
+        while not done.is_set():
+            sizes.append(len(get_catalog_forecasts(source=SOURCE)))
+
+    reader = threading.Thread(target=read_catalog)
+    reader.start()
+    try:
+        for _ in range(20):
+            index_source_files(source=SOURCE)
+    finally:
+        done.set()
+        reader.join()
+    assert len(sizes) and set(sizes) == {49}
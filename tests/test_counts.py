@@ -0,0 +1,141 @@
+from pathlib import Path
+from time import perf_counter
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from fastcgan.jobs.catalog import get_catalog_forecasts
+from fastcgan.jobs.counts import BIN_SPEC_1H, benchmark_counts_compression, bin_ensemble_counts, make_cgan_forecast_counts
+
+
+def histogram_loop_counts(ensemble: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    # the per pixel np.histogram loop that bin_ensemble_counts replaced
+    counts = np.zeros((*ensemble.shape[1:], len(bin_edges) - 1), dtype=int)
+    for index in np.ndindex(*ensemble.shape[1:]):
+        counts[index], _ = np.histogram(ensemble[(slice(None), *index)], bin_edges)
+    return counts
+
+
+def make_ensemble(rng: np.random.Generator, shape: tuple[int, ...], dtype: type) -> np.ndarray:
+    ensemble = rng.gamma(shape=0.5, scale=4.0, size=shape).astype(dtype)
+    flat = ensemble.reshape(-1)
+    positions = rng.permutation(flat.size)
+    picks = np.array_split(positions[: flat.size // 5], 5)
+    flat[picks[0]] = np.nan
+    # values exactly on bin edges, including the first and the closed last edge
+    flat[picks[1]] = rng.choice(BIN_SPEC_1H, size=len(picks[1])).astype(dtype)
+    # out of range values below the first and above the last edge
+    flat[picks[2]] = -rng.uniform(0.001, 5, size=len(picks[2])).astype(dtype)
+    flat[picks[3]] = rng.uniform(1000.5, 5000, size=len(picks[3])).astype(dtype)
+    # netCDF default fill value of float variables
+    flat[picks[4]] = nc.default_fillvals["f4"]
+    return ensemble
+
+
+def make_gan_file(file_path: Path, members: int = 5, valid_times: int = 3, stored_valid_times: int | None = None) -> np.ndarray:
+    # a small cGAN forecast file. stored_valid_times below valid_times leaves valid times without precipitation data
+    stored_valid_times = valid_times if stored_valid_times is None else stored_valid_times
+    precip = make_ensemble(np.random.default_rng(seed=members), (1, members, stored_valid_times, 4, 6), np.float32)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with nc.Dataset(file_path, "w", format="NETCDF4") as rootgrp:
+        rootgrp.createDimension("time", 1)
+        rootgrp.createDimension("member", members)
+        rootgrp.createDimension("valid_time", valid_times)
+        rootgrp.createDimension("stored_valid_time", stored_valid_times)
+        rootgrp.createDimension("latitude", 4)
+        rootgrp.createDimension("longitude", 6)
+        rootgrp.createVariable("latitude", "f4", ("latitude",))[:] = np.linspace(-1, 1, 4)
+        rootgrp.createVariable("longitude", "f4", ("longitude",))[:] = np.linspace(30, 35, 6)
+        rootgrp.createVariable("time", "f4", ("time",))[:] = [1000000]
+        rootgrp.createVariable("fcst_valid_time", "f4", ("time", "valid_time"))[:] = [1000006 + 6 * np.arange(valid_times)]
+        rootgrp.createVariable("precipitation", "f4", ("time", "member", "stored_valid_time", "latitude", "longitude"), fill_value=False)[:] = precip
+    return precip
+
+
+@pytest.mark.parametrize(
+    "shape, dtype",
+    [
+        ((1000, 3, 4), np.float32),
+        ((50, 6, 7), np.float64),
+        ((1, 5, 5), np.float32),
+        ((17, 2, 3, 4), np.float32),
+    ],
+)
+def test_bin_ensemble_counts_matches_histogram_loop(shape: tuple[int, ...], dtype: type):
+    rng = np.random.default_rng(seed=sum(shape))
+    ensemble = make_ensemble(rng, shape, dtype)
+    np.testing.assert_array_equal(bin_ensemble_counts(ensemble, BIN_SPEC_1H), histogram_loop_counts(ensemble, BIN_SPEC_1H))
+
+
+def test_bin_ensemble_counts_edge_cases():
+    ensemble = np.array([[0], [1000], [1000], [np.nan], [-0.0], [15], [1000.0001], [np.inf]], dtype=np.float64)
+    counts = bin_ensemble_counts(ensemble, BIN_SPEC_1H)
+    np.testing.assert_array_equal(counts, histogram_loop_counts(ensemble, BIN_SPEC_1H))
+    # both values on the last edge fall in the closed last bin
+    assert counts[0, -1] == 3
+    assert counts.sum() == 5
+
+
+def test_bin_ensemble_counts_all_nan():
+    ensemble = np.full((10, 2, 2), np.nan, dtype=np.float32)
+    assert not bin_ensemble_counts(ensemble, BIN_SPEC_1H).any()
+
+
+@pytest.mark.parametrize("chunk_rows", [None, 0, 3])
+def test_make_cgan_forecast_counts_registers_all_valid_times(data_store: Path, chunk_rows: int | None):
+    in_file = data_store / "jobs" / "jurre-brishti-count" / "GAN_20240105_00Z.nc"
+    precip = make_gan_file(in_file)
+    assert make_cgan_forecast_counts(date_str="20240105", hour_str="00", model_name="jurre-brishti-count", chunk_rows=chunk_rows, max_workers=2)
+    assert not in_file.exists()
+    assert sorted(get_catalog_forecasts(source="jurre-brishti-count")) == [("20240105", 0, 30), ("20240105", 0, 36), ("20240105", 0, 42)]
+    counts_file = data_store / "forecasts" / "jurre-brishti-count" / "2024" / "01" / "counts_20240105_00_36h.nc"
+    with nc.Dataset(counts_file, "r") as rootgrp:
+        counts = np.array(rootgrp["counts"][:])
+    np.testing.assert_array_equal(counts, np.moveaxis(histogram_loop_counts(precip[0, :, 1], BIN_SPEC_1H), -1, 0)[1:])
+
+
+def test_make_cgan_forecast_counts_keeps_the_forecast_of_incomplete_dates(data_store: Path, monkeypatch: pytest.MonkeyPatch):
+    # the last valid time has no precipitation data and fails on every retry
+    monkeypatch.setenv("COUNTS_RETRIES", "1")
+    in_file = data_store / "jobs" / "jurre-brishti-count" / "GAN_20240105_00Z.nc"
+    make_gan_file(in_file, valid_times=3, stored_valid_times=2)
+    assert not make_cgan_forecast_counts(date_str="20240105", hour_str="00", model_name="jurre-brishti-count", max_workers=2)
+    assert in_file.exists()
+    assert get_catalog_forecasts(source="jurre-brishti-count") == []
+    assert not list((data_store / "forecasts" / "jurre-brishti-count").rglob("counts_*.nc"))
+    # the counts are computed again from the kept forecast once it is readable
+    make_gan_file(in_file)
+    assert make_cgan_forecast_counts(date_str="20240105", hour_str="00", model_name="jurre-brishti-count", max_workers=2)
+    assert len(get_catalog_forecasts(source="jurre-brishti-count")) == 3
+
+
+def test_benchmark_counts_compression(tmp_path: Path):
+    in_file = tmp_path / "GAN_20240105_00Z.nc"
+    make_gan_file(in_file)
+    settings = [
+        {"complevel": 0, "shuffle": False, "chunksizes": None},
+        {"complevel": 4, "shuffle": True, "chunksizes": [5, 2, 3]},
+    ]
+    results = benchmark_counts_compression(in_file_name=str(in_file), valid_time_num=1, compression_settings=settings)
+    assert [{key: result[key] for key in ["complevel", "shuffle", "chunksizes"]} for result in results] == settings
+    for result in results:
+        assert result["size_kib"] > 0
+        assert result["write_seconds"] >= 0 and result["read_seconds"] >= 0
+
+
+@pytest.mark.benchmark
+def test_bin_ensemble_counts_benchmark():
+    # run with `pytest -m benchmark -s` to compare the vectorized binning with the np.histogram loop
+    ensemble = make_ensemble(np.random.default_rng(seed=0), (1000, 4, 100, 100), np.float32)
+    start = perf_counter()
+    expected = histogram_loop_counts(ensemble, BIN_SPEC_1H)
+    loop_seconds = perf_counter() - start
+    start = perf_counter()
+    counts = bin_ensemble_counts(ensemble, BIN_SPEC_1H)
+    vectorized_seconds = perf_counter() - start
+    np.testing.assert_array_equal(counts, expected)
+    print(
+        f"binned {ensemble.shape} ensemble in {vectorized_seconds:.2f}s vectorized and {loop_seconds:.2f}s with the "
+        + f"np.histogram loop. {loop_seconds / vectorized_seconds:.1f}x speedup"
+    )
@@ -0,0 +1,75 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from fastcgan.jobs import crawler
+
+ROOT = "https://data.example.org/model"
+
+
+class FakeIndexServer:
+    # directory listings that answer conditional requests with 304 while unchanged
+    def __init__(self, listings: dict[str, list[str]]):
+        self.listings = listings
+        self.fetched: list[str] = []
+
+    def get(self, url: str, headers: dict | None = None, **kwargs) -> SimpleNamespace:
+        self.fetched.append(url)
+        etag = str(hash(tuple(self.listings[url])))
+        if (headers or {}).get("If-None-Match") == etag:
+            return SimpleNamespace(status_code=304, reason="Not Modified", headers={}, text="")
+        text = "".join(f'<a href="{href}">{href}</a>' for href in self.listings[url])
+        return SimpleNamespace(status_code=200, reason="OK", headers={"ETag": etag}, text=text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return None
+
+
+@pytest.fixture
+def index_server(data_store: Path, monkeypatch: pytest.MonkeyPatch) -> FakeIndexServer:
+    server = FakeIndexServer(
+        {
+            ROOT: ["../", "2026/"],
+            f"{ROOT}/2026": ["../", "09/", "10/"],
+            f"{ROOT}/2026/09": ["../", "GAN_20260930_00Z.nc"],
+            f"{ROOT}/2026/10": ["../", "GAN_20261001_00Z.nc"],
+        }
+    )
+    monkeypatch.setattr(crawler, "make_http_session", lambda pool_size: server)
+    return server
+
+
+def crawl_at(monkeypatch: pytest.MonkeyPatch, now: float) -> set[str]:
+    monkeypatch.setattr(crawler, "time", lambda: now)
+    return crawler.crawl_dataset_links(data_pages=[ROOT], max_rate=0, refresh_days=3, max_age_hours=24)
+
+
+def test_crawl_finds_new_files_of_quiet_current_period(index_server: FakeIndexServer, monkeypatch: pytest.MonkeyPatch):
+    start = 1_800_000_000
+    assert crawl_at(monkeypatch, start) == {f"{ROOT}/2026/09/GAN_20260930_00Z.nc", f"{ROOT}/2026/10/GAN_20261001_00Z.nc"}
+    # the current month is quiet for longer than the refresh window before a new forecast lands in it.
+    # the parent listings do not change
+    crawl_at(monkeypatch, start + 4 * 86400 - 3600)
+    index_server.listings[f"{ROOT}/2026/10"].append("GAN_20261005_00Z.nc")
+    index_server.fetched.clear()
+    links = crawl_at(monkeypatch, start + 4 * 86400)
+    assert f"{ROOT}/2026/10/GAN_20261005_00Z.nc" in links
+    # the previous month is served from the manifest
+    assert f"{ROOT}/2026/09" not in index_server.fetched
+    assert f"{ROOT}/2026/09/GAN_20260930_00Z.nc" in links
+
+
+def test_crawl_refetches_listings_older_than_max_age(index_server: FakeIndexServer, monkeypatch: pytest.MonkeyPatch):
+    start = 1_800_000_000
+    crawl_at(monkeypatch, start)
+    crawl_at(monkeypatch, start + 4 * 86400)
+    index_server.fetched.clear()
+    crawl_at(monkeypatch, start + 4 * 86400 + 3600)
+    assert f"{ROOT}/2026/09" not in index_server.fetched
+    index_server.fetched.clear()
+    crawl_at(monkeypatch, start + 5 * 86400 + 60)
+    assert f"{ROOT}/2026/09" in index_server.fetched
@@ -0,0 +1,73 @@
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from fastcgan.jobs import inference
+
+FORECAST_SCRIPT = """
+import sys
+from pathlib import Path
+
+# the generator weights are loaded by every run of the script
+with Path("runs.log").open("a") as log:
+    log.write(sys.argv[-1] + "\\n")
+if sys.argv[-1].startswith("bad"):
+    sys.exit(2)
+"""
+
+FORECAST_ENTRYPOINT = """
+import sys
+from pathlib import Path
+
+# the generator weights are loaded once per worker
+with Path("loads.log").open("a") as log:
+    log.write("loaded\\n")
+
+
+def forecast(ifs_file):
+    with Path("runs.log").open("a") as log:
+        log.write(ifs_file + "\\n")
+    if ifs_file.startswith("bad"):
+        sys.exit(2)
+"""
+
+IFS_FILES = ["IFS_20240105_00Z.nc", "bad_IFS_20240106_00Z.nc", "IFS_20240107_00Z.nc"]
+
+
+@pytest.fixture
+def work_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    (tmp_path / "test_forecast.py").write_text(FORECAST_SCRIPT)
+    (tmp_path / "forecaster.py").write_text(FORECAST_ENTRYPOINT)
+    monkeypatch.setattr(inference, "get_model_work_dir", lambda model: tmp_path)
+    # docker compose passes an empty value when no entrypoint is configured
+    monkeypatch.setenv("CGAN_INFERENCE_ENTRYPOINT", "")
+    # the inference workers import fastcgan from the checkout
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(Path(__file__).parents[1]), os.getenv("PYTHONPATH", "")]))
+    return tmp_path
+
+
+@pytest.mark.parametrize("max_workers", [0, 1, 2])
+def test_run_cgan_inference_runs_the_script_per_file_by_default(work_dir: Path, max_workers: int):
+    results = dict(inference.run_cgan_inference(model="jurre-brishti-ens", ifs_files=IFS_FILES, max_workers=max_workers))
+    assert results == {"IFS_20240105_00Z.nc": 0, "bad_IFS_20240106_00Z.nc": 2, "IFS_20240107_00Z.nc": 0}
+    assert sorted((work_dir / "runs.log").read_text().split()) == sorted(IFS_FILES)
+
+
+def test_run_cgan_inference_loads_the_entrypoint_once_per_worker(work_dir: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("CGAN_INFERENCE_ENTRYPOINT", "forecaster:forecast")
+    results = dict(inference.run_cgan_inference(model="jurre-brishti-ens", ifs_files=IFS_FILES, max_workers=1))
+    assert results == {"IFS_20240105_00Z.nc": 0, "bad_IFS_20240106_00Z.nc": 2, "IFS_20240107_00Z.nc": 0}
+    assert (work_dir / "loads.log").read_text().split() == ["loaded"]
+    assert (work_dir / "runs.log").read_text().split() == IFS_FILES
+
+
+def test_closing_run_cgan_inference_stops_the_workers(work_dir: Path):
+    threads = threading.active_count()
+    results = inference.run_cgan_inference(model="jurre-brishti-ens", ifs_files=IFS_FILES, max_workers=1)
+    assert next(results) == ("IFS_20240105_00Z.nc", 0)
+    results.close()
+    # the file in flight completes. no file is started after the consumer stopped
+    assert threading.active_count() == threads
+    assert len((work_dir / "runs.log").read_text().split()) < len(IFS_FILES)
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+
+from fastcgan.utils.render import plot_to_file
+
+
+def test_plot_to_file_renames_the_map_into_place(tmp_path: Path):
+    target = tmp_path / "map.png"
+    written = []
+
+    def plot(file_name: str, **kwargs) -> None:
+        # the map is never written into the served file directly
+        assert not target.exists() and file_name.endswith(".png")
+        written.append(file_name)
+        Path(file_name).write_bytes(b"map")
+
+    assert plot_to_file(plot, file_name=str(target), region="Kenya")
+    assert target.read_bytes() == b"map"
+    assert [path.name for path in tmp_path.iterdir()] == ["map.png"]
+    assert written[0] != str(target)
+
+
+def test_plot_to_file_leaves_no_partial_map(tmp_path: Path):
+    target = tmp_path / "map.png"
+
+    def plot(file_name: str, **kwargs) -> None:
+        Path(file_name).write_bytes(b"partial")
+        raise RuntimeError("plotting failed")
+
+    with pytest.raises(RuntimeError):
+        plot_to_file(plot, file_name=str(target))
+    assert not plot_to_file(lambda file_name: None, file_name=str(target))
+    assert list(tmp_path.iterdir()) == []
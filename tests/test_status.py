@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+from fastcgan.jobs.status import acquire_task_lease, is_task_active, release_task_lease
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "file"])
+def test_task_leases(data_store: Path, monkeypatch: pytest.MonkeyPatch, backend: str):
+    monkeypatch.setenv("STATUS_BACKEND", backend)
+    assert acquire_task_lease(sync_type="processing", source="open-ifs")
+    assert acquire_task_lease(sync_type="download", source="open-ifs")
+    other_thread_admitted = []
+    other_thread = threading.Thread(target=lambda: other_thread_admitted.append(acquire_task_lease(sync_type="processing", source="open-ifs")))
+    other_thread.start()
+    other_thread.join()
+    assert other_thread_admitted == [False]
+    release_task_lease(sync_type="processing", source="open-ifs")
+    assert not is_task_active(sync_type="processing")
+    assert is_task_active(sync_type="download", source="open-ifs")
+    release_task_lease(sync_type="download", source="open-ifs")
+    assert not is_task_active(sync_type="download")
+
+
+def test_is_task_active_reads_without_the_write_lock(data_store: Path):
+    assert acquire_task_lease(sync_type="processing", source="open-ifs")
+    with closing(sqlite3.connect(data_store / "data-sync-tasks-status.sqlite", timeout=0, isolation_level=None)) as conn:
+        # another job holds the write lock of the status store
+        conn.execute("BEGIN IMMEDIATE")
+        assert is_task_active(sync_type="processing", source="open-ifs")
+        conn.execute("ROLLBACK")
+
+
+def test_release_only_writes_its_own_lease(data_store: Path):
+    assert acquire_task_lease(sync_type="processing", source="open-ifs")
+    assert acquire_task_lease(sync_type="processing", source="cgan-ifs-6h-ens")
+    with closing(sqlite3.connect(data_store / "data-sync-tasks-status.sqlite", isolation_level=None)) as conn:
+        rowids = dict(conn.execute("SELECT source, rowid FROM task_leases"))
+        release_task_lease(sync_type="processing", source="open-ifs")
+        # the other lease is left in place rather than deleted and inserted again
+        assert dict(conn.execute("SELECT source, rowid FROM task_leases")) == {"cgan-ifs-6h-ens": rowids["cgan-ifs-6h-ens"]}
+
+
+def test_scoped_leases_exclude_their_source_lease(data_store: Path):
+    assert acquire_task_lease(sync_type="processing", source="open-ifs:20240105")
+
+    def acquire_in_other_job(source: str) -> bool:
+        admitted = []
+        job = threading.Thread(target=lambda: admitted.append(acquire_task_lease(sync_type="processing", source=source)))
+        job.start()
+        job.join()
+        return admitted[0]
+
+    assert not acquire_in_other_job("open-ifs")
+    assert acquire_in_other_job("open-ifs:20240106")
+    assert acquire_in_other_job("open-ifs-2")
+    # the source lease is only taken once no other job holds one of its scopes
+    assert not acquire_task_lease(sync_type="processing", source="open-ifs")
+    release_task_lease(sync_type="processing", source="open-ifs:20240106", force=True)
+    assert acquire_task_lease(sync_type="processing", source="open-ifs")
@@ -0,0 +1,53 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+from show_forecasts.constants import COUNTRY_NAMES
+
+from fastcgan.jobs import utils
+from fastcgan.jobs.catalog import get_catalog_forecasts
+from fastcgan.jobs.utils import get_country_bbox, get_dataset_file_path, get_forecast_view, save_country_slices, slice_dataset_by_bbox
+from fastcgan.tools.config import settings
+
+
+def make_region_dataset(descending_latitude: bool) -> xr.Dataset:
+    latitude = np.arange(-12, 24.01, 0.25)
+    latitude = latitude[::-1] if descending_latitude else latitude
+    longitude = np.arange(20, 52.01, 0.25)
+    return xr.Dataset(
+        {"tp": (("member", "latitude", "longitude"), np.random.default_rng(0).random((3, len(latitude), len(longitude))))},
+        coords={"latitude": latitude, "longitude": longitude},
+    )
+
+
+@pytest.mark.parametrize("descending_latitude", [False, True])
+def test_get_forecast_view_windows_the_parent_region(monkeypatch: pytest.MonkeyPatch, descending_latitude: bool):
+    monkeypatch.setattr(settings, "FORECASTS_STORE_FORMAT", "chunked")
+    ds = make_region_dataset(descending_latitude)
+    for country_name in COUNTRY_NAMES[1:3]:
+        view = get_forecast_view(data=ds, source="open-ifs", mask_region=country_name)
+        xr.testing.assert_identical(view, slice_dataset_by_bbox(ds, get_country_bbox(country_name)))
+    assert get_forecast_view(data=ds, source="open-ifs", mask_region=COUNTRY_NAMES[0]) is ds
+
+
+def test_get_forecast_view_keeps_country_files_of_the_netcdf_store(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "FORECASTS_STORE_FORMAT", "netcdf")
+    ds = make_region_dataset(False)
+    assert get_forecast_view(data=ds, source="open-ifs", mask_region=COUNTRY_NAMES[1]) is ds
+
+
+def test_save_country_slices_with_one_writer_stays_in_process(data_store: Path, monkeypatch: pytest.MonkeyPatch):
+    # grib2 step workers write their slices themselves rather than through a process pool of their own
+    monkeypatch.setattr(utils, "ProcessPoolExecutor", None)
+    ds = make_region_dataset(False)
+    data_date = datetime(2024, 1, 5)
+    file_name = "20240105000000-30h-enfo-ef.nc"
+    errors = save_country_slices(ds=ds, source="open-ifs", data_date=data_date, file_name=file_name, country_names=COUNTRY_NAMES[1:3], max_workers=1)
+    assert errors == []
+    for country_name in COUNTRY_NAMES[1:3]:
+        slice_file = get_dataset_file_path(source="open-ifs", data_date=data_date, file_name=file_name, mask_region=country_name)
+        with xr.open_dataset(slice_file) as slice_ds:
+            xr.testing.assert_allclose(slice_ds, slice_dataset_by_bbox(ds, get_country_bbox(country_name)))
+    assert len(get_catalog_forecasts(source="open-ifs")) > 0